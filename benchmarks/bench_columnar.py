@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+#
+# The object backend against the columnar backend (--backend).
+#
+'''
+   Usage: bench_columnar.py [-n LINES] [--limit N] [-d DAYS]
+                            [--only-types TYPES] [--repeat N]
+
+   Queries the same synthetic todo file with each backend, from warm
+   caches: loading, filtering, sorting and building the items shown
+   (not rendering them). Checks the results are the same and prints
+   the times. The columnar times are with NumPy if it is installed.
+'''
+
+import os, sys, optparse, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import rastodo
+import synthtodo
+
+
+def timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return (best, [rastodo.itemRecord(i) for i in result])
+
+
+def main():
+    optparser = optparse.OptionParser()
+    optparser.add_option('-n', '--lines', type='int', default=1000000)
+    optparser.add_option('--limit', type='int', help='Only the N most urgent items')
+    optparser.add_option('-d', '--days', type='int', default=22)
+    optparser.add_option('--only-types', default='tsacwr')
+    optparser.add_option('--repeat', type='int', default=3)
+    (opts, args) = optparser.parse_args()
+
+    settings = rastodo.filter_settings
+    settings.days_cutoff = opts.days
+    settings.only_types = opts.only_types
+    cliopts = rastodo.makeOptionParser().parse_args(['--no-daemon'])[0]
+    cliopts.limit = opts.limit
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        rastodo.settings['paths']['cachedir'] = tmpdir
+        path = os.path.join(tmpdir, 'bench.todo')
+        synthtodo.writeTodoFile(path, opts.lines)
+
+        def query(backend):
+            cliopts.backend = backend
+            return rastodo.queryTodoItems(cliopts, path)[0]
+
+        results = []
+        print('%d lines, NumPy %s' % (opts.lines, 'used' if rastodo.importNumpy() else 'not installed'))
+        for backend in rastodo.BACKENDS:
+            query(backend)  # fill the caches
+            (elapsed, records) = timed(lambda: query(backend), opts.repeat)
+            results.append(records)
+            print('%-10s %8.3fs %8d items' % (backend, elapsed, len(records)))
+        if any(records != results[0] for records in results):
+            print('MISMATCH between results')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+#
+# Memory used by the loaded TodoItems (tracemalloc).
+#
+'''
+   Usage: bench_memory.py [-n LINES]
+
+   Parses a synthetic todo file and measures the memory held by the
+   items, then the same items in the old representation: a plain
+   object with a __dict__ and the date and days away stored on each
+   item.
+'''
+
+import os, sys, optparse, tempfile, tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import rastodo
+import synthtodo
+
+
+class DictTodoItem(object):
+    '''TodoItem as it was before __slots__'''
+    def __init__(self, item):
+        self.type = item.type
+        self.linenum = item.linenum
+        self.desc = item.desc
+        self.category = item.category
+        self.date = item.date
+        self.wake = item.wake
+        self.days = item.days  # a new int object unless it is small
+        self.recur = item.recur
+        self.recurrence = item.recurrence
+
+
+def measure(build):
+    '''Returns (result, bytes still allocated after build())'''
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    result = build()
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return (result, used)
+
+
+def main():
+    optparser = optparse.OptionParser()
+    optparser.add_option('-n', '--lines', type='int', default=1000000)
+    (opts, args) = optparser.parse_args()
+
+    with tempfile.NamedTemporaryFile('w', suffix='.todo') as tmp:
+        synthtodo.writeTodoFile(tmp.name, opts.lines)
+
+        def load():
+            with open(tmp.name) as f:
+                return rastodo.readTodoItems(f)[0]
+        load()  # warm the date memos so they are not counted
+
+        def old():
+            return [DictTodoItem(item) for item in load()]
+        (olditems, oldbytes) = measure(old)
+        del olditems
+
+        (newitems, newbytes) = measure(load)
+        count = len(newitems)
+
+    print('%d lines, %d items' % (opts.lines, count))
+    for (name, used) in (('__dict__', oldbytes), ('__slots__', newbytes)):
+        print('%-10s %8.1f MB %6.1f bytes/item' % (name, used / 1e6, used / count))
+    print('saved      %8.1f%%' % (100 - 100.0 * newbytes / oldbytes))
+
+
+if __name__ == '__main__':
+    main()
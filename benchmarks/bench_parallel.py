@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+#
+# Speedup of parallel parsing (--jobs) against the number of processes.
+#
+'''
+   Usage: bench_parallel.py [-n LINES] [--max-jobs N]
+
+   Parses the same synthetic todo file serially and with
+   rastodo.parseParallel for 2..N processes, checks the results are
+   identical and prints the time and speedup for each.
+'''
+
+import os, sys, optparse, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import rastodo
+import synthtodo
+
+
+def records(result):
+    (items, errors) = result
+    return ([rastodo.itemRecord(i) for i in items], errors)
+
+
+def main():
+    optparser = optparse.OptionParser()
+    optparser.add_option('-n', '--lines', type='int', default=2000000)
+    optparser.add_option('--max-jobs', type='int', default=os.cpu_count() or 1)
+    (opts, args) = optparser.parse_args()
+
+    with tempfile.NamedTemporaryFile('w', suffix='.todo') as tmp:
+        synthtodo.writeTodoFile(tmp.name, opts.lines)
+        with open(tmp.name, 'rb') as f:
+            data = f.read()
+
+        start = time.perf_counter()
+        with open(tmp.name) as f:
+            serial = rastodo.readTodoItems(f)
+        base = time.perf_counter() - start
+        expected = records(serial)
+        del serial
+        print('%d lines, %d cpus' % (opts.lines, os.cpu_count() or 1))
+        print('serial  %8.2fs' % base)
+
+        for jobs in range(2, max(opts.max_jobs, 2) + 1):
+            start = time.perf_counter()
+            result = rastodo.parseParallel(data, jobs=jobs)
+            elapsed = time.perf_counter() - start
+            same = records(result) == expected
+            print('jobs %2d %8.2fs  %5.2fx%s' %
+                  (jobs, elapsed, base / elapsed, '' if same else '  MISMATCH'))
+
+
+if __name__ == '__main__':
+    main()
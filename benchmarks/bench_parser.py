@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+#
+# Compares the line parser engines on the same synthetic todo file.
+#
+'''
+   Usage: bench_parser.py [-n LINES] [--repeat N]
+
+   Prints lines/sec for each of rastodo.PARSER_ENGINES.
+'''
+
+import os, sys, optparse, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import rastodo
+import synthtodo
+
+
+def parseAll(lines, parseLine):
+    '''Same loop as parseTodoFile, without the filtering'''
+    category = None
+    count = 0
+    for num, line in enumerate(lines, 1):
+        if line == "" or line.isspace() or line[0] == '#':
+            continue
+        if line[0] == '[':
+            category = line.lstrip('[').rstrip(']\n')
+        elif parseLine(line, num, category) is not None:
+            count += 1
+    return count
+
+
+def main():
+    optparser = optparse.OptionParser()
+    optparser.add_option('-n', '--lines', type='int', default=200000)
+    optparser.add_option('--repeat', type='int', default=3)
+    (opts, args) = optparser.parse_args()
+
+    with tempfile.NamedTemporaryFile('w', suffix='.todo') as tmp:
+        synthtodo.writeTodoFile(tmp.name, opts.lines)
+        with open(tmp.name) as f:
+            lines = f.readlines()
+
+    for name, parseLine in sorted(rastodo.PARSER_ENGINES.items()):
+        best = None
+        for _ in range(opts.repeat):
+            start = time.perf_counter()
+            items = parseAll(lines, parseLine)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print('%-8s %9d items %12.0f lines/sec' %
+              (name, items, len(lines) / best))
+
+
+if __name__ == '__main__':
+    main()
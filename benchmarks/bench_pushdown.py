@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+#
+# Filtering after parsing against pushing the filters down into it.
+#
+'''
+   Usage: bench_pushdown.py [-n LINES] [-d DAYS] [--only-types TYPES]
+                            [--ex-cat CATS]
+
+   Loads the same synthetic todo file with the given filters, both
+   parsing everything and then filtering with todoInclude, and with a
+   FilterPushdown; with and without the parsed file cache. Checks the
+   results are the same and prints the times.
+'''
+
+import os, sys, optparse, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import rastodo
+import synthtodo
+
+
+def timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return (best, [rastodo.itemRecord(i) for i in result])
+
+
+def main():
+    optparser = optparse.OptionParser()
+    optparser.add_option('-n', '--lines', type='int', default=500000)
+    optparser.add_option('-d', '--days', type='int', default=22)
+    optparser.add_option('--only-types', default='tsacwr')
+    optparser.add_option('--ex-cat', default='category 1,category 2,category 3',
+                         help='comma delimited; the generator numbers categories from 1')
+    optparser.add_option('--repeat', type='int', default=3)
+    (opts, args) = optparser.parse_args()
+
+    settings = rastodo.filter_settings
+    settings.days_cutoff = opts.days
+    settings.only_types = opts.only_types
+    settings.exclude_categories = opts.ex_cat.split(',') if opts.ex_cat else None
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        rastodo.settings['paths']['cachedir'] = tmpdir
+        path = os.path.join(tmpdir, 'bench.todo')
+        synthtodo.writeTodoFile(path, opts.lines)
+
+        def afterwards(usecache):
+            (items, errors) = rastodo.loadTodoFile(path, usecache=usecache)
+            return [item for item in items if rastodo.todoInclude(item)]
+
+        def pushdown(usecache):
+            return rastodo.loadTodoFile(path, usecache=usecache,
+                                        pushdown=rastodo.pushdownFilter())[0]
+
+        rastodo.loadTodoFile(path)  # fill the cache
+        results = []
+        for (name, func) in (('filter after parse', lambda: afterwards(False)),
+                             ('pushdown',           lambda: pushdown(False)),
+                             ('filter after cache', lambda: afterwards(True)),
+                             ('pushdown cache',     lambda: pushdown(True))):
+            (elapsed, records) = timed(func, opts.repeat)
+            results.append(records)
+            print('%-20s %8.3fs %8d items' % (name, elapsed, len(records)))
+        if any(records != results[0] for records in results):
+            print('MISMATCH between results')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/python3
+#
+# Throughput and peak RSS of the file readers (--reader).
+#
+'''
+   Usage: bench_reader.py [-n LINES] [--comments FRACTION]
+
+   Parses the same synthetic todo file with each of rastodo.READERS,
+   each in a fresh process so the peak RSS is its own, and prints
+   lines/sec, MB/sec and peak RSS. Archive files with lots of comments
+   can be simulated with --comments.
+'''
+
+import os, sys, json, optparse, resource, subprocess, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import rastodo
+import synthtodo
+
+
+def child(reader, path):
+    '''Runs in the subprocess: parse and report as JSON on stdout'''
+    start = time.perf_counter()
+    (items, errors) = rastodo.loadTodoFile(path, usecache=False, reader=reader)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KB on Linux, bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        maxrss //= 1024
+    print(json.dumps({'items': len(items), 'seconds': elapsed, 'maxrss_kb': maxrss}))
+
+
+def main():
+    optparser = optparse.OptionParser()
+    optparser.add_option('-n', '--lines', type='int', default=1000000)
+    optparser.add_option('--comments', type='float', default=0.06)
+    optparser.add_option('--child', nargs=2, help=optparse.SUPPRESS_HELP)
+    (opts, args) = optparser.parse_args()
+    if opts.child:
+        return child(*opts.child)
+
+    with tempfile.NamedTemporaryFile('w', suffix='.todo') as tmp:
+        synthtodo.writeTodoFile(tmp.name, opts.lines, comments=opts.comments)
+        size = os.path.getsize(tmp.name)
+        print('%d lines, %.1f MB, %d%% comments' %
+              (opts.lines, size / 1e6, opts.comments * 100))
+        for reader in rastodo.READERS:
+            out = subprocess.check_output([sys.executable, __file__,
+                                           '--child', reader, tmp.name])
+            result = json.loads(out)
+            print('%-5s %9d items %12.0f lines/sec %7.1f MB/sec %8.1f MB peak RSS' %
+                  (reader, result['items'], opts.lines / result['seconds'],
+                   size / 1e6 / result['seconds'], result['maxrss_kb'] / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+#
+# Benchmark suite: times the main stages of rastodo on a seeded
+# synthetic todo file and writes the results as JSON.
+#
+'''
+   Usage: suite.py [-n LINES] [--repeat N] [-o RESULTS.json]
+                   [--compare OLD.json] [--threshold FRACTION]
+                   [generator options, see synthtodo.py]
+
+   Runs each benchmark --repeat times and keeps the best time:
+
+     parseTodoLine    every todo line, with the table parser
+     parseTodoFile    the whole file, as the main block used to load it
+     loadTodoFile     the whole file from the parsed file cache
+     todoInclude      the default filters over all the items
+     sort             sorting the included items by days away
+     prettyPrintStr   rendering the included items one at a time
+     TodoRenderer     rendering them as a batch, as the terminal output does
+
+   With --compare, each time is checked against the same benchmark in
+   an earlier results file and the run fails (exit status 1) if any is
+   slower by more than --threshold. Compare runs with the same options
+   on the same machine.
+'''
+
+import os, sys, io, json, optparse, platform, subprocess, tempfile, time
+import contextlib, datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import rastodo
+import synthtodo
+
+
+def best(func, repeat):
+    '''Returns the fastest of repeat calls to func in seconds'''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def gitCommit():
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=here,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def runSuite(path, repeat):
+    '''Returns {benchmark: {'seconds': best time, 'count': things
+       processed, 'per_sec': count / seconds}} for the todo file'''
+    with open(path) as f:
+        lines = f.readlines()
+    todolines = []
+    category = None
+    for (num, line) in enumerate(lines, 1):
+        if line == "" or line.isspace() or line[0] == '#':
+            continue
+        if line[0] == '[':
+            category = line.lstrip('[').rstrip(']\n')
+        else:
+            todolines.append((line, num, category))
+
+    with open(path) as f:
+        (items, errors) = rastodo.readTodoItems(f)
+    included = [item for item in items if rastodo.todoInclude(item)]
+
+    def parseLines():
+        parseTodoLine = rastodo.parseTodoLine
+        for (line, num, category) in todolines:
+            parseTodoLine(line, num, category)
+
+    def parseFile():
+        # parseTodoFile prints the syntax errors
+        with open(path) as f, contextlib.redirect_stdout(io.StringIO()):
+            rastodo.parseTodoFile(f)
+
+    def loadCached():
+        rastodo.loadTodoFile(path)
+
+    def include():
+        todoInclude = rastodo.todoInclude
+        for item in items:
+            todoInclude(item)
+
+    def sort():
+        sorted(included, key=lambda x: x.daysAway(), reverse=True)
+
+    def render():
+        for item in included:
+            item.prettyPrintStr()
+
+    def renderBatch():
+        rastodo.TodoRenderer().lines(included)
+
+    rastodo.loadTodoFile(path)  # fill the cache
+    results = {}
+    for (name, func, count) in (('parseTodoLine', parseLines, len(todolines)),
+                                ('parseTodoFile', parseFile, len(lines)),
+                                ('loadTodoFile', loadCached, len(items)),
+                                ('todoInclude', include, len(items)),
+                                ('sort', sort, len(included)),
+                                ('prettyPrintStr', render, len(included)),
+                                ('TodoRenderer', renderBatch, len(included))):
+        seconds = best(func, repeat)
+        results[name] = {'seconds': seconds, 'count': count,
+                         'per_sec': count / seconds if seconds else None}
+    return results
+
+
+def compare(results, old, threshold):
+    '''Prints each benchmark against the old results; returns the
+       names of the ones slower by more than threshold'''
+    slower = []
+    for (name, result) in results.items():
+        if name not in old:
+            continue
+        ratio = result['seconds'] / old[name]['seconds']
+        flag = ''
+        if ratio > 1 + threshold:
+            slower.append(name)
+            flag = '  REGRESSION'
+        print('%-16s %9.4fs -> %9.4fs %6.2fx%s' %
+              (name, old[name]['seconds'], result['seconds'], ratio, flag))
+    return slower
+
+
+def main():
+    optparser = optparse.OptionParser()
+    optparser.add_option('-n', '--lines', type='int', default=100000)
+    optparser.add_option('--repeat', type='int', default=5)
+    optparser.add_option('-o', '--output', help='Write the results to this JSON file')
+    optparser.add_option('--compare', help='Earlier results JSON file to compare against')
+    optparser.add_option('--threshold', type='float', default=0.10,
+                         help='Slowdown flagged as a regression (default 0.10)')
+    synthtodo.addOptions(optparser)
+    (opts, args) = optparser.parse_args()
+
+    generator = synthtodo.generatorOptions(opts)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        rastodo.settings['paths']['cachedir'] = tmpdir
+        path = os.path.join(tmpdir, 'bench.todo')
+        synthtodo.writeTodoFile(path, opts.lines, **generator)
+        results = runSuite(path, opts.repeat)
+
+    report = {
+        'meta': {
+            'commit': gitCommit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'lines': opts.lines,
+            'repeat': opts.repeat,
+            'generator': generator,
+        },
+        'results': results,
+    }
+    for (name, result) in results.items():
+        print('%-16s %9.4fs %10d %12.0f/sec' %
+              (name, result['seconds'], result['count'], result['per_sec'] or 0))
+    if opts.output:
+        with open(opts.output, 'w') as out:
+            json.dump(report, out, indent=1, sort_keys=True)
+            out.write('\n')
+
+    if opts.compare:
+        with open(opts.compare) as f:
+            old = json.load(f)
+        if old['meta']['lines'] != opts.lines or old['meta']['generator'] != generator:
+            print('warning: %s was run with different options' % opts.compare)
+        if compare(results, old['results'], opts.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+#
+# Synthetic .todo file generator for the rastodo benchmarks.
+#
+'''
+   Writes a synthetic todo file modelled on sample.todo.
+
+   Usage: synthtodo.py [-n LINES] [--seed SEED] [--types TYPES]
+                       [--categories N] [--comments FRACTION]
+                       [--malformed FRACTION] OUTFILE
+
+   The same options and seed always give the same file (for a given
+   date, as the item dates are around today).
+'''
+
+import datetime, optparse, random
+
+DESCS = ('lab report', 'assignment due', 'do backups', 'birthday',
+         'appointment with lecturer about project', 'fix something soon',
+         'fix something whenever', 'pay the rent', 'renew registration')
+
+# Lines with syntax errors, as typos in a real file would be
+MALFORMED = ('t  2014-13-45 impossible date', 'x  2014-06-03 unknown type',
+             's  2014-06-06 sleeping without a wake', 'r3 2016-02-01 =2q bad unit',
+             'a2 14-06-05 short date', 'c             constant without days')
+
+
+def todoLines(count, seed=0, today=None, comments=0.06, types='tsacwr',
+              categories=None, malformed=0.0):
+    '''Generator yielding count lines of a synthetic todo file, with
+       about the given fraction of comment and malformed lines and
+       number of categories (default one every 50 lines). Item types
+       are picked from the string types, so repeating a type letter
+       makes it more common.'''
+    rand = random.Random(seed)
+    today = today or datetime.date.today()
+    catrate = 0.02 if categories is None else float(categories) / max(count, 1)
+    catnum = 0
+    for num in range(count):
+        roll = rand.random()
+        if roll < catrate:
+            catnum += 1
+            yield '[category %d]\n' % catnum
+            continue
+        if roll < catrate + comments:
+            yield '# a comment line\n'
+            continue
+        if roll < catrate + 0.02 + comments:
+            yield '\n'
+            continue
+        if roll < catrate + 0.02 + comments + malformed:
+            yield '%s\n' % MALFORMED[num % len(MALFORMED)]
+            continue
+        date = today + datetime.timedelta(days=rand.randint(-60, 400))
+        desc = '%s %d' % (rand.choice(DESCS), num)
+        type = rand.choice(types)
+        if type == 't':
+            yield 't  %s %s\n' % (date.isoformat(), desc)
+        elif type in 'sa':
+            yield '%s%d %s %s\n' % (type, rand.randint(0, 15),
+                                    date.isoformat(), desc)
+        elif type == 'c':
+            yield 'c%d            %s\n' % (rand.randint(0, 10), desc)
+        elif type == 'w':
+            yield 'w             %s\n' % desc
+        else:
+            yield 'r%d %s %s%d%s %s\n' % (rand.randint(0, 15),
+                                         date.isoformat(), rand.choice('=+'),
+                                         rand.randint(1, 4), rand.choice('dw'),
+                                         desc)
+
+
+def writeTodoFile(path, count, seed=0, comments=0.06, **options):
+    '''Writes a synthetic todo file of count lines to path; options
+       are passed on to todoLines'''
+    with open(path, 'w') as out:
+        out.writelines(todoLines(count, seed, comments=comments, **options))
+
+
+def addOptions(optparser):
+    '''Adds the generator options to an OptionParser, for the
+       benchmarks; see generatorOptions'''
+    optparser.add_option('--seed', type='int', default=0, \
+                         help='Random seed')
+    optparser.add_option('--types', default='tsacwr', \
+                         help='Item types to pick from; repeat a letter to weight it')
+    optparser.add_option('--categories', type='int', \
+                         help='Number of categories (default one every 50 lines)')
+    optparser.add_option('--comments', type='float', default=0.06, \
+                         help='Fraction of comment lines')
+    optparser.add_option('--malformed', type='float', default=0.0, \
+                         help='Fraction of lines with syntax errors')
+
+
+def generatorOptions(opts):
+    '''The keyword arguments for writeTodoFile from parsed options'''
+    return {'seed': opts.seed, 'types': opts.types, 'categories': opts.categories,
+            'comments': opts.comments, 'malformed': opts.malformed}
+
+
+if __name__ == '__main__':
+    optparser = optparse.OptionParser(usage='%prog [options] OUTFILE')
+    optparser.add_option('-n', '--lines', type='int', default=100000, \
+                         help='Number of lines to generate')
+    addOptions(optparser)
+    (opts, args) = optparser.parse_args()
+    if len(args) != 1:
+        optparser.error('need an output file')
+    if not opts.types or set(opts.types) - set('tsacwr'):
+        optparser.error('--types must be letters from tsacwr')
+    writeTodoFile(args[0], opts.lines, **generatorOptions(opts))
@@ -141,20 +141,24 @@ a12 2014-06-08 Bob's birthday
 #
 # For each valid type of item, there must be:
 #  - an entry in default VALIDTYPES
-#  - a regex for the line entry
-#  - a section in parseTodoLine for the type
+#  - a lineParser() registration: the regex for the line entry and
+#    a builder turning the matched fields into a TodoItem
+# (parseTodoLineLegacy has the old per-type sections; it is kept so the
+# --parser=legacy option can be used to compare against it)
 #
 # TODO: - Settings via env vars
-#       - Use linecache when reading single lines
 #       - Handle white backgrounds neatly
-#       - Group by category with original file order
 #       - Better factoring on filter arguments
 #       - Implement p (pending) and f (followup) items
-#       - --count or --stats options
 #       - Priorities setting colours early?
 
 import os, sys, re, optparse
-import datetime
+import io, marshal, struct, locale, array, heapq
+import socket, signal, select, shutil
+# (csv, json, mmap, hashlib, socketserver and concurrent.futures are
+# imported by the functions that use them: most runs need few of them)
+import time, collections, contextlib, tempfile, glob, itertools, bisect
+import datetime, calendar
 
 # If import android fails, don't do the other android stuff...
 try:
@@ -163,17 +167,26 @@ try:
 except (ImportError):
     droid = None  # test on this later for droid vs terminal
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # no locking of the todo files
+
 # Default settings and constants - Constants are in UPPERCASE.
 TODAY = datetime.date.today()
+TODAY_ORDINAL = TODAY.toordinal()
 VALIDTYPES = 'tsacwr'
 
 class FilterSettings(object):
    # TODO: different days/types defaults on droid?
    days_cutoff = 22  # If due later than this, will not be shown
+   show_all = False  # Ignore all of the filters
    show_line_nums = False  # FIXME display settings
    only_types = VALIDTYPES
    only_categories = None
    exclude_categories = None  # NB: if both only and ex are specified only use only
+   where = None  # --where expression, applies even with show_all
+   search = None  # --search words (also added to where), for the search index
 filter_settings = FilterSettings()
 
 settings = {}  # FIXME ^^^
@@ -195,7 +208,10 @@ else:  # android:
    }
 settings['paths'] = {
    'todopath': DEFAULTTODOFILE,
+   'cachedir': os.path.join(os.getenv('XDG_CACHE_HOME') or \
+                            os.path.join(os.getenv('HOME', ''), '.cache'), 'rastodo'),
 }
+settings['paths']['socket'] = os.path.join(settings['paths']['cachedir'], 'daemon.sock')
 
 # ANSI colours
 # these are all with black background (40)
@@ -218,24 +234,68 @@ class TodoItem(object):
     # If cat/days/date are not given, we do not use or display.
     # TODO refactor to calc some on demand based on pri?
     # FIXME pri in init too
+    #
+    # There can be a lot of these, so they have slots instead of a
+    # __dict__. Dates are kept as ordinals; date and days are worked out
+    # from them when used (days is only stored for constant items).
+    # source is the todo file when several are loaded, otherwise None.
+    __slots__ = ('type', 'linenum', 'desc', 'category', 'ordinal', '_days',
+                 'wake', 'recur', 'recurrence', 'source')
+
     def __init__(self, type, desc, linenum, \
-                 category=None, days=None, date=None, wake=None, recur=None):
+                 category=None, days=None, date=None, wake=None, recur=None,
+                 recurrence=None):
         self.type = type.lower()  # validation TODO
         self.linenum = int(linenum)
         self.desc = desc
         self.category = category
-        self.date = date
+        self.ordinal = date.toordinal() if date is not None else None
+        self._days = int(days) if days is not None and date is None else None
         self.wake = int(wake) if wake is not None else None
-        self.days = int(days) if days is not None else None
         self.recur = recur
+        self.recurrence = recurrence  # ('=' or '+', length, unit)
+        self.source = None
+
+    @classmethod
+    def fromFields(cls, type, desc, linenum, category, days, ordinal, wake, recur,
+                   recurrence=None):
+        '''Fast constructor used by the line parsers; the fields must
+           already be of the right types as nothing is re-cast here.
+           days is only used if there is no date ordinal.'''
+        self = cls.__new__(cls)
+        self.type = type
+        self.linenum = linenum
+        self.desc = desc
+        self.category = category
+        self.ordinal = ordinal
+        self._days = days
+        self.wake = wake
+        self.recur = recur
+        self.recurrence = recurrence
+        self.source = None
+        return self
+
+    @property
+    def date(self):
+        if self.ordinal is None:
+            return None
+        return dateFromOrdinal(self.ordinal)
+
+    @property
+    def days(self):
+        if self.ordinal is None:
+            return self._days
+        return self.ordinal - TODAY_ORDINAL
 
     def daysAway(self):
         # for wishlist items without a date, fudges days = the
         # cutoff so they are filtered and sorted properly.
-        if self.days is None:
+        if self.ordinal is not None:
+            return self.ordinal - TODAY_ORDINAL
+        if self._days is None:
             return filter_settings.days_cutoff
         else:
-            return self.days
+            return self._days
 
     # FIXME: below should be __repr__, or repr should wrap below
     def asTodoLine(self):
@@ -273,7 +333,12 @@ class TodoItem(object):
                 preamble = ANSI_COLOURS['boldred']
 
         if filter_settings.show_line_nums:  # If set, line numbers should be first
-            preamble = "%s%03d " % (preamble, self.linenum)
+            if self.source is None:
+                preamble = "%s%03d " % (preamble, self.linenum)
+            else:
+                preamble = "%s%s:%03d " % (preamble, self.source, self.linenum)
+        elif self.source is not None:
+            preamble = "%s%s: " % (preamble, self.source)
         if showType:  # show the type of the entry
             preamble = "%s%s " % (preamble, self.type)
 
@@ -291,24 +356,26 @@ class TodoItem(object):
             days = '[%02d]' % self.days
 
         if settings['display']['two_lines']:  # newline before description
-            self.desc = "%s%s" % ('\n', self.desc)
+            desc = "%s%s" % ('\n', self.desc)
+        else:
+            desc = self.desc
         if self.recur:  # print date of next after desc
-            self.desc = "%s [next %s]" % (self.desc, self.recur.isoformat())
+            desc = "%s [next %s]" % (desc, self.recur.isoformat())
 
         if settings['display']['use_colours']:
             if self.category is None:
                 return '%s%s %s %s%s' % \
-                       (preamble, days, date, self.desc, ANSI_COLOURS['normal'])
+                       (preamble, days, date, desc, ANSI_COLOURS['normal'])
             else:
                 return '%s%s %s [%s] %s%s' % (preamble, days, \
-                                              date, self.category, self.desc, ANSI_COLOURS['normal'])
+                                              date, self.category, desc, ANSI_COLOURS['normal'])
         else:
             if self.category is None:
                 return '%s%s %s %s' % \
-                       (preamble, days, date, self.desc)
+                       (preamble, days, date, desc)
             else:
                 return '%s%s %s [%s] %s' % (preamble, days, \
-                                            date, self.category, self.desc)
+                                            date, self.category, desc)
                 # end prettyPrint
 
 # end TodoItem class
@@ -328,7 +395,160 @@ regexR = re.compile(r'[Rr](\d+)\s+(\d{4}-\d{2}-\d{2})\s+([=+])(\d+)([dwmy])\s+(.
 #regexF = re.compile(r'[Ff]\s+(\d{4}-\d{2}-\d{2})\s+(.+)')         # "Followup"
 
 
+RENDER_CHUNK = 4096  # lines written at a time, so a pager can start early
+
+class TodoRenderer(object):
+    '''Formats lists of TodoItems exactly as prettyPrintStr does, for
+       the current display settings, without changing the items. The
+       colour, type, days and date at the start of each line only
+       depend on the type and date, so they are formatted once for
+       each and reused.'''
+    def __init__(self, showType=True):
+        self.use_colours = settings['display']['use_colours']
+        self.two_lines = settings['display']['two_lines']
+        self.show_line_nums = filter_settings.show_line_nums
+        self.showType = showType
+        self.normal = ANSI_COLOURS['normal'] if self.use_colours else ''
+        self._heads = {}  # (type, ordinal, days) -> (colour, head)
+        self._categories = {None: ''}
+
+    def head(self, type, days, date):
+        '''Returns (colour, head): the colour for the days away and the
+           type, days and date up to the category'''
+        colour = ''
+        if self.use_colours:
+            if days is None:
+                colour = ANSI_COLOURS['blue']
+            elif days > 4:
+                colour = ANSI_COLOURS['green']
+            elif days > 0:
+                colour = ANSI_COLOURS['yellow']
+            elif days == 0:
+                colour = ANSI_COLOURS['boldmagenta']
+            else:
+                colour = ANSI_COLOURS['boldred']
+        if date is None:
+            datestr = '     '
+        elif type == 'a':
+            datestr = '%02d-%02d %s:' % (date.month, date.day, date.strftime('%a'))
+        else:
+            datestr = '%02d-%02d' % (date.month, date.day)
+        daystr = '    ' if days is None else '[%02d]' % days
+        typestr = '%s ' % type if self.showType else ''
+        return (colour, '%s%s %s ' % (typestr, daystr, datestr))
+
+    def lines(self, items):
+        '''Returns the list of lines (without newlines) for items'''
+        heads = self._heads
+        categories = self._categories
+        normal = self.normal
+        newline = '\n' if self.two_lines else ''
+        ret = []
+        append = ret.append
+        for item in items:
+            key = (item.type, item.ordinal, item._days)
+            try:
+                (colour, head) = heads[key]
+            except KeyError:
+                (colour, head) = heads[key] = self.head(item.type, item.days, item.date)
+            try:
+                category = categories[item.category]
+            except KeyError:
+                category = categories[item.category] = '[%s] ' % item.category
+            desc = item.desc
+            if item.recur:
+                desc = '%s [next %s]' % (desc, item.recur.isoformat())
+            if self.show_line_nums:
+                if item.source is None:
+                    colour = '%s%03d ' % (colour, item.linenum)
+                else:
+                    colour = '%s%s:%03d ' % (colour, item.source, item.linenum)
+            elif item.source is not None:
+                colour = '%s%s: ' % (colour, item.source)
+            append('%s%s%s%s%s%s' % (colour, head, category, newline, desc, normal))
+        return ret
+
+
+# Machine readable output (--format)
+OUTPUT_FORMATS = ('text', 'jsonl', 'csv', 'tsv')
+RECORD_FIELDS = ('type', 'wake', 'date', 'days', 'recur', 'cat', 'desc', 'line')
+
+class RecordWriter(object):
+    '''Writes TodoItems to out as they are appended, one record each,
+       as JSON Lines or as CSV or TSV with a header line. The fields
+       are RECORD_FIELDS (named as for --where), file if sources is
+       true and as_of (the as_of attribute, for --forecast) if as_of
+       is true; dates are YYYY-MM-DD and missing values are null (or
+       empty). It can be passed as the ret of the loaders to write
+       the items as they are parsed.'''
+    streams = True  # the loaders parse line by line rather than from the cache
+
+    def __init__(self, out, format='jsonl', sources=False, as_of=False):
+        self.out = out
+        self.sources = sources
+        self.fields = RECORD_FIELDS + ('file',) if sources else RECORD_FIELDS
+        self.as_of = '' if as_of else None
+        if as_of:
+            self.fields += ('as_of',)
+        self.count = 0
+        self.csv = None
+        # JSON for the values that repeat (all but desc and line)
+        import json
+        self.dumps = json.dumps
+        self.json = {}
+        self.template = '{%s}\n' % ', '.join('"%s": %%s' % field for field in self.fields)
+        if format != 'jsonl':
+            import csv
+            self.csv = csv.writer(out, delimiter='\t' if format == 'tsv' else ',', \
+                                  lineterminator='\n')
+            self.csv.writerow(self.fields)
+
+    def values(self, item):
+        date = item.date
+        recur = item.recur
+        values = [item.type, item.wake, None if date is None else date.isoformat(),
+                  item.days, None if recur is None else recur.isoformat(),
+                  item.category, item.desc, item.linenum]
+        if self.sources:
+            values.append(item.source)
+        if self.as_of is not None:
+            values.append(self.as_of)
+        return values
+
+    def encode(self, value):
+        try:
+            return self.json[value]
+        except KeyError:
+            encoded = self.json[value] = self.dumps(value)
+            return encoded
+
+    def append(self, item):
+        self.count += 1
+        if self.csv is not None:
+            self.csv.writerow(self.values(item))
+            return
+        # as json.dumps of a dict of the fields, but quicker
+        values = self.values(item)
+        encode = self.encode
+        encoded = [encode(values[0]), encode(values[1]), encode(values[2]), encode(values[3]),
+                   encode(values[4]), encode(values[5]), self.dumps(values[6]), values[7]]
+        encoded.extend(encode(value) for value in values[8:])
+        self.out.write(self.template % tuple(encoded))
+
+    def __len__(self):
+        return self.count
+
+
 # Standalone functions
+def setToday(date=None):
+    '''Sets TODAY (and TODAY_ORDINAL), which days away are counted
+       from, to the given date or the current date. Items already
+       loaded follow it, except for the next date of '+' recurrences.'''
+    global TODAY, TODAY_ORDINAL
+    TODAY = date or datetime.date.today()
+    TODAY_ORDINAL = TODAY.toordinal()
+
+
 def parseISODate(s):
     '''Given a string in ISO 8602 format (yyyy-mm-dd), returns a
        date object representing the date (see datetime module)
@@ -337,14 +557,223 @@ def parseISODate(s):
     return datetime.date(int(y), int(m), int(d))
 
 
+# Fast path date decoding for the line parsers. The regexes have
+# already checked the layout, so the fields can be sliced out directly;
+# todo files have lots of repeated dates so results are memoised.
+_isoDates = {}
+
+def decodeISODate(s):
+    '''Given a string already matched as YYYY-MM-DD, returns a
+       (date, ordinal) tuple. Throws ValueError on an impossible date'''
+    try:
+        return _isoDates[s]
+    except KeyError:
+        date = datetime.date(int(s[0:4]), int(s[5:7]), int(s[8:10]))
+        ret = _isoDates[s] = (date, date.toordinal())
+        _ordinalDates[ret[1]] = date
+        return ret
+
+
+_ordinalDates = {}
+
+def dateFromOrdinal(ordinal):
+    try:
+        return _ordinalDates[ordinal]
+    except KeyError:
+        date = _ordinalDates[ordinal] = datetime.date.fromordinal(ordinal)
+        return date
+
+
+# Line parser dispatch table: type char -> (regex match method, builder).
+# Builders take the tuple of matched groups, line number and category
+# and return a TodoItem. Every type in VALIDTYPES must be registered here.
+# LINE_FIELDS has the (date, wake, days) group numbers for each type, so
+# the raw fields can be checked against the filters (see FilterPushdown).
+LINE_PARSERS = {}
+LINE_FIELDS = {}
+
+def lineParser(type, regex, date=None, wake=None, days=None):
+    '''Decorator registering a builder for lines of the given type'''
+    def register(builder):
+        LINE_PARSERS[type] = (re.compile(regex).match, builder)
+        LINE_FIELDS[type] = (date, wake, days)
+        return builder
+    return register
+
+
+@lineParser('t', r't\s+(\d{4}-\d{2}-\d{2})\s+(.+)', date=0)
+def _buildTodo(fields, num, category):
+    ordinal = decodeISODate(fields[0])[1]
+    return TodoItem.fromFields('t', fields[1], num, category,
+                               None, ordinal, None, None)
+
+
+@lineParser('s', r's(\d+)\s+(\d{4}-\d{2}-\d{2})\s+(.+)', date=1, wake=0)
+def _buildSleeping(fields, num, category):
+    ordinal = decodeISODate(fields[1])[1]
+    return TodoItem.fromFields('s', fields[2], num, category,
+                               None, ordinal, int(fields[0]), None)
+
+
+@lineParser('a', r'a(\d+)\s+(\d{4}-\d{2}-\d{2})\s+(.+)', date=1, wake=0)
+def _buildAppointment(fields, num, category):
+    ordinal = decodeISODate(fields[1])[1]
+    return TodoItem.fromFields('a', fields[2], num, category,
+                               None, ordinal, int(fields[0]), None)
+
+
+@lineParser('c', r'c(\d+)\s+(.+)', days=0)
+def _buildConstant(fields, num, category):
+    return TodoItem.fromFields('c', fields[1], num, category,
+                               int(fields[0]), None, None, None)
+
+
+@lineParser('w', r'w\s+(.+)')
+def _buildWishlist(fields, num, category):
+    return TodoItem.fromFields('w', fields[0], num, category,
+                               None, None, None, None)
+
+
+# Recurring period units: (days, months) in each
+RECUR_UNITS = {'d': (1, 0), 'w': (7, 0), 'm': (0, 1), 'y': (0, 12)}
+
+def addPeriod(date, length, unit, times=1):
+    '''Returns date plus times periods of length units. Months are
+       calendar months, keeping the day of the month or using the last
+       day of shorter months: 2016-01-31 +1m is 2016-02-29, +2m is
+       2016-03-31. Raises ValueError past the year 9999.'''
+    (days, months) = RECUR_UNITS[unit]
+    if not months:
+        try:
+            return date + datetime.timedelta(days=days*length*times)
+        except OverflowError:
+            raise ValueError('date out of range')
+    months = date.month - 1 + months*length*times
+    (year, month) = (date.year + months // 12, months % 12 + 1)
+    if not datetime.MINYEAR <= year <= datetime.MAXYEAR:
+        raise ValueError('date out of range')
+    return datetime.date(year, month, min(date.day, calendar.monthrange(year, month)[1]))
+
+
+def nextRecurrence(date, recurrence):
+    '''Returns the date after date for a ('=' or '+', length, unit)
+       recurrence; '+' recurrences are relative to TODAY instead.'''
+    (sign, length, unit) = recurrence
+    if sign == '=':
+        return addPeriod(date, length, unit)
+    else:
+        return addPeriod(TODAY, length, unit)
+
+
+def occurrences(date, recurrence, start=None):
+    '''Generates the dates on which an item recurs, from its due date
+       date, or from the first on or after start. '=' recurrences are
+       every period from the due date (each counted from the due date,
+       so month ends don't drift). '+' recurrences are a period after
+       they are done, so they are taken to be done when due, or today
+       if already overdue. The dates end when they would pass the year
+       9999.'''
+    (sign, length, unit) = recurrence
+    if sign == '+' and date < TODAY:
+        if start is None or date >= start:
+            yield date  # overdue; done today at the earliest
+        date = TODAY
+        first = 1
+    else:
+        first = 0
+    if length == 0:
+        if start is None or date >= start:
+            yield date
+        return
+    if start is not None and start > date:
+        # jump straight to the first period on or after start
+        (days, months) = RECUR_UNITS[unit]
+        if months:
+            first = max(first, ((start.year - date.year)*12 + start.month - date.month) //
+                        (months*length))
+        else:
+            first = max(first, (start - date).days // (days*length))
+    times = first
+    while True:
+        try:
+            next = addPeriod(date, length, unit, times)
+        except ValueError:
+            return
+        if start is None or next >= start:
+            yield next
+        times += 1
+
+
+@lineParser('r', r'r(\d+)\s+(\d{4}-\d{2}-\d{2})\s+([=+])(\d+)([dwmy])\s+(.+)',
+            date=1, wake=0)
+def _buildRecurring(fields, num, category):
+    if fields[4] not in RECUR_UNITS:
+        return None
+    (date, ordinal) = decodeISODate(fields[1])
+    recurrence = (fields[2], int(fields[3]), fields[4])
+    return TodoItem.fromFields('r', fields[5], num, category,
+                               None, ordinal, int(fields[0]),
+                               nextRecurrence(date, recurrence), recurrence)
+
+
 def parseTodoLine(line, num, category=None):
     '''Takes a single line string (and optionally the current
        category); returns a todo item or None if it is invalid.'''
+    try:
+        (match, build) = LINE_PARSERS[line[0]]
+    except KeyError:
+        return None  # no recognized type
+    mat = match(line)
+    if mat is None:
+        return None
+    try:
+        return build(mat.groups(), num, category)
+    except ValueError:
+        return None  # impossible date, e.g. 2014-02-30
+
+
+def validFields(type, fields):
+    '''Returns true if the builder for the type can make an item of the
+       fields its pattern matched: makes the same checks (a date that
+       exists, a next recurrence before the year 10000) without
+       building the item'''
+    date = LINE_FIELDS[type][0]
+    if date is None:
+        return True
+    try:
+        (date, ordinal) = decodeISODate(fields[date])
+        if type == 'r':
+            nextRecurrence(date, (fields[2], int(fields[3]), fields[4]))
+    except ValueError:
+        return False
+    return True
+
+
+def checkTodoLine(line):
+    '''Returns true if parseTodoLine would make an item of the line (a
+       todo line, not blank, a comment or a category), checked without
+       making it; for lines that are filtered out unparsed, so that
+       their syntax errors are still reported'''
+    try:
+        match = LINE_PARSERS[line[0]][0]
+    except KeyError:
+        return False
+    mat = match(line)
+    return mat is not None and validFields(line[0], mat.groups())
+
+
+def parseTodoLineLegacy(line, num, category=None):
+    '''Takes a single line string (and optionally the current
+       category); returns a todo item or None if it is invalid.
+       This is the original if/elif parser, see parseTodoLine.'''
     # Determine type of line
     if line[0] == 't':  # Todo item
         mat = regexT.match(line)
         if mat:
-            date = parseISODate(mat.group(1))
+            try:
+                date = parseISODate(mat.group(1))
+            except ValueError:
+                return None  # impossible date, e.g. 2014-02-30
             desc = mat.group(2)
             days = (date - TODAY).days
             return TodoItem(
@@ -362,7 +791,10 @@ def parseTodoLine(line, num, category=None):
         mat = regexS.match(line)
         if mat:
             wake = int(mat.group(1))
-            date = parseISODate(mat.group(2))
+            try:
+                date = parseISODate(mat.group(2))
+            except ValueError:
+                return None  # impossible date, e.g. 2014-02-30
             desc = mat.group(3)
             days = (date - TODAY).days
             return TodoItem(
@@ -381,7 +813,10 @@ def parseTodoLine(line, num, category=None):
         mat = regexA.match(line)
         if mat:
             wake = int(mat.group(1))
-            date = parseISODate(mat.group(2))
+            try:
+                date = parseISODate(mat.group(2))
+            except ValueError:
+                return None  # impossible date, e.g. 2014-02-30
             desc = mat.group(3)
             days = (date - TODAY).days
             return TodoItem(
@@ -428,7 +863,10 @@ def parseTodoLine(line, num, category=None):
         mat = regexR.match(line)
         if mat:
             wake = int(mat.group(1))
-            date = parseISODate(mat.group(2))
+            try:
+                date = parseISODate(mat.group(2))
+            except ValueError:
+                return None  # impossible date, e.g. 2014-02-30
             recurtype = mat.group(3)
             recurlen = int(mat.group(4))
             recurunit = mat.group(5)
@@ -437,24 +875,18 @@ def parseTodoLine(line, num, category=None):
             days = (date - TODAY).days
 
             # Find time of next event
-            if recurunit == 'd':
-               datedelta = datetime.timedelta(days=recurlen)
-            elif recurunit == 'w':
-               datedelta = datetime.timedelta(days=recurlen*7)
-            # TODO longer times
-            #elif recurunit == 'm':
-            #   datedelta = datetime.timedelta(months=recurlen)
-            #elif recurunit == 'y':
-            #   datedelta = datetime.timedelta(months=recurlen*12)
-            else:
+            if recurunit not in RECUR_UNITS:
                 return None
 
-            if recurtype == '=':
-                nextdate = date + datedelta
-            elif recurtype == '+':
-                nextdate = TODAY + datedelta
-            else:
-                return None
+            try:
+                if recurtype == '=':
+                    nextdate = addPeriod(date, recurlen, recurunit)
+                elif recurtype == '+':
+                    nextdate = addPeriod(TODAY, recurlen, recurunit)
+                else:
+                    return None
+            except ValueError:
+                return None  # next recurrence after the year 9999
 
             return TodoItem(
                 'r',
@@ -464,7 +896,8 @@ def parseTodoLine(line, num, category=None):
                 days=days,
                 date=date,
                 wake=wake,
-                recur=nextdate
+                recur=nextdate,
+                recurrence=(recurtype, recurlen, recurunit)
             )
         else:
             return None
@@ -473,41 +906,568 @@ def parseTodoLine(line, num, category=None):
         return None
 
 
+# Selectable with --parser
+PARSER_ENGINES = {
+    'table': parseTodoLine,
+    'legacy': parseTodoLineLegacy,
+}
+
+
+_includeFilter = [None, None]  # (settings key, FilterPushdown or None)
+
 def todoInclude(item):
     '''Returns true if the todo item should be included based on
        the global options. Otherwise returns false.'''
-    # FIXME TODO move into class
-    # Filter items
-    if not cliopts.all:
-        if item.wake is not None:
-            if item.wake < item.daysAway():
-                return False
-        if item.daysAway() > filter_settings.days_cutoff:
-            return False
+    # The filters are compiled by FilterPushdown; recompiled only
+    # when the settings change.
+    key = (filter_settings.show_all, filter_settings.days_cutoff,
+           filter_settings.only_types, filter_settings.only_categories,
+           filter_settings.exclude_categories, filter_settings.where, TODAY_ORDINAL)
+    if _includeFilter[0] != key:
+        _includeFilter[:] = [key, pushdownFilter()]
+    pushdown = _includeFilter[1]
+    return pushdown is None or pushdown.includes(item)
 
-        # type of item
-        if filter_settings.only_types.find(item.type) == -1:
-            return False
 
-        # category
-        if filter_settings.only_categories is not None:
-            if item.category not in filter_settings.only_categories:
-                return False
+# Filter expressions (--where)
+#
+# A small boolean language over the fields of an item, such as
+#   type in "ta" and days <= 7 and cat !~ "birthdays"
+# Comparisons are <field> <op> <value or field>, with the ops
+#   == != < <= > >=
+#   ~ !~           regex search (re.search) of a string field
+#   in, not in     membership of a ("list", "of", "values"), or of a
+#                  string: type letters for type, otherwise comma
+#                  delimited as for --only-cat
+# combined with and, or, not and parentheses. Strings are in single or
+# double quotes, dates are YYYY-MM-DD and none is for missing fields
+# (== none, != none). days is days away as used for sorting, so
+# wishlist items count as --days away.
+#
+# The option filters are translated to the same syntax tree, and the
+# tree is compiled (see compileFilter) to a single Python function.
+WHERE_FIELDS = {'type': 'str', 'cat': 'str', 'desc': 'str',
+                'days': 'int', 'wake': 'int', 'line': 'int', 'date': 'date'}
+WHERE_NULLABLE = frozenset(('cat', 'wake', 'date'))
+_whereToken = re.compile(r'''\s*(?:("(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')|(\d{4}-\d{2}-\d{2})\b|(-?\d+)|(==|!=|<=|>=|<|>|!~|~|\(|\)|,)|([A-Za-z_]+))''')
+
+def _whereTokens(text):
+    '''Returns the list of (kind, value) tokens in a --where
+       expression, ending with ('end', None)'''
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        mat = _whereToken.match(text, pos)
+        if mat is None:
+            raise ValueError("can't parse %r" % text[pos:].strip())
+        (string, date, number, op, word) = mat.groups()
+        if string is not None:
+            tokens.append(('value', ('str', re.sub(r'\\(.)', r'\1', string[1:-1]))))
+        elif date is not None:
+            try:
+                tokens.append(('value', ('date', parseISODate(date).toordinal())))
+            except ValueError:
+                raise ValueError('bad date %s' % date)
+        elif number is not None:
+            tokens.append(('value', ('int', int(number))))
+        elif op is not None:
+            tokens.append(('op', op))
+        elif word in ('and', 'or', 'not', 'in'):
+            tokens.append(('op', word))
+        elif word == 'none':
+            tokens.append(('value', ('none', None)))
+        elif word in WHERE_FIELDS:
+            tokens.append(('field', word))
         else:
-            if filter_settings.exclude_categories is not None:
-                if item.category in filter_settings.exclude_categories:
+            raise ValueError('unknown field %s (fields are %s)' %
+                             (word, ', '.join(sorted(WHERE_FIELDS))))
+        pos = mat.end()
+    tokens.append(('end', None))
+    return tokens
+
+
+class _WhereParser(object):
+    '''Recursive descent parser for --where expressions'''
+    def __init__(self, text):
+        self.tokens = _whereTokens(text)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos]
+
+    def next(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def accept(self, op):
+        if self.peek() == ('op', op):
+            self.pos += 1
+            return True
+        return False
+
+    def parse(self):
+        tree = self.parseOr()
+        if self.peek()[0] != 'end':
+            raise ValueError('unexpected %s' % (self.peek()[1],))
+        return tree
+
+    def parseOr(self):
+        nodes = [self.parseAnd()]
+        while self.accept('or'):
+            nodes.append(self.parseAnd())
+        return nodes[0] if len(nodes) == 1 else ('or', nodes)
+
+    def parseAnd(self):
+        nodes = [self.parseNot()]
+        while self.accept('and'):
+            nodes.append(self.parseNot())
+        return nodes[0] if len(nodes) == 1 else ('and', nodes)
+
+    def parseNot(self):
+        if self.accept('not'):
+            return ('not', self.parseNot())
+        if self.accept('('):
+            tree = self.parseOr()
+            if not self.accept(')'):
+                raise ValueError('missing )')
+            return tree
+        return self.parseComparison()
+
+    def parseComparison(self):
+        (kind, field) = self.next()
+        if kind != 'field':
+            raise ValueError('expected a field, not %s' % (field,))
+        (kind, op) = self.next()
+        if kind != 'op' or op in ('and', 'or', '(', ')', ','):
+            raise ValueError('expected a comparison after %s' % field)
+        if op == 'not':
+            if not self.accept('in'):
+                raise ValueError('expected in after not')
+            op = 'not in'
+        if op in ('in', 'not in') and self.accept('('):
+            values = []
+            while True:
+                (kind, value) = self.next()
+                if kind != 'value':
+                    raise ValueError('expected a value in the list for %s' % field)
+                values.append(value)
+                if self.accept(')'):
+                    break
+                if not self.accept(','):
+                    raise ValueError('expected , or ) in the list for %s' % field)
+            return comparison(op, field, ('list', values))
+        (kind, value) = self.next()
+        if kind == 'field':
+            return comparison(op, field, ('field', value))
+        if kind != 'value':
+            raise ValueError('expected a value after %s %s' % (field, op))
+        return comparison(op, field, value)
+
+
+def comparison(op, field, value):
+    '''Returns the syntax tree node for field op value, checking the
+       types; value is a (kind, value) pair where the kind is one of
+       str, int, date, none, field or list (of pairs)'''
+    fieldtype = WHERE_FIELDS[field]
+    (kind, value) = value
+    if op in ('~', '!~'):
+        if fieldtype != 'str' or kind != 'str':
+            raise ValueError('%s needs a string field and a string' % op)
+        try:
+            return ('cmp', op, field, ('regex', re.compile(value).search))
+        except re.error as e:
+            raise ValueError('bad regex %r: %s' % (value, e))
+    if op in ('in', 'not in'):
+        if kind == 'str':
+            if field == 'type':
+                values = [('str', letter) for letter in value]
+            else:
+                values = [('str', v) for v in value.split(',')]
+        elif kind == 'list':
+            values = value
+        else:
+            raise ValueError('%s needs a string or a list' % op)
+        for (vkind, v) in values:
+            if vkind != fieldtype and vkind != 'none':
+                raise ValueError('%s is a %s, not a %s' % (field, fieldtype, vkind))
+        return ('cmp', op, field, ('set', frozenset(v for (vkind, v) in values)))
+    if kind == 'none':
+        if op not in ('==', '!='):
+            raise ValueError('none can only be compared with == or !=')
+    elif kind == 'field':
+        if WHERE_FIELDS[value] != fieldtype:
+            raise ValueError("%s and %s can't be compared" % (field, value))
+    elif kind != fieldtype:
+        raise ValueError('%s is a %s, not a %s' % (field, fieldtype, kind))
+    return ('cmp', op, field, (kind, value))
+
+
+def parseWhere(text):
+    '''Parses a --where expression, returning its syntax tree.
+       Raises ValueError if it is not valid.'''
+    return _WhereParser(text).parse()
+
+
+def _filterCode(tree, consts):
+    '''Returns a Python expression for the syntax tree, with the
+       fields in v_<field> variables and constants added to consts'''
+    node = tree[0]
+    if node == 'true':
+        return 'True'
+    if node in ('and', 'or'):
+        return '(%s)' % (' %s ' % node).join(_filterCode(t, consts) for t in tree[1])
+    if node == 'not':
+        return '(not %s)' % _filterCode(tree[1], consts)
+    (node, op, field, (kind, value)) = tree
+    left = 'v_' + field
+    if kind == 'field':
+        right = 'v_' + value
+    elif kind != 'none':
+        right = '_c%d' % len(consts)
+        consts[right] = value
+    if kind == 'regex':
+        code = '%s(%s) is not None' % (right, left)
+        if op == '~':
+            return '(%s is not None and %s)' % (left, code)
+        return '(%s is None or not %s)' % (left, code)
+    if kind == 'set':
+        return '(%s %s %s)' % (left, op, right)
+    if kind == 'none':
+        return '(%s %s None)' % (left, 'is' if op == '==' else 'is not')
+    guards = [name for name in (left, right)
+              if name.startswith('v_') and name[2:] in WHERE_NULLABLE]
+    code = '%s %s %s' % (left, op, right)
+    if guards and op != '==' and op != '!=':
+        # none is never less or greater than anything
+        code = ' and '.join(['%s is not None' % g for g in guards] + [code])
+    return '(%s)' % code
+
+
+def compileFilter(tree, record=False, today=None, cutoff=None):
+    '''Compiles a filter syntax tree to a function returning whether
+       a TodoItem matches, or with record true, a cache record (see
+       itemRecord) and the line offset of its block. cutoff is the days
+       away of undated wishlist items; today defaults to TODAY.'''
+    consts = {'_today': TODAY_ORDINAL if today is None else today,
+              '_cutoff': filter_settings.days_cutoff if cutoff is None else cutoff}
+    code = _filterCode(tree, consts)
+    used = set(re.findall(r'\bv_(\w+)', code))
+    if record:
+        lines = ['def match(record, lineoffset=0):',
+                 '    (v_type, v_desc, v_line, v_cat, v_date, v_wake, v_days, recurrence) = record']
+        if 'line' in used:
+            lines.append('    v_line += lineoffset')
+        if 'days' in used:
+            lines += ['    if v_date is not None:',
+                      '        v_days = v_date - _today',
+                      '    elif v_days is None:',
+                      '        v_days = _cutoff']
+    else:
+        lines = ['def match(item):']
+        attributes = {'type': 'type', 'cat': 'category', 'desc': 'desc', 'wake': 'wake',
+                      'line': 'linenum', 'date': 'ordinal'}
+        for field in sorted(used - set(['days'])):
+            lines.append('    v_%s = item.%s' % (field, attributes[field]))
+        if 'days' in used:
+            lines += ['    v_days = item.ordinal',
+                      '    if v_days is None:',
+                      '        v_days = item._days',
+                      '        if v_days is None:',
+                      '            v_days = _cutoff',
+                      '    else:',
+                      '        v_days -= _today']
+    lines.append('    return %s' % code)
+    namespace = dict(consts)
+    exec(compile('\n'.join(lines), '<filter>', 'exec'), namespace)
+    return namespace['match']
+
+
+class FilterPushdown(object):
+    '''The filter settings in a form that lets lines and cache records
+       be rejected before a TodoItem is built for them: excluded
+       categories are skipped a block at a time, excluded types on the
+       first character and dates are checked as strings before they
+       are decoded. includes(item) and includesRecord(record,
+       lineoffset) are the compiled filters (with any --where) for
+       items and cache records.'''
+    def __init__(self, settings=filter_settings):
+        self.days_cutoff = settings.days_cutoff
+        self.today = TODAY_ORDINAL
+        self.filtering = not settings.show_all  # the option filters apply
+        self.types = frozenset(settings.only_types if self.filtering else VALIDTYPES)
+        self.skiptypes = frozenset(VALIDTYPES) - self.types
+        self.skipbytes = frozenset(ord(type) for type in self.skiptypes)
+        self.only_categories = self.exclude_categories = None
+        if not self.filtering:
+            pass
+        elif settings.only_categories is not None:
+            self.only_categories = frozenset(settings.only_categories)
+        elif settings.exclude_categories is not None:
+            self.exclude_categories = frozenset(settings.exclude_categories)
+        self._limits = {}
+        self.wheretext = settings.where
+        self.search = settings.search
+        self._compile()
+
+    def _compile(self):
+        tree = self.settingsTree() if self.filtering else ('true',)
+        self.where = None
+        if self.wheretext:
+            wheretree = parseWhere(self.wheretext)
+            self.where = compileFilter(wheretree, False, self.today, self.days_cutoff)
+            tree = ('and', [tree, wheretree])
+        self.includes = compileFilter(tree, False, self.today, self.days_cutoff)
+        self.includesRecord = compileFilter(tree, True, self.today, self.days_cutoff)
+
+    # The compiled functions can't be pickled (for the --jobs worker
+    # processes), so they are compiled again when unpickled.
+    def __getstate__(self):
+        state = dict(vars(self))
+        for name in ('where', 'includes', 'includesRecord'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        vars(self).update(state)
+        self._compile()
+
+    def settingsTree(self):
+        '''The option filters as a filter syntax tree (see parseWhere)'''
+        nodes = [('or', [('cmp', '==', 'wake', ('none', None)),
+                         ('cmp', '>=', 'wake', ('field', 'days'))]),
+                 ('cmp', '<=', 'days', ('int', self.days_cutoff)),
+                 ('cmp', 'in', 'type', ('set', self.types))]
+        if self.only_categories is not None:
+            nodes.append(('cmp', 'in', 'cat', ('set', self.only_categories)))
+        elif self.exclude_categories is not None:
+            nodes.append(('cmp', 'not in', 'cat', ('set', self.exclude_categories)))
+        return ('and', nodes)
+
+    def wantCategory(self, category):
+        if self.only_categories is not None:
+            return category in self.only_categories
+        return self.exclude_categories is None or \
+               category not in self.exclude_categories
+
+    def exclusion(self, item):
+        '''Returns the name of the first filter excluding item
+           ('category', 'type', 'wake', 'days' or 'where'), or None'''
+        if self.filtering:
+            if not self.wantCategory(item.category):
+                return 'category'
+            if item.type not in self.types:
+                return 'type'
+            days = item.daysAway()
+            if item.wake is not None and item.wake < days:
+                return 'wake'
+            if days > self.days_cutoff:
+                return 'days'
+        if self.where is not None and not self.where(item):
+            return 'where'
+        return None
+
+    def dateLimit(self, wake):
+        '''Returns the last YYYY-MM-DD date an item with the given
+           wake field (a string of digits, or None) can have and still
+           be included'''
+        try:
+            return self._limits[wake]
+        except KeyError:
+            days = self.days_cutoff if wake is None else min(self.days_cutoff, int(wake))
+            ordinal = max(1, min(self.today + days, datetime.date.max.toordinal()))
+            limit = self._limits[wake] = datetime.date.fromordinal(ordinal).isoformat()
+            return limit
+
+    def parseLine(self, line, num, category=None):
+        '''As parseTodoLine, but returns False for a line that would be
+           filtered out'''
+        try:
+            (match, build) = LINE_PARSERS[line[0]]
+        except KeyError:
+            return None  # no recognized type
+        mat = match(line)
+        if mat is None:
+            return None
+        fields = mat.groups()
+        if self.filtering:
+            (date, wake, days) = LINE_FIELDS[line[0]]
+            if date is not None:
+                if fields[date] > self.dateLimit(None if wake is None else fields[wake]):
+                    return False if validFields(line[0], fields) else None
+            elif days is not None:
+                if int(fields[days]) > self.days_cutoff:
                     return False
+        try:
+            item = build(fields, num, category)
+        except ValueError:
+            return None  # impossible date, e.g. 2014-02-30
+        if item is not None and self.where is not None and not self.where(item):
+            return False
+        return item
 
-    # end if not cliopts.all
-    return True
+    def wrap(self, parseLine):
+        '''Returns a version of parseLine (one of the PARSER_ENGINES)
+           which returns False for items that would be filtered out'''
+        if parseLine is parseTodoLine:
+            return self.parseLine
+        def parse(line, num, category=None):
+            item = parseLine(line, num, category)
+            if item is None or self.includes(item):
+                return item
+            return False
+        return parse
 
 
-def parseTodoFile(file):
-    '''Takes a file-like object, returns a list containing
-       filtered but unsorted todo objects'''
-    ret = []
-    category = None
-    linecount = 0
+# Profiling (--profile)
+#
+# The stages of a run are timed with stage(), which does nothing unless
+# profile is set, so the hooks cost nothing normally. When profiling,
+# the line parser and date decoding are also wrapped to time every
+# call, the line parser's results are counted, and the readers and
+# loaders add up the lines, cache records and filtering as they go
+# (addCount); see startProfile.
+profile = None  # the Profile while --profile is on
+_NOSTAGE = contextlib.nullcontext()
+
+class Profile(object):
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.times = {}  # stage -> [seconds, calls, nesting depth]
+        self.counts = collections.Counter()
+        self.depth = 0
+        self.running = True
+
+    def _entry(self, name):
+        # entered in the order the stages start, so they are reported
+        # before the stages within them
+        entry = self.times.get(name)
+        if entry is None:
+            entry = self.times[name] = [0.0, 0, self.depth]
+        return entry
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        entry = self._entry(name)
+        start = time.perf_counter()
+        self.depth += 1
+        try:
+            yield
+        finally:
+            self.depth -= 1
+            if self.running:
+                entry[0] += time.perf_counter() - start
+                entry[1] += 1
+
+    def timed(self, name, func):
+        '''Returns func wrapped to add the time of each call to the
+           stage name'''
+        def timedCall(*args):
+            entry = self._entry(name)
+            start = time.perf_counter()
+            self.depth += 1
+            try:
+                return func(*args)
+            finally:
+                self.depth -= 1
+                if self.running:
+                    entry[0] += time.perf_counter() - start
+                    entry[1] += 1
+        return timedCall
+
+    def counted(self, parseLine):
+        '''Returns parseLine wrapped to count the items it parses by
+           type, the syntax errors and the lines a pushdown rejects'''
+        counts = self.counts
+        def countedParse(line, num, category=None):
+            item = parseLine(line, num, category)
+            if item:
+                counts['%s items parsed' % item.type] += 1
+            elif item is None:
+                counts['syntax errors'] += 1
+            else:
+                counts['filtered out while parsing'] += 1
+            return item
+        return countedParse
+
+    def finish(self):
+        '''Stops the timing; later calls are not counted'''
+        self.running = False
+        self.total = time.perf_counter() - self.started
+
+    def report(self, format='text', out=None):
+        '''Writes the times and counts, as text or JSON, to out
+           (default stderr)'''
+        import json
+        out = out or sys.stderr
+        if format == 'json':
+            json.dump({'total': self.total,
+                       'stages': dict((name, {'seconds': t, 'calls': calls})
+                                      for (name, (t, calls, depth)) in self.times.items()),
+                       'counts': dict(self.counts)}, out, indent=1, sort_keys=True)
+            out.write('\n')
+            return
+        out.write('profile: %.4fs total (stages include the ones indented below them)\n'
+                  % self.total)
+        for (name, (t, calls, depth)) in self.times.items():
+            out.write('  %-26s %9.4fs %8d calls\n' % ('  '*depth + name, t, calls))
+        for name in sorted(self.counts):
+            out.write('  %-26s %10d\n' % (name, self.counts[name]))
+
+
+def stage(name):
+    '''Context manager timing a stage of the run, if profiling'''
+    if profile is None:
+        return _NOSTAGE
+    return profile.stage(name)
+
+
+def addCount(name, n=1):
+    '''Adds n to the count name, if profiling'''
+    if profile is not None:
+        profile.counts[name] += n
+
+
+def startProfile():
+    '''Turns on profiling for the rest of the run'''
+    global profile, decodeISODate, parseISODate
+    profile = Profile()
+    decodeISODate = profile.timed('date decoding', decodeISODate)
+    parseISODate = profile.timed('date decoding', parseISODate)
+
+
+def readTodoItems(file, parseLine=parseTodoLine, pushdown=None, ret=None):
+    '''Takes a file-like object, returns a tuple of (items, errors):
+       a list of all the todo objects in file order (not filtered) and
+       a list of line numbers with syntax errors.
+       If a FilterPushdown is given, only the items it includes are
+       returned; the lines it skips are still checked for syntax
+       errors (see checkTodoLine).
+       If ret is given the items are appended to it (it only needs an
+       append method, see UrgentItems) and it is returned instead.'''
+    (ret, errors, linecount) = readTodoLines(file, parseLine, pushdown=pushdown,
+                                             ret=ret)
+    return (ret, errors)
+
+
+def readTodoLines(file, parseLine=parseTodoLine, linecount=0, category=None,
+                  pushdown=None, ret=None):
+    '''As readTodoItems, for a part of a file starting after line
+       linecount with the given category in effect. Returns (items,
+       errors, linecount) where linecount is the last line read.'''
+    if ret is None:
+        ret = []
+    errors = []
+    firstline = linecount
+    skipping = False
+    skiptypes = ()
+    if pushdown is not None:
+        parseLine = pushdown.wrap(parseLine)
+        skiptypes = pushdown.skiptypes
+        skipping = not pushdown.wantCategory(category)
+    if profile is not None:
+        parseLine = profile.timed('line parsing', profile.counted(parseLine))
 
     for line in file:
         linecount += 1
@@ -516,229 +1476,2875 @@ def parseTodoFile(file):
 
         # handle categories
         if line[0] == '[':
-            category = line.lstrip('[').rstrip(']\n')
+            category = sys.intern(line.lstrip('[').rstrip(']\n'))
+            if pushdown is not None:
+                skipping = not pushdown.wantCategory(category)
+        elif skipping or line[0] in skiptypes:  # excluded category or type
+            if not checkTodoLine(line):
+                errors.append(linecount)
         else:  # try parsing as a todo line
-            todoitem = parseTodoLine(line, linecount+1, category)
+            todoitem = parseLine(line, linecount, category)
             if todoitem:
-                if todoInclude(todoitem):
-                    ret.append(todoitem)
-            else:
-                print("Syntax error at line", linecount)
+                ret.append(todoitem)
+            elif todoitem is None:  # False if filtered out
+                errors.append(linecount)
 
     # end for line in file
-    return ret
+    addCount('lines read', linecount - firstline)
+    return (ret, errors, linecount)
 
-# FIXME rm bump and recur and move to above
-def rewriteTodoFile(fname, action, linenum, recur=None, newline=None):
-    """
-    rewrites the todo file (safely, to a temp file first), modifying one line.
-    action can be:
-         'bump' - bump a recurring item on that line (must pass in recur)
-         'delete' - delete the line
-         'replace' - FIXME TODO
-         'insert' - FIXME TODO
-    """
-    linecount = 0
 
-    # Before opening the new file make sure the arguments are valid TODO
+def reportSyntaxErrors(errors, out=None, source=None):
+    for linenum in errors:
+        if source is None:
+            print("Syntax error at line", linenum, file=out)
+        else:
+            print("Syntax error at line", linenum, "of", source, file=out)
 
-    outfile = NamedTemporaryFile()  # FIXME
 
-    with open(fname) as infile:
-        for line in infile:
-            linecount += 1
-            if linecount != linenum:
-                outfile.write(line)
-            else:  # Reached target line
-                if action == 'delete':
-                    pass  # Don't copy to new file
-                if action == 'bump':
-                    # FIXME - this would be done better in an outer
-                    # function that handles the porcelain generation of new
-                    # todolines. this one should only handle the
-                    # plumbing of the file and string handling
-                    # rewrite that line FIXME
-                    pass
-                else:
-                    print("ERROR: Unknown action %s" % action)
-                    return None
+def parseTodoFile(file, parseLine=parseTodoLine):
+    '''Takes a file-like object, returns a list containing
+       filtered but unsorted todo objects. parseLine is one of the
+       PARSER_ENGINES.'''
+    (items, errors) = readTodoItems(file, parseLine, pushdownFilter())
+    reportSyntaxErrors(errors)
+    return items
 
-    # TODO: Copy outfile over old file name
 
+def pushdownFilter():
+    '''Returns a FilterPushdown for the current filter_settings, or
+       None if nothing is filtered out'''
+    if filter_settings.show_all and not filter_settings.where:
+        return None
+    return FilterPushdown(filter_settings)
 
-if __name__ == '__main__':
-    # Parse commandline arguments
-    optparser = optparse.OptionParser()      # TODO: optparser is deprecated :(
 
-    optparser.add_option('-f', '--file', \
-                         help='File to parse (defaults to %s)' % DEFAULTTODOFILE)
+class TodoIndex(object):
+    '''Todo items in the order they are added, with an index of them by
+       category. It can be passed as the ret of the loaders to build
+       the index while the file is parsed.'''
+    def __init__(self, items=()):
+        self.items = []
+        self.categories = {}  # category -> items; categories in the order first seen
+        for item in items:
+            self.append(item)
 
-    if droid is None:
-        optparser.add_option('-e', '--edit', action='store_true', \
-                             help='Invoke your EDITOR (%s) on todo file.' % EDITOR)
-    else:  # android TODO invoke text intent
-        optparser.add_option('-e', '--edit', action='store_true', \
-                             help='Invoke a text editor on todo file.')
+    def append(self, item):
+        self.items.append(item)
+        try:
+            self.categories[item.category].append(item)
+        except KeyError:
+            self.categories[item.category] = [item]
 
-    optparser.add_option('-r', '--reverse', action='store_true', \
-                         help='Reversed order of sorting.')
-    optparser.add_option('--mono', action='store_true', \
-                         dest='monochrome', help='Monochrome output')
-    optparser.add_option('--terminal', action='store_true', \
-                         dest='terminal', help='Disable Android GUI (if present)')
+    def __len__(self):
+        return len(self.items)
 
-    optparser.add_option('--sort-cat', action='store_true', \
-                         help='Group by category')
-    optparser.add_option('--line-numbers', action='store_true', \
-                         help='Show line numbers from todo file in output')    
+    def __iter__(self):
+        return iter(self.items)
 
-    optparser.add_option('--all', action='store_true', \
-                         help='Shows all items, regardless of date and filtering')
-    optparser.add_option('-d', '--days', \
-                         help='Days after which item will not be included')
+    def grouped(self, sort=False):
+        '''Returns the items grouped by category, with the categories in
+           the order first seen, or by name if sort (see categoryOrder)'''
+        categories = self.categories
+        order = sorted(categories, key=categoryOrder) if sort else categories
+        return [item for category in order for item in categories[category]]
 
-    optparser.add_option('--bump-line', \
-                         help='Bump a recurring item (on specified line) to next due date')
-    #optparser.add_option('--line-remove', \
-    #                     help='Remove the item on specified line')
-    #optparser.add_option('--line-edit', \
-    #                     help='Edit specified line')
 
-    # Don't use store_const for only-types for if-else later XXX
-    optparser.add_option('--only-types', \
-                         help='Only include these types (string of letters)')
-    optparser.add_option('--appointments', \
-                         action='store_const', const='a', dest='only_types', \
-                         help='Shows appointments only (equivalent to --only-types=a')
-    optparser.add_option('--ex-types', \
-                         help='Exclude these types (string of letters)')
-    optparser.add_option('--only-cat', \
-                         help='Only include these categories (comma delimited)')
-    optparser.add_option('--ex-cat', \
-                         help='Exclude these categories (comma delimited)')
-    optparser.add_option('--two-lines', action='store_true', \
-                         help='Newline before description')
+def categoryOrder(category):
+    '''Sort key for category names with no category (None) first'''
+    return (category is not None, category)
 
-    (cliopts, cliargs) = optparser.parse_args()
 
-    # TODO: Break up below into functions!
+class UrgentItems(object):
+    '''Collects the limit most urgent items (nearest daysAway) as they
+       are loaded, for --limit, without keeping or sorting the rest.
+       Pass it as the ret of the loaders. sortedItems() returns the
+       same items in the same order as the end of the full list sorted
+       by daysAway would have: the last limit items if descending,
+       otherwise the first.'''
+    def __init__(self, limit, descending=False):
+        self.limit = limit
+        self.descending = descending
+        self.seq = 0
+        # max-heap on (days, seq) negated so the root is the least
+        # urgent kept; with equal days the stable sort puts earlier
+        # items first, so descending keeps the later ones.
+        self.heap = []
 
-    # Check term option first
-    if cliopts.terminal:
-        droid = None
+    def append(self, item):
+        self.seq += 1
+        if self.descending:
+            entry = (-item.daysAway(), self.seq, item)
+        else:
+            entry = (-item.daysAway(), -self.seq, item)
+        if len(self.heap) < self.limit:
+            heapq.heappush(self.heap, entry)
+        elif entry > self.heap[0]:
+            heapq.heapreplace(self.heap, entry)
 
-    # Check file argument second
-    if cliopts.file:
-        settings['paths']['todopath'] = cliopts.file
-    todopath = settings['paths']['todopath']
-    if not os.access(todopath, os.F_OK):
-        sys.exit("%s does not exist; use the -f option to specify a todo file" % todopath)
-    if not os.access(todopath, os.R_OK):
-        sys.exit("%s is not readable." % todopath)
+    def __len__(self):
+        return len(self.heap)
 
-    # If edit mode, send to defined editor, replacing this process
-    if cliopts.edit:
-        os.execlp(EDITOR, "editor", todopath)  # replaces this process
-    # If bumping, read the whole file up to the given line
-    #if cliopts.bump_line:  # TODO not implemented
-    #    rewrite_todo_file(todopath, 'bump', cliopts.bump_line)
+    def sortedItems(self):
+        entries = sorted(self.heap, reverse=not self.descending)
+        return [entry[2] for entry in entries]
 
-    # Determine any cutoff dates, categories or types to be
-    # excluded beforehand so that we don't include those items when
-    # loading from the file. XXX
-    if cliopts.days:
-        filter_settings.days_cutoff = int(cliopts.days)
 
-    if cliopts.only_cat:
-        filter_settings.only_categories = cliopts.only_cat.split(',')
-    else:
-        if cliopts.ex_cat:
-            filter_settings.exclude_categories = cliopts.ex_cat.split(',')
+# Byte level reader (--reader=mmap)
+#
+# Instead of decoding every line as iterating over a text file does,
+# the file is mmapped and split into lines as bytes a window at a time.
+# Blank lines and comments are skipped without being decoded, and the
+# pages of each window are dropped once it has been read, so big files
+# don't add to the peak RSS. Lines
+# are split at '\n', '\r' and '\r\n' like a text file's but are passed
+# to the line parser without the line ending.
+MMAP_WINDOW = 1 << 18
+READERS = ('text', 'mmap')
 
-    if cliopts.only_types:
-        filter_settings.only_types = cliopts.only_types
-    else:
-        if cliopts.ex_types:
-            for type in cliopts.ex_types:
-                filter_settings.only_types = filter_settings.only_types.replace(type, '')
-    # end if only types
+def readTodoBytes(buf, start=0, end=None, parseLine=parseTodoLine,
+                  linecount=0, category=None, pushdown=None, ret=None):
+    '''As readTodoLines, for buf[start:end] where buf is a bytes-like
+       object with find/rfind (such as bytes or an mmap)'''
+    import mmap
+    if ret is None:
+        ret = []
+    errors = []
+    append = ret.append
+    firstline = linecount
+    skipping = False
+    skipbytes = ()
+    if pushdown is not None:
+        parseLine = pushdown.wrap(parseLine)
+        skipbytes = pushdown.skipbytes
+        skipping = not pushdown.wantCategory(category)
+    if profile is not None:
+        parseLine = profile.timed('line parsing', profile.counted(parseLine))
+    encoding = locale.getpreferredencoding(False)  # as open() uses
+    if end is None:
+        end = len(buf)
+    release = isinstance(buf, mmap.mmap) and hasattr(mmap, 'MADV_DONTNEED')
+    released = start - start % mmap.PAGESIZE
 
-    filter_settings.show_line_nums = True if cliopts.line_numbers else False
+    pos = start
+    while pos < end:
+        # Next window, up to the end of a line
+        if end - pos <= MMAP_WINDOW:
+            stop = end
+        else:
+            stop = buf.rfind(b'\n', pos, pos + MMAP_WINDOW) + 1
+            if stop == 0:  # very long line
+                stop = buf.find(b'\n', pos + MMAP_WINDOW, end) + 1 or end
+        window = buf[pos:stop]
+        if release:  # drop pages already read from our RSS
+            done = stop - stop % mmap.PAGESIZE
+            if done > released:
+                buf.madvise(mmap.MADV_DONTNEED, released, done - released)
+                released = done
+        pos = stop
 
-    # Open the file and give it to the parsing function.
-    todoFile = open(todopath)
-    todoList = parseTodoFile(todoFile)
-    todoFile.close()
+        for line in window.splitlines():
+            linecount += 1
+            if not line:
+                continue  # skip blanks
+            first = line[0]
+            if first == 35:  # '#' - skip comments
+                continue
+            if first == 91:  # '[' - handle categories
+                category = sys.intern(line.decode(encoding).lstrip('[').rstrip(']'))
+                if pushdown is not None:
+                    skipping = not pushdown.wantCategory(category)
+                continue
+            line = line.decode(encoding)
+            if line.isspace():
+                continue
+            if skipping or first in skipbytes:  # excluded category or type
+                if not checkTodoLine(line):
+                    errors.append(linecount)
+                continue
+            todoitem = parseLine(line, linecount, category)
+            if todoitem:
+                append(todoitem)
+            elif todoitem is None:  # False if filtered out
+                errors.append(linecount)
 
-    # Sort
-    if droid is None:
-        todoList.sort(key=lambda x: x.daysAway(), \
-                      reverse=not cliopts.reverse)
-    else:  # android always newest on top
-        todoList.sort(key=lambda x: x.daysAway(), reverse=False)
-    if cliopts.sort_cat:
-        todoList.sort(key=lambda x: x.category)
+    addCount('lines read', linecount - firstline)
+    return (ret, errors, linecount)
 
-    # Misc display options
-    if cliopts.two_lines:
-        settings['display']['two_lines'] = True
-    if cliopts.monochrome:
-        settings['display']['use_colours'] = False
 
-    # Display items
-    if droid is None:
-        for item in todoList:
-            print(item.prettyPrintStr())
-    else:  # droid - display in listview
-        categories = list()
-        for item in todoList:
-            if item.category is None:
-                # no duplicates
-                if 0 == categories.count("[Uncategorized]"):
-                    categories.append("[Uncategorized]")
-            else:
-                # no duplicates
-                if 0 == categories.count(item.category):
-                    categories.append(item.category)
+def readTodoMmap(todopath, parseLine=parseTodoLine, pushdown=None, ret=None):
+    '''As readTodoItems, for the named file using readTodoBytes'''
+    import mmap
+    with open(todopath, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ([] if ret is None else ret, [])  # can't mmap an empty file
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            (ret, errors, linecount) = readTodoBytes(buf, parseLine=parseLine,
+                                                     pushdown=pushdown, ret=ret)
+    return (ret, errors)
 
-        # TODO: Option for [Add Item] ? In each category?
-        todoselection = None
 
-        while todoselection == None:
-            try:
-                droid.dialogCreateAlert('Todo Categories:', '')
-                droid.dialogSetItems(categories)
-                droid.dialogShow()
+def readTodoRange(data, start, end, parseLine=parseTodoLine,
+                  linecount=0, category=None, reader='text', pushdown=None):
+    '''As readTodoLines, for data[start:end] (bytes) using one of
+       the READERS'''
+    if reader == 'mmap':
+        return readTodoBytes(data, start, end, parseLine, linecount, category,
+                             pushdown)
+    # Decode the same way open() would
+    return readTodoLines(io.TextIOWrapper(io.BytesIO(data[start:end])),
+                         parseLine, linecount, category, pushdown)
 
-                # triggers an exception if back key used
-                cat = categories[droid.dialogGetResponse().result['item']]
-                if cat == "[Uncategorized]":
-                    cat = None
 
-            except:
-                sys.exit()  # back pressed in cat menu
+# Parsed file cache
+#
+# The unfiltered items of each todo file are kept in
+# CACHEDIR/<hash of path>.bin as two marshalled objects: a header
+# (CACHE_VERSION, path, size, mtime, sha1 of contents) preceded by its
+# length, and then the syntax errors, item records and category blocks
+# (see parseBlocks). If the size and mtime match the header the records
+# are used directly; otherwise the file is hashed and only the blocks
+# that really changed are reparsed.
+#
+# Records store dates as ordinals rather than days away, as TodoItems
+# do, so a cached parse stays valid after TODAY changes; all the
+# filtering still happens on every run. Only the default line parser's
+# items are cached: with another --parser the file is always parsed,
+# so that the engines really are compared.
+CACHE_VERSION = 5
 
-            try:
-                items = []
-                for item in todoList:
-                    if item.category == cat:
-                        items.append(item.prettyPrintStr())
 
-                droid.dialogCreateAlert('Todo List:', cat)
-                droid.dialogSetItems(items)
-                droid.dialogShow()
+def itemRecord(item, lineoffset=0):
+    '''Returns a tuple of marshallable fields for a TodoItem, with
+       lineoffset subtracted from the line number'''
+    return (item.type, item.desc, item.linenum - lineoffset, item.category,
+            item.ordinal, item.wake, item._days, item.recurrence)
+
+
+def itemsFromRecords(records, lineoffset=0, ret=None):
+    '''Inverse of itemRecord for a list of records. The items are appended to ret if given.
+       This is the hot loop of a cache hit, so they are built inline.'''
+    if ret is None:
+        ret = []
+    append = ret.append
+    new = TodoItem.__new__
+    for (type, desc, linenum, category, ordinal, wake, days, recurrence) in records:
+        item = new(TodoItem)
+        item.type = type
+        item.desc = desc
+        item.linenum = linenum + lineoffset
+        item.category = category
+        item.ordinal = ordinal
+        item._days = days
+        item.wake = wake
+        item.recurrence = recurrence
+        item.source = None
+        if recurrence is None:
+            item.recur = None
+        else:
+            item.recur = nextRecurrence(dateFromOrdinal(ordinal), recurrence)
+        append(item)
+    return ret
+
 
-                # triggers an exception if back key used
-                todoselection = droid.dialogGetResponse().result['item']
-            except:
-                pass  # do nothing; goes back to cat menu
+def cachePath(todopath, suffix='.bin'):
+    '''Returns the name of the cache file for the given todo file'''
+    import hashlib
+    key = hashlib.sha1(os.path.abspath(todopath).encode()).hexdigest()
+    return os.path.join(settings['paths']['cachedir'], key + suffix)
 
-                # end while for displaying listview
-                # action on selected todo item
-                # XXX: menu with options, date/time picker etc?
-                # TODO: newline = droid.dialogGetInput('Edit Entry',  oldline, oldline).result
 
+def _readCache(cachefile):
+    '''Returns (header, file object positioned at the records) or
+       (None, None) if there is no usable cache file'''
+    try:
+        f = open(cachefile, 'rb')
+    except OSError:
+        return (None, None)
+    try:
+        (length,) = struct.unpack('<I', f.read(4))
+        header = marshal.loads(f.read(length))
+        if header[0] == CACHE_VERSION:
+            return (header, f)
+    except (EOFError, ValueError, TypeError, IndexError, struct.error):
+        pass
+    f.close()
+    return (None, None)
 
-                # end else for droid displayitems
 
-# end if main
+def _writeCache(cachefile, header, body):
+    '''Writes the cache file atomically; failures are ignored as the
+       cache is only an optimisation'''
+    try:
+        os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+        tmpname = '%s.%d' % (cachefile, os.getpid())
+        header = marshal.dumps(header)
+        with open(tmpname, 'wb') as f:
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            f.write(marshal.dumps(body))
+        os.replace(tmpname, cachefile)
+    except OSError:
+        pass
+
+
+cache_stats = False  # count cache results in the stats file (--cache-stats, --profile)
+
+def _updateCacheStats(result):
+    '''Counts a cache result ('hit', 'rehash', 'partial' or 'miss')
+       in the stats file if cache_stats is set; see --cache-stats. The
+       file is replaced atomically, though two runs at once may both
+       count over the same old stats and lose one of the results.'''
+    addCount('cache %s' % result)
+    if not cache_stats:
+        return
+    stats = readCacheStats()
+    stats[result] = stats.get(result, 0) + 1
+    statsfile = os.path.join(settings['paths']['cachedir'], 'stats')
+    try:
+        os.makedirs(settings['paths']['cachedir'], exist_ok=True)
+        (fd, tmppath) = tempfile.mkstemp(dir=settings['paths']['cachedir'], prefix='.stats.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump(stats, f)
+            os.replace(tmppath, statsfile)
+        except BaseException:
+            os.unlink(tmppath)
+            raise
+    except OSError:
+        pass
+
+
+def readCacheStats():
+    try:
+        with open(os.path.join(settings['paths']['cachedir'], 'stats'), 'rb') as f:
+            return marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return {}
+
+
+# Parallel parsing (--jobs)
+#
+# The file contents are split at line boundaries into pieces which are
+# parsed in a process pool. A piece doesn't start with the category in
+# effect at its first line, so that is found beforehand (categoryAt)
+# and passed in along with the number of lines before the piece; the
+# workers send back records (see itemRecord) which are turned into
+# items in the original order. Lines end with '\n', '\r\n' or a lone
+# '\r' (LINE_ENDING), as the text reader sees them, so pieces and line
+# counts match a serial parse whatever the line endings.
+PARALLEL_PIECES = 4  # pieces per job, to even out the load
+LINE_ENDING = re.compile(rb'\r\n?|\n')  # as for a text file read with newline=''
+
+def countLines(data, start, end):
+    '''Returns the number of line endings in data[start:end] (which
+       doesn't split a '\r\n')'''
+    count = data.count(b'\n', start, end)
+    if data.find(b'\r', start, end) == -1:
+        return count
+    return count + data.count(b'\r', start, end) - data.count(b'\r\n', start, end)
+
+
+def categoryAt(data, offset):
+    '''Returns the category in effect at the line starting at byte
+       offset of the todo file contents data'''
+    pos = data.rfind(b'\n[', 0, offset) + 1
+    pos = data.rfind(b'\r[', pos, offset) + 1 or pos  # after an old Mac line ending
+    if pos == 0 and (offset == 0 or not data.startswith(b'[')):
+        return None
+    mat = LINE_ENDING.search(data, pos, offset)
+    end = offset if mat is None else mat.end()
+    # Decode the same way open() would
+    line = io.TextIOWrapper(io.BytesIO(data[pos:end])).readline()
+    return sys.intern(line.lstrip('[').rstrip(']\n'))
+
+
+def splitLines(data, start, end, size):
+    '''Returns a list of (start, end) byte offsets splitting
+       data[start:end] at line boundaries into pieces of about size'''
+    ret = []
+    while end - start > size:
+        mat = LINE_ENDING.search(data, start + size - 1, end)
+        if mat is None or mat.end() == end:
+            break
+        pos = mat.end()
+        ret.append((start, pos))
+        start = pos
+    ret.append((start, end))
+    return ret
+
+
+def _parsePieces(pieces, engine, reader, pushdown):
+    '''Process pool worker: parses a list of (bytes, category,
+       linecount) pieces, returning a list of (records, errors,
+       linecount) for each as readTodoLines does and the profile
+       counts for them (None if not profiling)'''
+    if profile is not None:
+        profile.counts.clear()  # a forked copy; only this task's are sent back
+    parseLine = PARSER_ENGINES[engine]
+    ret = []
+    for (chunk, category, linecount) in pieces:
+        (items, errors, linecount) = readTodoRange(
+            chunk, 0, len(chunk), parseLine, linecount, category, reader, pushdown)
+        ret.append(([itemRecord(i) for i in items], errors, linecount))
+    return (ret, None if profile is None else dict(profile.counts))
+
+
+def parsePieces(pieces, parseLine=parseTodoLine, jobs=2, reader='text',
+                pushdown=None):
+    '''Parses a list of (bytes, category, linecount) pieces using
+       jobs processes; returns the results of _parsePieces in order'''
+    import concurrent.futures
+    engine = [name for name in PARSER_ENGINES if PARSER_ENGINES[name] is parseLine][0]
+    target = sum(len(piece[0]) for piece in pieces) // (jobs * PARALLEL_PIECES) + 1
+    tasks = [[]]
+    size = 0
+    for piece in pieces:
+        if size >= target:
+            tasks.append([])
+            size = 0
+        tasks[-1].append(piece)
+        size += len(piece[0])
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        results = list(pool.map(_parsePieces, tasks, [engine] * len(tasks),
+                                [reader] * len(tasks), [pushdown] * len(tasks)))
+    for (task, counts) in results:
+        if counts and profile is not None:
+            profile.counts.update(counts)
+    return [result for (task, counts) in results for result in task]
+
+
+def parseParallel(data, parseLine=parseTodoLine, jobs=2, reader='text',
+                  pushdown=None, ret=None):
+    '''Parses the todo file contents data (bytes) using jobs
+       processes; returns (items, errors) as readTodoItems does'''
+    pieces = []
+    linecount = 0
+    last = 0
+    for (start, end) in splitLines(data, 0, len(data),
+                                   len(data) // (jobs * PARALLEL_PIECES) + 1):
+        linecount += countLines(data, last, start)
+        last = start
+        pieces.append((data[start:end], categoryAt(data, start), linecount))
+    items = [] if ret is None else ret
+    errors = []
+    for (records, errs, linecount) in parsePieces(pieces, parseLine, jobs, reader,
+                                                  pushdown):
+        itemsFromRecords(records, 0, items)
+        errors.extend(errs)
+    return (items, errors)
+
+
+def _parseBlocksParallel(data, blocks, parseLine, jobs, reader):
+    '''Parses the given (index, (start, end)) blocks of data using
+       jobs processes; returns a dict of index -> (records, errors,
+       nlines) with line numbers relative to the start of the block'''
+    size = sum(end - start for (index, (start, end)) in blocks) // (jobs * PARALLEL_PIECES) + 1
+    pieces = []
+    owners = []
+    for (index, (start, end)) in blocks:
+        for (pstart, pend) in splitLines(data, start, end, size):
+            pieces.append((data[pstart:pend], categoryAt(data, pstart),
+                           countLines(data, start, pstart)))
+            owners.append(index)
+    ret = {}
+    results = parsePieces(pieces, parseLine, jobs, reader)
+    for (index, (records, errors, linecount)) in zip(owners, results):
+        if index in ret:
+            (oldrecords, olderrors, nlines) = ret[index]
+            ret[index] = (oldrecords + records, olderrors + errors, linecount)
+        else:
+            ret[index] = (records, errors, linecount)
+    return ret
+
+
+# Incremental reparsing
+#
+# A changed file is split into blocks at each [category] line (plus
+# the uncategorised block before the first one); categories never
+# carry over a block boundary, so every block can be parsed on its
+# own. The cache keeps the byte range, line range, sha1 and the slice
+# of records/errors for every block, and only blocks whose sha1 isn't
+# in the old cache are parsed again. Line numbers in the records and
+# errors are relative to the start of their block, so reused blocks
+# can move when lines are added or removed above them.
+_blockStart = re.compile(br'(?:^|(?<=\r))\[', re.M)  # lines may end with \r alone
+
+def splitBlocks(data):
+    '''Returns a list of (start, end) byte offsets of the category
+       blocks in data'''
+    starts = [mat.start() for mat in _blockStart.finditer(data)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    return list(zip(starts, starts[1:] + [len(data)]))
+
+
+def _oldBlocks(body):
+    '''Returns a dict of sha1 -> (records, errors, nlines) for the
+       blocks of an old cache body'''
+    (errors, records, blocks) = body
+    ret = {}
+    for (digest, line, start, length, nlines, rec, nrecs, err, nerrs) in blocks:
+        ret[digest] = (records[rec:rec+nrecs], errors[err:err+nerrs], nlines)
+    return ret
+
+
+def _blockItems(body, pushdown=None, items=None):
+    '''Returns (items, errors) from a cache body, only building the
+       items a FilterPushdown includes if one is given'''
+    (errors, records, blocks) = body
+    if items is None:
+        items = []
+    ret = []
+    for (digest, line, start, length, nlines, rec, nrecs, err, nerrs) in blocks:
+        ret.extend(e + line for e in errors[err:err+nerrs])
+        if not nrecs:
+            continue
+        recs = records[rec:rec+nrecs]
+        addCount('records read from cache', nrecs)
+        if pushdown is not None:
+            if not pushdown.wantCategory(recs[0][3]):
+                addCount('filtered out by category block', nrecs)
+                continue  # the whole block is excluded
+            includes = pushdown.includesRecord
+            recs = [r for r in recs if includes(r, line)]
+            addCount('filtered out from cache', nrecs - len(recs))
+        itemsFromRecords(recs, line, items)
+    return (items, ret)
+
+
+def parseBlocks(data, parseLine=parseTodoLine, oldblocks={}, jobs=1, reader='text'):
+    '''Parses the todo file contents data (bytes), reusing the records
+       of any blocks found in oldblocks. Returns (items, errors, body,
+       reused) where body is the new cache body.'''
+    import hashlib
+    items = []
+    errors = []
+    records = []
+    blockerrors = []
+    blocks = []
+    reused = 0
+    linecount = 0
+    view = memoryview(data)
+    spans = splitBlocks(data)
+    digests = [hashlib.sha1(view[start:end]).digest() for (start, end) in spans]
+    parsed = {}
+    if jobs > 1:
+        parsed = _parseBlocksParallel(data, [(index, span) for (index, span) in enumerate(spans) \
+                                             if digests[index] not in oldblocks], \
+                                      parseLine, jobs, reader)
+    for (index, (start, end)) in enumerate(spans):
+        digest = digests[index]
+        old = oldblocks.get(digest)
+        if old is not None:
+            reused += 1
+        else:
+            old = parsed.get(index)
+        if old is not None:
+            (recs, errs, nlines) = old
+            itemsFromRecords(recs, linecount, items)
+            errors.extend(e + linecount for e in errs)
+        else:
+            (blockitems, errs, last) = readTodoRange(data, start, end, parseLine,
+                                                     linecount, None, reader)
+            items.extend(blockitems)
+            errors.extend(errs)
+            recs = [itemRecord(i, linecount) for i in blockitems]
+            errs = [e - linecount for e in errs]
+            nlines = last - linecount
+        blocks.append((digest, linecount, start, end - start, nlines,
+                       len(records), len(recs), len(blockerrors), len(errs)))
+        records.extend(recs)
+        blockerrors.extend(errs)
+        linecount += nlines
+    return (items, errors, (blockerrors, records, blocks), reused)
+
+
+def loadTodoBody(todopath, parseLine=parseTodoLine, jobs=1, reader='text', usecache=True):
+    '''Returns (header, body, items, errors) for the named file: the
+       header and body of its parsed file cache, which is brought up to
+       date first, and if the file had to be parsed the unfiltered
+       items and the syntax errors (otherwise None, None). Without
+       usecache the file is always parsed and the cache is left alone.'''
+    import hashlib
+    usecache = usecache and parseLine is parseTodoLine
+    path = os.path.abspath(todopath)
+    (size, mtime) = todoStat(path)
+    cachefile = cachePath(path)
+    oldblocks = {}
+    header = None
+    if usecache:
+        with stage('cache read'):
+            (header, cached) = _readCache(cachefile)
+        try:
+            if header is not None:
+                with stage('cache read'):
+                    body = marshal.loads(cached.read())
+                if header[1:4] == (path, size, mtime):
+                    _updateCacheStats('hit')
+                    return (header, body, None, None)
+                oldblocks = _oldBlocks(body)
+        except (EOFError, ValueError, TypeError):
+            pass  # corrupt cache, reparse
+        finally:
+            if cached is not None:
+                cached.close()
+
+    with stage('parse'):
+        data = readTodoData(path)
+        (items, errors, body, reused) = parseBlocks(data, parseLine, oldblocks, jobs, reader)
+    digest = hashlib.sha1(b''.join(b[0] for b in body[2])).hexdigest()
+    newheader = (CACHE_VERSION, path, size, mtime, digest)
+    if not usecache:
+        return (newheader, body, items, errors)
+    if header is not None and header[4] == digest:
+        _updateCacheStats('rehash')  # touched, not changed
+    elif reused:
+        _updateCacheStats('partial')
+    else:
+        _updateCacheStats('miss')
+    with stage('cache write'):
+        _writeCache(cachefile, newheader, body)
+    return (newheader, body, items, errors)
+
+
+def loadTodoFile(todopath, parseLine=parseTodoLine, usecache=True, jobs=1,
+                 reader='text', pushdown=None, ret=None):
+    '''Returns (items, errors) for the named file as readTodoItems
+       does, using the parsed file cache unless usecache is false.
+       If jobs > 1 anything that needs parsing is done in parallel.
+       reader is one of the READERS. If a FilterPushdown is given,
+       only the items it includes are returned. If ret is given the
+       items are appended to it as they are loaded.'''
+    if not usecache or parseLine is not parseTodoLine:
+        with stage('parse'):
+            if jobs > 1:
+                return parseParallel(readTodoData(todopath), parseLine, jobs, reader, pushdown, ret)
+            if reader == 'mmap' and not os.path.exists(journalPath(todopath)):
+                return readTodoMmap(todopath, parseLine, pushdown, ret)
+            with openTodoFile(todopath) as todoFile:
+                return readTodoItems(todoFile, parseLine, pushdown, ret)
+
+    if pushdown is not None and pushdown.search:
+        (items, errors) = searchTodoFile(todopath, pushdown.search, parseLine, jobs, reader)
+    else:
+        (header, body, items, errors) = loadTodoBody(todopath, parseLine, jobs, reader)
+        if items is None:
+            with stage('build items'):
+                return _blockItems(body, pushdown, ret)
+    if pushdown is not None:
+        with stage('filter'):
+            included = [item for item in items if pushdown.includes(item)]
+        addCount('filtered out after parsing', len(items) - len(included))
+        items = included
+    if ret is not None:
+        for item in items:
+            ret.append(item)
+        items = ret
+    return (items, errors)
+
+
+# Summary counts (--stats, --count)
+#
+# Counted straight from the records of the parsed file cache (see
+# itemRecord) with FilterPushdown.includesRecord, so no TodoItems are
+# built and nothing is sorted: with the cache up to date this is cheap
+# enough to run for every shell prompt. The daemon counts the items it
+# has loaded instead.
+STATS_WHEN = ('overdue', 'today', 'this week', 'later', 'wishlist')
+
+class TodoStats(object):
+    '''Counts of the todo items the filters include, by type, by
+       category and by when they are due (STATS_WHEN, wishlist being
+       the items without a date or days away), and of syntax errors'''
+    def __init__(self):
+        self.types = collections.Counter()
+        self.categories = collections.Counter()  # in the order first seen
+        self.when = collections.Counter()
+        self.errors = 0
+
+    @property
+    def count(self):
+        return sum(self.types.values())
+
+    def _countDays(self, days):
+        when = self.when
+        for days in days:
+            if days is None:
+                when['wishlist'] += 1
+            elif days < 0:
+                when['overdue'] += 1
+            elif days == 0:
+                when['today'] += 1
+            elif days < 7:
+                when['this week'] += 1
+            else:
+                when['later'] += 1
+
+    def addRecords(self, body, pushdown=None):
+        '''Counts the records of a cache body that the FilterPushdown
+           (if any) includes'''
+        (errors, records, blocks) = body
+        self.errors += len(errors)
+        today = TODAY_ORDINAL
+        for (digest, line, start, length, nlines, rec, nrecs, err, nerrs) in blocks:
+            if not nrecs:
+                continue
+            recs = records[rec:rec+nrecs]
+            if pushdown is not None:
+                if not pushdown.wantCategory(recs[0][3]):
+                    continue  # the whole block is excluded
+                includes = pushdown.includesRecord
+                recs = [r for r in recs if includes(r, line)]
+                if not recs:
+                    continue
+            self.categories[recs[0][3]] += len(recs)  # one category a block
+            self.types.update(r[0] for r in recs)
+            self._countDays(r[6] if r[4] is None else r[4] - today for r in recs)
+
+    def addItems(self, items, errors, pushdown=None):
+        '''Counts the items the FilterPushdown (if any) includes'''
+        self.errors += len(errors)
+        if pushdown is not None:
+            items = [item for item in items if pushdown.includes(item)]
+        self.categories.update(item.category for item in items)
+        self.types.update(item.type for item in items)
+        self._countDays(item._days if item.ordinal is None else item.ordinal - TODAY_ORDINAL
+                        for item in items)
+
+    def asDict(self):
+        '''The counts as a JSON object, '' being no category'''
+        counts = {'items': self.count, 'syntax errors': self.errors,
+                  'types': dict(sorted(self.types.items())),
+                  'categories': dict(('' if category is None else category, count)
+                                     for (category, count) in self.categories.items())}
+        counts.update((when, self.when[when]) for when in STATS_WHEN)
+        return counts
+
+    def report(self, out=None, format='text', count=False):
+        '''Writes the counts, or just the number of items if count, as
+           text or as a line of JSON (format jsonl) to out (default
+           stdout)'''
+        import json
+        out = out or sys.stdout
+        if format == 'jsonl':
+            out.write(json.dumps({'items': self.count} if count else self.asDict()) + '\n')
+            return
+        if count:
+            out.write('%d\n' % self.count)
+            return
+        out.write('%-26s %10d\n' % ('items', self.count))
+        for when in STATS_WHEN:
+            out.write('  %-24s %10d\n' % (when, self.when[when]))
+        out.write('%-26s %10d\n' % ('syntax errors', self.errors))
+        out.write('by type\n')
+        for (type, count) in sorted(self.types.items()):
+            out.write('  %-24s %10d\n' % (type, count))
+        out.write('by category\n')
+        for (category, count) in self.categories.items():
+            out.write('  %-24s %10d\n' % ('(none)' if category is None else category, count))
+
+
+# Columnar backend (--backend=columnar)
+#
+# For very big files, most of the time of a query goes on building a
+# TodoItem for every item and calling daysAway() and the filters on
+# each. The columnar backend keeps the items of a file as parallel
+# arrays instead (type, date ordinal, days, wake, category id, line
+# number, and the descriptions packed into one string with offsets),
+# stored in CACHEDIR/<hash of path>.col next to the parsed file cache
+# and rebuilt from its records when the file changes. Days away, the
+# option filters and the sort are then worked out on whole columns,
+# with NumPy if it is installed, and TodoItems are only built for the
+# items shown. A --where expression is checked row by row, on the rows
+# the option filters leave. NumPy takes longer to import than most
+# runs take, so it is only imported when columns are first made.
+numpy = False  # not imported yet; see importNumpy
+
+def importNumpy():
+    '''Returns the numpy module, imported on the first call, or None if
+       it isn't installed'''
+    global numpy
+    if numpy is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+    return numpy
+
+
+BACKENDS = ('objects', 'columnar')
+COLUMN_NONE = -2**63  # missing days or wake
+COLUMN_MAX = 2**62  # larger numbers are stored as this; further than any cutoff
+
+
+def _columnInt(value):
+    return COLUMN_NONE if value is None else min(value, COLUMN_MAX)
+
+
+class TodoColumns(object):
+    '''The items of a todo file as columns (see fromBody). Integer
+       columns are NumPy arrays if NumPy is available, otherwise
+       memoryviews of the packed bytes.'''
+    # (name, array typecode) of the columns, in the order stored
+    COLUMNS = (('types', 'B'), ('ordinals', 'i'), ('days', 'q'), ('wakes', 'q'),
+               ('catids', 'i'), ('lines', 'i'), ('descends', 'q'),
+               ('recurops', 'B'), ('recurlengths', 'q'), ('recurunits', 'B'))
+
+    def __init__(self, state):
+        '''state is as returned by getState: the packed bytes of each of
+           the COLUMNS, then the category names, the descriptions (UTF-8)
+           and the syntax errors'''
+        importNumpy()
+        for ((name, typecode), data) in zip(self.COLUMNS, state):
+            if numpy is not None:
+                column = numpy.frombuffer(data, dtype=numpy.dtype(typecode))
+            else:
+                column = memoryview(data).cast(typecode)
+            setattr(self, name, column)
+        (self.categories, self.descs, self.errors) = state[len(self.COLUMNS):]
+        self.count = len(self.types)
+
+    @classmethod
+    def fromBody(cls, body):
+        '''Builds the columns from a parsed file cache body'''
+        (errors, records, blocks) = body
+        columns = dict((name, array.array(typecode)) for (name, typecode) in cls.COLUMNS)
+        categories = [None]
+        catids = {None: 0}
+        descs = []
+        descend = 0
+        allerrors = []
+        for (digest, line, start, length, nlines, rec, nrecs, err, nerrs) in blocks:
+            allerrors.extend(e + line for e in errors[err:err+nerrs])
+            for (type, desc, linenum, category, ordinal, wake, days, recurrence) in \
+                    records[rec:rec+nrecs]:
+                try:
+                    catid = catids[category]
+                except KeyError:
+                    catid = catids[category] = len(categories)
+                    categories.append(category)
+                desc = desc.encode('utf-8', 'surrogatepass')
+                descs.append(desc)
+                descend += len(desc)
+                if recurrence is None:
+                    recurrence = ('\0', 0, '\0')
+                for (name, value) in (('types', ord(type)), ('ordinals', ordinal or 0),
+                                      ('days', _columnInt(days)), ('wakes', _columnInt(wake)),
+                                      ('catids', catid), ('lines', linenum + line),
+                                      ('descends', descend),
+                                      ('recurops', ord(recurrence[0])),
+                                      ('recurlengths', min(recurrence[1], COLUMN_MAX)),
+                                      ('recurunits', ord(recurrence[2]))):
+                    columns[name].append(value)
+        state = [columns[name].tobytes() for (name, typecode) in cls.COLUMNS]
+        return cls(state + [categories, b''.join(descs), allerrors])
+
+    def getState(self):
+        '''Returns the state to store (see __init__)'''
+        return [bytes(getattr(self, name)) for (name, typecode) in self.COLUMNS] + \
+               [self.categories, self.descs, self.errors]
+
+    def daysAway(self, today, cutoff):
+        '''Returns the days away of every row, as TodoItem.daysAway'''
+        if numpy is not None:
+            days = numpy.where(self.days == COLUMN_NONE, cutoff, self.days)
+            return numpy.where(self.ordinals != 0, self.ordinals.astype(numpy.int64) - today,
+                               days)
+        return [ordinal - today if ordinal else (cutoff if days == COLUMN_NONE else days)
+                for (ordinal, days) in zip(self.ordinals, self.days)]
+
+    def select(self, pushdown, days):
+        '''Returns the rows (in file order) the FilterPushdown includes,
+           or all of them if it is None'''
+        allrows = numpy.arange(self.count) if numpy is not None else range(self.count)
+        if pushdown is None:
+            return allrows
+        if pushdown.filtering:
+            typeok = [chr(code) in pushdown.types for code in range(256)]
+            catok = [pushdown.wantCategory(category) for category in self.categories]
+            cutoff = pushdown.days_cutoff
+            if numpy is not None:
+                mask = numpy.array(typeok)[self.types] & numpy.array(catok, dtype=bool)[self.catids]
+                mask &= (self.wakes == COLUMN_NONE) | (self.wakes >= days)
+                mask &= days <= cutoff
+                rows = numpy.flatnonzero(mask)
+            else:
+                rows = [row for (row, type, catid, wake, away) in
+                        zip(range(self.count), self.types, self.catids, self.wakes, days)
+                        if typeok[type] and catok[catid] and away <= cutoff and
+                        (wake == COLUMN_NONE or wake >= away)]
+        else:
+            rows = allrows
+        if pushdown.wheretext:
+            where = compileFilter(parseWhere(pushdown.wheretext), True, pushdown.today,
+                                  pushdown.days_cutoff)
+            rows = [row for row in rows if where(self.record(row))]
+            if numpy is not None:
+                rows = numpy.array(rows, dtype=numpy.intp)
+        return rows
+
+    def sortRows(self, rows, days, descending=True, limit=None):
+        '''Returns rows sorted (stably) by days away, or only the limit
+           most urgent of them as UrgentItems would'''
+        if numpy is not None:
+            keys = days[rows]
+            rows = rows[numpy.argsort(-keys if descending else keys, kind='stable')]
+        else:
+            rows = sorted(rows, key=days.__getitem__, reverse=descending)
+        if limit is not None:
+            rows = rows[-limit:] if descending else rows[:limit]
+        return rows
+
+    def record(self, row):
+        '''Returns the cache record (see itemRecord) of a row'''
+        row = int(row)
+        start = self.descends[row - 1] if row else 0
+        desc = self.descs[start:self.descends[row]].decode('utf-8', 'surrogatepass')
+        ordinal = int(self.ordinals[row]) or None
+        days = int(self.days[row])
+        wake = int(self.wakes[row])
+        recurrence = None
+        if self.recurops[row]:
+            recurrence = (chr(self.recurops[row]), int(self.recurlengths[row]),
+                          chr(self.recurunits[row]))
+        return (chr(self.types[row]), desc, int(self.lines[row]),
+                self.categories[self.catids[row]], ordinal,
+                None if wake == COLUMN_NONE else wake,
+                None if days == COLUMN_NONE else days, recurrence)
+
+    def items(self, rows, ret=None):
+        '''Returns the TodoItems for rows (appended to ret if given).
+           The columns are gathered for all the rows first, then the
+           items are built inline as in itemsFromRecords.'''
+        if numpy is not None:
+            rows = numpy.asarray(rows, dtype=numpy.intp)
+            take = lambda column: column[rows].tolist()
+            starts = numpy.where(rows > 0, self.descends[rows - 1], 0).tolist()
+        else:
+            take = lambda column: [column[row] for row in rows]
+            starts = [self.descends[row - 1] if row else 0 for row in rows]
+        if ret is None:
+            ret = []
+        append = ret.append
+        new = TodoItem.__new__
+        descs = self.descs
+        categories = self.categories
+        for (type, start, end, linenum, catid, ordinal, wake, days, recurop, length, unit) in \
+                zip(take(self.types), starts, take(self.descends), take(self.lines),
+                    take(self.catids), take(self.ordinals), take(self.wakes), take(self.days),
+                    take(self.recurops), take(self.recurlengths), take(self.recurunits)):
+            item = new(TodoItem)
+            item.type = chr(type)
+            item.desc = descs[start:end].decode('utf-8', 'surrogatepass')
+            item.linenum = linenum
+            item.category = categories[catid]
+            item.ordinal = ordinal or None
+            item._days = None if days == COLUMN_NONE else days
+            item.wake = None if wake == COLUMN_NONE else wake
+            item.source = None
+            if recurop:
+                item.recurrence = (chr(recurop), length, chr(unit))
+                item.recur = nextRecurrence(dateFromOrdinal(ordinal), item.recurrence)
+            else:
+                item.recurrence = item.recur = None
+            append(item)
+        return ret
+
+
+def loadTodoColumns(todopath, parseLine=parseTodoLine, usecache=True, jobs=1, reader='text'):
+    '''Returns the TodoColumns for the named file, from the columns
+       cache file if it is up to date, otherwise from the parsed file
+       cache (brought up to date) and written to the columns cache'''
+    usecache = usecache and parseLine is parseTodoLine
+    path = os.path.abspath(todopath)
+    (size, mtime) = todoStat(path)
+    colfile = cachePath(path, '.col')
+    if usecache:
+        with stage('cache read'):
+            (header, cached) = _readCache(colfile)
+            if header is not None:
+                try:
+                    with cached:
+                        if header[:4] == (CACHE_VERSION, path, size, mtime):
+                            return TodoColumns(marshal.loads(cached.read()))
+                except (EOFError, ValueError, TypeError):
+                    pass  # corrupt, rebuild
+    (header, body, items, errors) = loadTodoBody(path, parseLine, jobs, reader, usecache)
+    with stage('build columns'):
+        columns = TodoColumns.fromBody(body)
+    if usecache:
+        with stage('cache write'):
+            _writeCache(colfile, header[:4], columns.getState())
+    return columns
+
+
+def queryTodoColumns(cliopts, todopath, descending=True, ret=None):
+    '''queryTodoItems with the columnar backend'''
+    with stage('load'):
+        columns = loadTodoColumns(todopath, PARSER_ENGINES[cliopts.parser], \
+                                  usecache=not cliopts.no_cache, jobs=cliopts.jobs, \
+                                  reader=cliopts.reader)
+    with stage('filter'):
+        days = columns.daysAway(TODAY_ORDINAL, filter_settings.days_cutoff)
+        rows = columns.select(pushdownFilter(), days)
+    addCount('rows read from columns', columns.count)
+    addCount('filtered out from columns', columns.count - len(rows))
+    with stage('sort'):
+        if not (cliopts.no_sort or cliopts.group_cat and cliopts.limit is None):
+            rows = columns.sortRows(rows, days, descending, cliopts.limit)
+    with stage('build items'):
+        todoList = columns.items(rows, ret if cliopts.no_sort else None)
+    with stage('sort'):
+        if cliopts.group_cat:
+            if cliopts.limit is not None:  # back to file order for grouping
+                todoList = sorted(todoList, key=lambda x: x.linenum)
+            todoList = TodoIndex(todoList).grouped()
+        elif cliopts.sort_cat:
+            todoList = TodoIndex(todoList).grouped(sort=True)
+    return (todoList, list(columns.errors))
+
+
+# Line offset index
+#
+# To read or change a single line without scanning the file from the
+# top, the byte offset of the start of each line is kept in
+# CACHEDIR/<hash of path>.idx: a fixed size header (INDEX_MAGIC, size
+# and mtime of the todo file) and then the offsets as a packed array,
+# with the size of the file as the last entry. Line N is the bytes from
+# entry N-1 to entry N, so only those two entries are read. The index
+# is rebuilt when the size or mtime in the header don't match the file.
+INDEX_MAGIC = b'rtidx001'
+INDEX_HEADER = struct.Struct('<8sqq')
+
+
+def buildLineIndex(data):
+    '''Returns an array of the offsets of the start of each line of
+       data followed by len(data)'''
+    offsets = array.array(_indexType(len(data)), [0])
+    if b'\r' in data:
+        offsets.extend(mat.end() for mat in LINE_ENDING.finditer(data))
+    else:
+        find = data.find
+        pos = find(b'\n')
+        while pos >= 0:
+            offsets.append(pos + 1)
+            pos = find(b'\n', pos + 1)
+    if offsets[-1] != len(data):
+        offsets.append(len(data))  # the last line has no line ending
+    return offsets
+
+
+def _indexType(size):
+    '''Array typecode for the offsets of a file of this size'''
+    return 'I' if size < 2**32 else 'Q'
+
+
+def _writeIndex(indexfile, stat, offsets):
+    '''Writes the index file atomically; failures are ignored as for
+       the parsed file cache'''
+    try:
+        os.makedirs(os.path.dirname(indexfile), exist_ok=True)
+        tmpname = '%s.%d' % (indexfile, os.getpid())
+        with open(tmpname, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, stat.st_size, stat.st_mtime_ns))
+            offsets.tofile(f)
+        os.replace(tmpname, indexfile)
+    except OSError:
+        pass
+
+
+def lineSpans(file, linenums):
+    '''Returns {linenum: (start, end)} with the byte offsets of the given
+       lines (line endings included) of the open binary todo file,
+       leaving out numbers with no line. Uses the line offset index,
+       building it first if it is out of date.'''
+    stat = os.fstat(file.fileno())
+    indexfile = cachePath(file.name, '.idx')
+    try:
+        with open(indexfile, 'rb') as f:
+            header = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+            if header == (INDEX_MAGIC, stat.st_size, stat.st_mtime_ns):
+                typecode = _indexType(stat.st_size)
+                itemsize = array.array(typecode).itemsize
+                count = (os.fstat(f.fileno()).st_size - INDEX_HEADER.size) // itemsize - 1
+                spans = {}
+                for num in linenums:
+                    if 1 <= num <= count:
+                        f.seek(INDEX_HEADER.size + (num - 1) * itemsize)
+                        pair = array.array(typecode)
+                        pair.fromfile(f, 2)
+                        spans[num] = tuple(pair)
+                return spans
+    except (OSError, EOFError, struct.error):
+        pass  # no usable index
+
+    file.seek(0)
+    offsets = buildLineIndex(file.read())
+    _writeIndex(indexfile, stat, offsets)
+    return dict((num, (offsets[num - 1], offsets[num]))
+                for num in linenums if 1 <= num < len(offsets))
+
+
+def _touchIndex(file):
+    '''Updates the header of the line offset index for the open todo
+       file after it has been changed without moving any lines'''
+    stat = os.fstat(file.fileno())
+    try:
+        with open(cachePath(file.name, '.idx'), 'r+b') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, stat.st_size, stat.st_mtime_ns))
+    except OSError:
+        pass
+
+
+def readLineAt(todopath, linenum):
+    '''Returns line linenum of the todo file, with its line ending, or
+       None if there is no such line'''
+    if linenum < 1:
+        return None
+    if os.path.exists(journalPath(todopath)):  # no index of the edited lines
+        with openTodoFile(todopath) as f:
+            return next(itertools.islice(f, linenum - 1, None), None)
+    with open(todopath, 'rb') as f:
+        span = lineSpans(f, [linenum]).get(linenum)
+        if span is None:
+            return None
+        f.seek(span[0])
+        return f.read(span[1] - span[0]).decode(locale.getpreferredencoding(False))
+
+
+# Search index (--search)
+#
+# --search finds the items with words starting with each of the search
+# words in their description or category, ignoring case. It is added to
+# --where as regex searches (see searchWhere), so every kind of query
+# takes it, but for files loaded from the parsed file cache the search
+# index finds the lines without looking at the other items: only those
+# lines are read (with the line offset index) and parsed, and then go
+# through the filters as usual.
+#
+# The index is CACHEDIR/<hash of path>.words, rebuilt from the cache
+# records when the todo file (or its journal) changes: SEARCH_HEADER
+# (SEARCH_MAGIC, CACHE_VERSION, todoStat of the file and the counts of
+# the sections), then the end offsets of each of the sorted words (in
+# UTF-8) and of their lists of line numbers, the category blocks as
+# the end offsets of their names and their first lines, then the lines
+# of each word, the lines with syntax errors, the words and the
+# category names. It is read with mmap, binary searching the words for
+# the range starting with each search word, so a lookup doesn't
+# depend on the size of the file.
+SEARCH_MAGIC = b'rtwrd001'
+SEARCH_HEADER = struct.Struct('<8sqqqqqqqq')
+SEARCH_WORD = re.compile(r'\w+')
+
+
+def searchWords(text):
+    '''Returns the words to search for in --search text'''
+    return tuple(SEARCH_WORD.findall(text.lower()))
+
+
+def searchWhere(words, where=None):
+    '''Returns a --where expression for items with words starting with
+       each of the words in their description or category, and where'''
+    terms = ['(desc ~ "(?i)(?<!\\\\w)%s" or cat ~ "(?i)(?<!\\\\w)%s")' % (word, word)
+             for word in words]
+    if where:
+        terms.append('(%s)' % where)
+    return ' and '.join(terms)
+
+
+class SearchIndex(object):
+    '''A search index (see above) in a bytes-like buffer'''
+    def __init__(self, buf):
+        self.buf = buf
+        header = SEARCH_HEADER.unpack_from(buf)
+        (magic, version, size, mtime, nwords, nlines, nblocks, nerrors, uncategorised) = header
+        self.key = (magic, version, size, mtime)
+        view = memoryview(buf)
+        pos = SEARCH_HEADER.size
+        sections = []
+        for (typecode, count) in (('Q', nwords), ('Q', nwords), ('Q', nblocks), ('Q', nblocks),
+                                  ('I', nlines), ('I', nerrors)):
+            end = pos + count * array.array(typecode).itemsize
+            sections.append(view[pos:end].cast(typecode))
+            pos = end
+        (self.wordends, self.lineends, self.catends, self.blocklines,
+         self.lines, self.errors) = sections
+        self.words = view[pos:pos + (self.wordends[-1] if nwords else 0)]
+        self.categories = view[pos + len(self.words):]
+        self.uncategorised = uncategorised
+
+    @classmethod
+    def build(cls, key, body):
+        '''Returns a SearchIndex of the records of a cache body, for a
+           todo file with todoStat key'''
+        (errors, records, blocks) = body
+        wordlines = collections.defaultdict(list)
+        blocklines = array.array('Q')
+        catends = array.array('Q')
+        categories = bytearray()
+        errorlines = array.array('I')
+        uncategorised = 0
+        for (digest, line, start, length, nlines, rec, nrecs, err, nerrs) in blocks:
+            errorlines.extend(e + line for e in errors[err:err+nerrs])
+            if not nrecs:
+                continue
+            recs = records[rec:rec+nrecs]
+            category = recs[0][3]
+            if category is None:
+                uncategorised = 1  # only ever the first block
+            else:
+                categories += category.encode('utf-8', 'surrogatepass')
+            blocklines.append(line)
+            catends.append(len(categories))
+            catwords = set(SEARCH_WORD.findall(category.lower())) if category else set()
+            for record in recs:
+                num = record[2] + line
+                for word in catwords.union(SEARCH_WORD.findall(record[1].lower())):
+                    wordlines[word].append(num)
+        wordends = array.array('Q')
+        lineends = array.array('Q')
+        lines = array.array('I')
+        words = bytearray()
+        for (word, nums) in sorted((word.encode('utf-8'), nums)
+                                   for (word, nums) in wordlines.items()):
+            words += word
+            wordends.append(len(words))
+            lines.extend(nums)
+            lineends.append(len(lines))
+        out = io.BytesIO()
+        out.write(SEARCH_HEADER.pack(SEARCH_MAGIC, CACHE_VERSION, key[0], key[1], len(wordends),
+                                     len(lines), len(blocklines), len(errorlines),
+                                     uncategorised))
+        for section in (wordends, lineends, catends, blocklines, lines, errorlines):
+            out.write(section.tobytes())
+        out.write(words)
+        out.write(categories)
+        return cls(out.getvalue())
+
+    def _word(self, num):
+        return bytes(self.words[self.wordends[num - 1] if num else 0:self.wordends[num]])
+
+    def wordRange(self, prefix):
+        '''Returns (low, high): the words starting with prefix (bytes)
+           are numbers low to high - 1'''
+        (low, high) = (0, len(self.wordends))
+        while low < high:
+            mid = (low + high) // 2
+            if self._word(mid) < prefix:
+                low = mid + 1
+            else:
+                high = mid
+        high = low
+        while high < len(self.wordends) and self._word(high)[:len(prefix)] == prefix:
+            high += 1
+        return (low, high)
+
+    def _lineRange(self, low, high):
+        '''Returns the start and end in lines of words low to high - 1'''
+        return (self.lineends[low - 1] if low else 0, self.lineends[high - 1] if high else 0)
+
+    def lookup(self, words):
+        '''Returns the sorted lines with words starting with each of
+           the search words'''
+        ranges = []
+        for word in set(words):
+            (low, high) = self.wordRange(word.encode('utf-8'))
+            (start, end) = self._lineRange(low, high)
+            ranges.append((end - start, low, high))
+        found = None
+        for (count, low, high) in sorted(ranges):  # fewest lines first
+            if found is None:
+                found = set()
+                for num in range(low, high):
+                    found.update(self.lines[slice(*self._lineRange(num, num + 1))])
+            elif len(found) * (high - low) * 20 < count:
+                # few lines left: look for each in the (sorted) lines of each word
+                lines = self.lines
+                def hasWord(linenum):
+                    for num in range(low, high):
+                        (start, end) = self._lineRange(num, num + 1)
+                        pos = bisect.bisect_left(lines, linenum, start, end)
+                        if pos < end and lines[pos] == linenum:
+                            return True
+                    return False
+                found = set(filter(hasWord, found))
+            else:
+                found.intersection_update(self.lines[slice(*self._lineRange(low, high))])
+            if not found:
+                break
+        return sorted(found or ())
+
+    def category(self, linenum):
+        '''Returns the category of the item on line linenum'''
+        block = bisect.bisect_left(self.blocklines, linenum) - 1
+        if block < 0 or block == 0 and self.uncategorised:
+            return None
+        start = self.catends[block - 1] if block else 0
+        return bytes(self.categories[start:self.catends[block]]).decode('utf-8', 'surrogatepass')
+
+    def release(self):
+        for name in ('wordends', 'lineends', 'catends', 'blocklines', 'lines', 'errors',
+                     'words', 'categories'):
+            getattr(self, name).release()
+
+
+def _openSearchIndex(path, key):
+    '''Returns the SearchIndex in the named index file (an mmap), or
+       None if it is missing or not for a todo file with todoStat key'''
+    import mmap
+    try:
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        index = SearchIndex(buf)
+        if index.key == (SEARCH_MAGIC, CACHE_VERSION) + key:
+            return index
+        index.release()
+    except (struct.error, TypeError, ValueError, IndexError):
+        pass  # corrupt, rebuild
+    buf.close()
+    return None
+
+
+def searchTodoFile(todopath, words, parseLine=parseTodoLine, jobs=1, reader='text'):
+    '''Returns (items, errors) for the named file as loadTodoFile does,
+       with only the items that have words starting with each of the
+       search words, in file order. Uses the search index, building it
+       (and bringing the parsed file cache up to date) first if the file
+       has changed.'''
+    path = os.path.abspath(todopath)
+    key = todoStat(path)
+    indexfile = cachePath(path, '.words')
+    with stage('search'):
+        index = _openSearchIndex(indexfile, key)
+    if index is None:
+        body = loadTodoBody(path, parseLine, jobs, reader)[1]
+        with stage('search index'):
+            index = SearchIndex.build(key, body)
+            try:
+                os.makedirs(os.path.dirname(indexfile), exist_ok=True)
+                tmpname = '%s.%d' % (indexfile, os.getpid())
+                with open(tmpname, 'wb') as f:
+                    f.write(index.buf)
+                os.replace(tmpname, indexfile)
+            except OSError:
+                pass  # as for the parsed file cache
+    with stage('search'):
+        linenums = index.lookup(words)
+        categories = [index.category(num) for num in linenums]
+        errors = index.errors.tolist()
+        index.release()
+    with stage('parse'):
+        encoding = locale.getpreferredencoding(False)
+        if os.path.exists(journalPath(path)):
+            with openTodoFile(path) as f:
+                alllines = f.readlines()
+            lines = [alllines[num - 1] for num in linenums]
+        else:
+            with open(path, 'rb') as f:
+                spans = lineSpans(f, linenums)
+                lines = []
+                for num in linenums:
+                    f.seek(spans[num][0])
+                    lines.append(f.read(spans[num][1] - spans[num][0]).decode(encoding))
+        items = []
+        for (num, line, category) in zip(linenums, lines, categories):
+            item = parseLine(line.rstrip('\r\n'), num, category)  # the readers never see a \r
+            if item is not None:
+                items.append(item)
+    return (items, errors)
+
+
+# Rewriting the todo file
+#
+# Edits are applied in one pass over the file, writing a temporary file
+# in the same directory which is synced and renamed over the original,
+# so the todo file is either completely old or completely new.
+# Bumps and replacements that don't change the length of their lines
+# (all bumps do not) are instead written over the old lines in place,
+# finding them with the line offset index; see _rewriteInPlace.
+def bumpTodoLine(line):
+    '''Returns the recurring item line with its date moved on to the
+       next recurrence, or None if it is not a recurring item line'''
+    mat = LINE_PARSERS['r'][0](line)
+    if mat is None or mat.group(5) not in RECUR_UNITS:
+        return None
+    recurrence = (mat.group(3), int(mat.group(4)), mat.group(5))
+    nextdate = nextRecurrence(parseISODate(mat.group(2)), recurrence)
+    return '%s%s%s' % (line[:mat.start(2)], nextdate.isoformat(), line[mat.end(2):])
+
+
+def _dueRecurring(line):
+    '''True if line is a recurring item due today or earlier'''
+    mat = LINE_PARSERS['r'][0](line)
+    return mat is not None and mat.group(2) <= TODAY.isoformat()
+
+
+def _rewriteInPlace(path, edits):
+    '''Applies edits as rewriteTodoFile does by overwriting the edited
+       lines where they are. Returns the changes, or None (having
+       changed nothing) if an edit is not a bump or replace of a line
+       with one of the same length in bytes.'''
+    if any(action not in ('bump', 'replace') for (action, newline) in edits.values()):
+        return None
+    encoding = locale.getpreferredencoding(False)
+    changes = []
+    writes = []
+    with open(path, 'r+b') as f:
+        spans = lineSpans(f, edits)
+        if len(spans) < len(edits):
+            return None  # the full rewrite reports the missing lines
+        for linenum in sorted(edits):
+            (start, end) = spans[linenum]
+            f.seek(start)
+            line = f.read(end - start).decode(encoding)
+            (action, newline) = edits[linenum]
+            if action == 'bump':
+                newline = bumpTodoLine(line)
+                if newline is None:
+                    return None
+            data = newline.encode(encoding)
+            if len(data) != end - start:
+                return None
+            changes.append((linenum, line, newline))
+            writes.append((start, data))
+        for (start, data) in writes:
+            f.seek(start)
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+        _touchIndex(f)
+    return changes
+
+
+def editLines(lines, edits, bumpdue=False, changes=None):
+    '''Generates the lines (strings including their line endings) with
+       a batch of edits applied as rewriteTodoFile describes, adding a
+       (linenum, oldline, newline) to the changes list for each change.
+       Raises ValueError, once the lines run out for a missing line, if
+       an edit is not possible.'''
+    if changes is None:
+        changes = []
+    linecount = 0
+    line = ''
+    for line in lines:
+        linecount += 1
+        (action, newline) = edits.get(linecount, (None, None))
+        if action is None:
+            if bumpdue and line[:1] == 'r' and _dueRecurring(line):
+                action = 'bump'
+            else:
+                yield line
+                continue
+        if action == 'bump':
+            newline = bumpTodoLine(line)
+            if newline is None:
+                raise ValueError("line %d is not a recurring item that can be bumped"
+                                 % linecount)
+        elif action == 'insert':
+            changes.append((linecount, None, newline))
+            yield newline
+            yield line
+            continue
+        elif action == 'delete':
+            newline = None
+        changes.append((linecount, line, newline))
+        if newline is not None:
+            yield newline
+    # appending after the last line
+    (action, newline) = edits.get(linecount + 1, (None, None))
+    if action == 'insert':
+        if line and line[-1] not in '\r\n':
+            yield '\n'  # the last line had no newline
+        changes.append((linecount + 1, None, newline))
+        yield newline
+    missing = [num for num in edits if num < 1 or num > linecount and
+               not (num == linecount + 1 and edits[num][0] == 'insert')]
+    if missing:
+        raise ValueError('there is no line %d' % min(missing))
+
+
+def _writeTodoFile(path, lines):
+    '''Replaces the file at path (a real path) with the lines, safely
+       through a temporary file. If getting the lines raises, the file
+       is left alone.'''
+    (fd, tmppath) = tempfile.mkstemp(dir=os.path.dirname(path),
+                                     prefix='.%s.' % os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'w', newline='') as outfile:
+            for line in lines:
+                outfile.write(line)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.chmod(tmppath, os.stat(path).st_mode & 0o7777)
+        os.replace(tmppath, path)
+    except BaseException:
+        os.unlink(tmppath)
+        raise
+    _syncDirectory(path)
+
+
+def _syncDirectory(path):
+    '''Makes renames and removals in the directory of path durable'''
+    try:
+        dirfd = os.open(os.path.dirname(path), os.O_RDONLY)
+        try:
+            os.fsync(dirfd)
+        finally:
+            os.close(dirfd)
+    except OSError:
+        pass  # not possible on some platforms
+
+
+def rewriteTodoFile(fname, edits=None, bumpdue=False):
+    '''Rewrites the todo file (safely, to a temp file first) with a
+       batch of edits in a single pass. edits maps line numbers to
+       (action, newline), newline including its line ending, where
+       action is:
+         'bump' - bump the recurring item on that line (newline unused)
+         'delete' - delete the line
+         'replace' - replace the line with newline
+         'insert' - insert newline before the line (the line after the
+                    last to append)
+       If bumpdue is true every recurring item due today or earlier is
+       also bumped. Returns a list of (linenum, oldline, newline) for
+       each change, with None for the missing side of a delete or
+       insert. Raises ValueError (leaving the file alone) if an edit
+       is not possible. Edits that keep the length of every line are
+       written in place. See editTodoFile for files with a journal.'''
+    edits = edits or {}
+    for (linenum, (action, newline)) in edits.items():
+        if action not in ('bump', 'delete', 'replace', 'insert'):
+            raise ValueError('unknown action %s' % action)
+    path = os.path.realpath(fname)  # replace the file, not a symlink to it
+    if edits and not bumpdue:
+        changes = _rewriteInPlace(path, edits)
+        if changes is not None:
+            return changes
+    changes = []
+    with open(path, newline='') as infile:
+        _writeTodoFile(path, editLines(infile, edits, bumpdue, changes))
+    return changes
+
+
+# Edit journal (--journal, --compact)
+#
+# Rewriting a big todo file for every bump is a lot of writing (and of
+# syncing, if the file is shared between machines). With --journal the
+# edits are instead appended to FILE.journal, and read back over the
+# todo file whenever it is loaded. Its first line is JSON {"size": n,
+# "sha1": hex} for the todo file it applies to, and each line after that
+# is the JSON list of [linenum, oldline, newline] changes of one batch
+# of edits (as rewriteTodoFile returns them, bumps already worked out).
+# Line numbers are those of the file with the earlier batches applied,
+# so the journal reads the same as the lines the list shows. --compact,
+# or an edit that takes the journal past JOURNAL_COMPACT_SIZE, folds
+# the journal into the todo file, and a file with a journal keeps
+# using it for edits until then. Edits and compaction hold an exclusive
+# lock (on a file in the cache directory) and reading a file with a
+# journal a shared one, so concurrent runs can't see or write half of
+# an edit. A journal whose todo file has changed some other way is
+# ignored (with a warning) when reading and refused for edits.
+JOURNAL_COMPACT_SIZE = 64 * 1024  # bytes
+
+
+def journalPath(todopath):
+    return os.path.realpath(todopath) + '.journal'
+
+
+@contextlib.contextmanager
+def lockTodoFile(todopath, exclusive=True):
+    '''Holds the edit lock of the named todo file for the with block,
+       shared if not exclusive'''
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(settings['paths']['cachedir'], exist_ok=True)
+    with open(cachePath(os.path.realpath(todopath), '.lock'), 'ab') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield  # closing the file unlocks it
+
+
+def todoStat(todopath):
+    '''Returns (size, mtime_ns) of the named todo file, which change
+       when its journal does too'''
+    stat = os.stat(todopath)
+    try:
+        journal = os.stat(journalPath(todopath))
+    except FileNotFoundError:
+        return (stat.st_size, stat.st_mtime_ns)
+    return (stat.st_size + journal.st_size, max(stat.st_mtime_ns, journal.st_mtime_ns))
+
+
+def _journalLines(path, data):
+    '''Returns the lines of the todo file at path (a real path) with
+       contents data (bytes) after the edits in its journal, or None if
+       it has none. Raises ValueError if the journal can't be read or
+       doesn't apply to data. A last journal line without its newline
+       (still being written) is left out.'''
+    import hashlib, json
+    try:
+        with open(path + '.journal', 'rb') as f:
+            records = f.read().split(b'\n')[:-1]
+    except FileNotFoundError:
+        return None
+    if not records:
+        return None
+    try:
+        header = json.loads(records[0].decode('ascii'))
+        batches = [json.loads(record.decode('ascii')) for record in records[1:]]
+    except ValueError:
+        raise ValueError('%s.journal is corrupt' % path)
+    if header != {'size': len(data), 'sha1': hashlib.sha1(data).hexdigest()}:
+        raise ValueError('%s was changed after its journal was started' % path)
+    lines = data.decode(locale.getpreferredencoding(False)).splitlines(True)
+    for (batchnum, changes) in enumerate(batches, 1):
+        for (linenum, oldline, newline) in sorted(changes, reverse=True):
+            if oldline is None:  # insert
+                if linenum == len(lines) + 1 and lines and lines[-1][-1] not in '\r\n':
+                    lines[-1] += '\n'
+                lines.insert(linenum - 1, newline)
+            elif lines[linenum-1:linenum] != [oldline]:
+                raise ValueError('%s.journal edit %d does not apply' % (path, batchnum))
+            elif newline is None:
+                del lines[linenum - 1]
+            else:
+                lines[linenum - 1] = newline
+    return lines
+
+
+def readTodoData(todopath):
+    '''Returns the contents (bytes) of the named todo file with the
+       edits in its journal applied'''
+    path = os.path.realpath(todopath)
+    if not os.path.exists(path + '.journal'):
+        with open(path, 'rb') as f:
+            return f.read()
+    with lockTodoFile(path, exclusive=False):
+        with open(path, 'rb') as f:
+            data = f.read()
+        try:
+            lines = _journalLines(path, data)
+        except ValueError as e:
+            print("Warning: %s; ignoring the journal" % e, file=sys.stderr)
+            return data
+    if lines is None:
+        return data
+    return ''.join(lines).encode(locale.getpreferredencoding(False))
+
+
+def openTodoFile(todopath):
+    '''Opens the named todo file for reading as text, with the edits
+       in its journal applied'''
+    if not os.path.exists(journalPath(todopath)):
+        return open(todopath)
+    return io.StringIO(readTodoData(todopath).decode(locale.getpreferredencoding(False)),
+                       newline=None)  # translated as open() does
+
+
+def editTodoFile(fname, edits=None, bumpdue=False, journal=False):
+    '''Applies a batch of edits to the todo file as rewriteTodoFile
+       does (with the same arguments and result), appending them to its
+       journal instead if journal is true or it already has one'''
+    import hashlib, json
+    edits = edits or {}
+    for (linenum, (action, newline)) in edits.items():
+        if action not in ('bump', 'delete', 'replace', 'insert'):
+            raise ValueError('unknown action %s' % action)
+    path = os.path.realpath(fname)
+    with lockTodoFile(path):
+        if not journal and not os.path.exists(path + '.journal'):
+            return rewriteTodoFile(path, edits, bumpdue)
+        with open(path, 'rb') as f:
+            data = f.read()
+        lines = _journalLines(path, data)
+        if lines is None:
+            lines = data.decode(locale.getpreferredencoding(False)).splitlines(True)
+        changes = []
+        lines = list(editLines(lines, edits, bumpdue, changes))
+        if not changes:
+            return changes
+        record = json.dumps(changes).encode('ascii') + b'\n'
+        try:
+            size = os.stat(path + '.journal').st_size
+        except FileNotFoundError:
+            header = {'size': len(data), 'sha1': hashlib.sha1(data).hexdigest()}
+            record = json.dumps(header, sort_keys=True).encode('ascii') + b'\n' + record
+            size = 0
+        if size + len(record) > JOURNAL_COMPACT_SIZE:
+            _compactTodoFile(path, lines)
+            return changes
+        fd = os.open(path + '.journal', os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                     os.stat(path).st_mode & 0o666)
+        try:
+            os.write(fd, record)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        if not size:
+            _syncDirectory(path)
+    return changes
+
+
+def _compactTodoFile(path, lines):
+    '''Replaces the todo file at path with lines and removes its journal'''
+    _writeTodoFile(path, lines)
+    try:
+        os.unlink(path + '.journal')
+    except FileNotFoundError:
+        pass
+    _syncDirectory(path)
+
+
+def compactTodoFile(fname):
+    '''Folds the journal of the todo file into it (--compact). Returns
+       the number of batches of edits that were in the journal, 0 if
+       there was none. Raises ValueError (leaving both alone) if the
+       journal doesn't apply.'''
+    path = os.path.realpath(fname)
+    with lockTodoFile(path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        lines = _journalLines(path, data)
+        if lines is None:
+            return 0
+        with open(path + '.journal', 'rb') as f:
+            batches = f.read().count(b'\n') - 1
+        _compactTodoFile(path, lines)
+    return batches
+
+
+# Command line handling, shared by the daemon (which runs the same
+# queries for other processes)
+def makeOptionParser():
+    optparser = optparse.OptionParser()      # TODO: optparser is deprecated :(
+
+    optparser.add_option('-f', '--file', action='append', \
+                         help='File to parse (defaults to %s); may be given more ' \
+                              'than once, or be a glob pattern or a directory of ' \
+                              '*.todo files' % DEFAULTTODOFILE)
+
+    if droid is None:
+        optparser.add_option('-e', '--edit', action='store_true', \
+                             help='Invoke your EDITOR (%s) on todo file.' % EDITOR)
+    else:  # android TODO invoke text intent
+        optparser.add_option('-e', '--edit', action='store_true', \
+                             help='Invoke a text editor on todo file.')
+
+    optparser.add_option('-r', '--reverse', action='store_true', \
+                         help='Reversed order of sorting.')
+    optparser.add_option('--mono', action='store_true', \
+                         dest='monochrome', help='Monochrome output')
+    optparser.add_option('--terminal', action='store_true', \
+                         dest='terminal', help='Disable Android GUI (if present)')
+
+    optparser.add_option('--sort-cat', action='store_true', \
+                         help='Group by category')
+    optparser.add_option('--group-cat', action='store_true', \
+                         help='Group by category in todo file order, ' \
+                              'with the items in file order')
+    optparser.add_option('--line-numbers', action='store_true', \
+                         help='Show line numbers from todo file in output')    
+    optparser.add_option('--no-sort', action='store_true', \
+                         help='List the items in todo file order (as they are parsed)')
+    optparser.add_option('--format', type='choice', default='text', \
+                         choices=OUTPUT_FORMATS, \
+                         help='Output format: text (default), or one record per item ' \
+                              'as jsonl, csv or tsv')
+
+    optparser.add_option('--all', action='store_true', \
+                         help='Shows all items, regardless of date and filtering')
+    optparser.add_option('-d', '--days', \
+                         help='Days after which item will not be included')
+
+    optparser.add_option('--bump-line', \
+                         help='Bump the recurring items on these lines (comma delimited, ' \
+                              'FILE:LINE with several files) to their next due dates')
+    optparser.add_option('--bump-all-due', action='store_true', \
+                         help='Bump every recurring item due today or earlier')
+    optparser.add_option('--journal', action='store_true', \
+                         help='Append edits to FILE.journal instead of rewriting ' \
+                              'the todo file')
+    optparser.add_option('--compact', action='store_true', \
+                         help='Fold the edits in FILE.journal into the todo file')
+    #optparser.add_option('--line-remove', \
+    #                     help='Remove the item on specified line')
+    #optparser.add_option('--line-edit', \
+    #                     help='Edit specified line')
+
+    # Don't use store_const for only-types for if-else later XXX
+    optparser.add_option('--only-types', \
+                         help='Only include these types (string of letters)')
+    optparser.add_option('--appointments', \
+                         action='store_const', const='a', dest='only_types', \
+                         help='Shows appointments only (equivalent to --only-types=a')
+    optparser.add_option('--ex-types', \
+                         help='Exclude these types (string of letters)')
+    optparser.add_option('--only-cat', \
+                         help='Only include these categories (comma delimited)')
+    optparser.add_option('--ex-cat', \
+                         help='Exclude these categories (comma delimited)')
+    optparser.add_option('--where', \
+                         help='Only include items matching this expression, ' \
+                              'e.g. \'type in "ta" and days <= 7 and cat !~ "birthdays"\'')
+    optparser.add_option('--search', metavar='WORDS', \
+                         help='Only include items with words starting with each of ' \
+                              'these in their description or category')
+    optparser.add_option('--two-lines', action='store_true', \
+                         help='Newline before description')
+    optparser.add_option('--parser', type='choice', default='table', \
+                         choices=sorted(PARSER_ENGINES), \
+                         help='Line parser engine: table (default) or legacy')
+    optparser.add_option('--no-cache', action='store_true', \
+                         help="Don't use the parsed file cache (in %s)" % \
+                              settings['paths']['cachedir'])
+    optparser.add_option('--cache-stats', action='store_true', \
+                         help='Print parsed file cache hits/misses (of the runs with --cache-stats ' \
+                              'or --profile) to stderr')
+    optparser.add_option('-j', '--jobs', type='int', default=1, \
+                         help='Parse large files using this many processes')
+    optparser.add_option('--reader', type='choice', default='text', \
+                         choices=READERS, \
+                         help='File reader: text (default) or mmap, which skips ' \
+                              'comments and blanks without decoding them')
+    optparser.add_option('--backend', type='choice', default='objects', \
+                         choices=BACKENDS, \
+                         help='objects (default) or columnar, which filters and sorts ' \
+                              'whole columns (with NumPy if installed), for huge files')
+    optparser.add_option('-n', '--limit', type='int', \
+                         help='Only show the N most urgent items')
+    optparser.add_option('--count', action='store_true', \
+                         help='Only print the number of items that would be shown')
+    optparser.add_option('--stats', action='store_true', \
+                         help='Print counts of the items that would be shown by type, ' \
+                              'category and when due, and of syntax errors')
+    optparser.add_option('--as-of', metavar='YYYY-MM-DD', \
+                         help='Show the list as it will be (or was) on this date')
+    optparser.add_option('--forecast', type='int', metavar='DAYS', \
+                         help='Show the list for each of the next DAYS days ' \
+                              '(from today or --as-of)')
+    optparser.add_option('--agenda', type='int', metavar='DAYS', \
+                         help='Show the items due on each of the next DAYS days ' \
+                              '(from today or --as-of), with every recurrence')
+    optparser.add_option('--watch', action='store_true', \
+                         help='Keep the list on screen, updating it when the todo ' \
+                              'file changes and at midnight')
+    optparser.add_option('--daemon', action='store_true', \
+                         help='Keep todo files loaded and answer queries from ' \
+                              'other runs over a Unix socket')
+    optparser.add_option('--no-daemon', action='store_true', \
+                         help="Don't ask a running daemon, parse in this process")
+    optparser.add_option('--socket', \
+                         help='Daemon socket (defaults to %s)' % settings['paths']['socket'])
+    optparser.add_option('--profile', action='store_const', const='text', \
+                         help='Print the time taken by each stage and counts of ' \
+                              'lines and items to stderr')
+    optparser.add_option('--profile-json', action='store_const', const='json', \
+                         dest='profile', help='As --profile, in JSON')
+
+    return optparser
+
+
+def checkOptions(optparser, cliopts):
+    '''Exits with a usage error for invalid option values'''
+    if cliopts.limit is not None and cliopts.limit < 1:
+        optparser.error('--limit must be at least 1')
+    if cliopts.as_of:
+        try:
+            parseISODate(cliopts.as_of)
+        except (TypeError, ValueError):
+            optparser.error('--as-of takes a date as YYYY-MM-DD')
+    if cliopts.forecast is not None:
+        if cliopts.forecast < 1:
+            optparser.error('--forecast must be at least 1')
+        if cliopts.watch or cliopts.no_sort:
+            optparser.error('--forecast cannot be used with --watch or --no-sort')
+    if cliopts.agenda is not None:
+        if cliopts.agenda < 1:
+            optparser.error('--agenda must be at least 1')
+        if cliopts.watch or cliopts.no_sort or cliopts.forecast is not None or \
+           cliopts.sort_cat or cliopts.group_cat:
+            optparser.error('--agenda cannot be used with --watch, --no-sort, --forecast, ' \
+                            '--sort-cat or --group-cat')
+    if cliopts.stats or cliopts.count:
+        if cliopts.watch or cliopts.forecast is not None or cliopts.agenda is not None or \
+           cliopts.limit is not None:
+            optparser.error('--stats and --count cannot be used with --watch, --forecast, ' \
+                            '--agenda or --limit')
+        if cliopts.format not in ('text', 'jsonl'):
+            optparser.error('--stats and --count print text or jsonl')
+    if cliopts.no_sort and (cliopts.limit is not None or cliopts.sort_cat or cliopts.group_cat):
+        optparser.error('--no-sort cannot be used with --limit, --sort-cat or --group-cat')
+    if cliopts.bump_line:
+        try:
+            lines = [int(entry.rpartition(':')[2]) for entry in cliopts.bump_line.split(',')]
+        except ValueError:
+            lines = [0]
+        if min(lines) < 1:
+            optparser.error('--bump-line takes line numbers (or FILE:LINE), comma delimited')
+    if cliopts.search is not None and not searchWords(cliopts.search):
+        optparser.error('--search needs at least one word')
+    if cliopts.where:
+        try:
+            parseWhere(cliopts.where)
+        except ValueError as e:
+            optparser.error('--where: %s' % e)
+
+
+def applyOptions(cliopts):
+    '''Sets filter_settings and the display settings from cliopts'''
+    # Determine any cutoff dates, categories or types to be
+    # excluded beforehand so that we don't include those items when
+    # loading from the file. XXX
+    if cliopts.days:
+        filter_settings.days_cutoff = int(cliopts.days)
+
+    if cliopts.only_cat:
+        filter_settings.only_categories = cliopts.only_cat.split(',')
+    else:
+        if cliopts.ex_cat:
+            filter_settings.exclude_categories = cliopts.ex_cat.split(',')
+
+    if cliopts.only_types:
+        filter_settings.only_types = cliopts.only_types
+    else:
+        if cliopts.ex_types:
+            for type in cliopts.ex_types:
+                filter_settings.only_types = filter_settings.only_types.replace(type, '')
+    # end if only types
+
+    if cliopts.as_of:
+        setToday(parseISODate(cliopts.as_of))
+
+    filter_settings.show_line_nums = True if cliopts.line_numbers else False
+    filter_settings.show_all = True if cliopts.all else False
+    filter_settings.where = cliopts.where
+    if cliopts.search:
+        filter_settings.search = searchWords(cliopts.search)
+        filter_settings.where = searchWhere(filter_settings.search, cliopts.where)
+
+    # Misc display options
+    if cliopts.two_lines:
+        settings['display']['two_lines'] = True
+    if cliopts.monochrome:
+        settings['display']['use_colours'] = False
+
+
+def queryTodoItems(cliopts, todopath, loaded=None, descending=True, ret=None):
+    '''Returns (todoList, errors): the items to show for cliopts
+       (after applyOptions), sorted by days away, descending or not,
+       and the syntax errors. loaded is the (items, errors) of the
+       whole file if it is already loaded, as in the daemon; otherwise
+       the file is loaded with the filters pushed down into parsing.
+       With --no-sort the items are in file order, appended to ret
+       (and ret returned as the todoList) if given. If ret streams (see
+       RecordWriter) the file is read a line at a time, without the
+       parsed file cache, so the first items come out straight away
+       and the whole file is never held in memory.'''
+    if loaded is None and cliopts.backend == 'columnar':
+        return queryTodoColumns(cliopts, todopath, descending, ret)
+    urgent = index = None
+    if cliopts.limit is not None:
+        collector = urgent = UrgentItems(cliopts.limit, descending)
+    elif cliopts.group_cat:
+        collector = index = TodoIndex()
+    else:
+        collector = ret if cliopts.no_sort else None
+    streams = getattr(collector, 'streams', False)
+
+    if loaded is None:
+        # Load the file (from the cache if possible) with the filters
+        # pushed down into the parsing.
+        with stage('load'):
+            (todoList, errors) = loadTodoFile(todopath, PARSER_ENGINES[cliopts.parser], \
+                                              usecache=not (cliopts.no_cache or streams), \
+                                              jobs=1 if streams else cliopts.jobs, \
+                                              reader=cliopts.reader, pushdown=pushdownFilter(), \
+                                              ret=collector)
+    else:
+        (items, errors) = loaded
+        pushdown = pushdownFilter()
+        todoList = [] if collector is None else collector
+        with stage('filter'):
+            for item in items:
+                if pushdown is None or pushdown.includes(item):
+                    todoList.append(item)
+
+    # Sort
+    with stage('sort'):
+        if urgent is not None:
+            todoList = urgent.sortedItems()
+            if cliopts.group_cat:  # back to file order for grouping
+                index = TodoIndex(sorted(todoList, key=lambda x: x.linenum))
+        if index is not None:
+            todoList = index.grouped()
+        elif not cliopts.no_sort:
+            if urgent is None:
+                todoList.sort(key=lambda x: x.daysAway(), reverse=descending)
+            if cliopts.sort_cat:
+                todoList = TodoIndex(todoList).grouped(sort=True)
+    return (todoList, errors)
+
+
+def printTodoList(todoList, out=None, format='text', sources=False):
+    '''Writes the todoList as TodoRenderer formats it to out (default
+       stdout), or as records in another of the OUTPUT_FORMATS (see
+       RecordWriter)'''
+    out = out or sys.stdout
+    if format != 'text':
+        with stage('output'):
+            writer = RecordWriter(out, format, sources)
+            for item in todoList:
+                writer.append(item)
+        return
+    with stage('render'):
+        lines = TodoRenderer().lines(todoList)
+    with stage('output'):
+        for start in range(0, len(lines), RENDER_CHUNK):
+            chunk = lines[start:start+RENDER_CHUNK]
+            chunk.append('')  # for the last newline
+            out.write('\n'.join(chunk))
+
+
+# Several todo files
+#
+# -f can be given more than once, as a glob pattern or as a directory
+# (for the *.todo files in it). Each file is loaded, filtered and sorted
+# on its own, in a process pool with --jobs, and the sorted lists are
+# merged with heapq.merge; that keeps items with the same days away in
+# file order, as sorting them all together would. The items have their
+# source set to the path of their file, for display and for edits.
+def expandTodoPaths(specs):
+    '''Returns the todo files for a list of -f arguments (files, glob
+       patterns or directories) in order, without repeats. Raises
+       ValueError for a pattern or directory with no todo files.'''
+    paths = []
+    for spec in specs:
+        spec = os.path.expanduser(spec)  # for quoted patterns
+        if os.path.isdir(spec):
+            found = sorted(glob.glob(os.path.join(spec, '*.todo')))
+        elif glob.escape(spec) != spec:  # a pattern
+            found = sorted(path for path in glob.glob(spec) if not os.path.isdir(path))
+        else:
+            found = [spec]
+        if not found:
+            raise ValueError('no todo files match %s' % spec)
+        for path in found:
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def _sortedFileItems(todopath, parseLine, usecache, reader, pushdown, limit, descending,
+                     backend='objects'):
+    '''Returns (items, errors): the included items of the file sorted by
+       days away (only the limit most urgent if limit is not None)'''
+    if backend == 'columnar':
+        columns = loadTodoColumns(todopath, parseLine, usecache, reader=reader)
+        days = columns.daysAway(TODAY_ORDINAL, filter_settings.days_cutoff)
+        rows = columns.sortRows(columns.select(pushdown, days), days, descending, limit)
+        return (columns.items(rows), list(columns.errors))
+    urgent = UrgentItems(limit, descending) if limit is not None else None
+    (items, errors) = loadTodoFile(todopath, parseLine, usecache=usecache, reader=reader, \
+                                   pushdown=pushdown, ret=urgent)
+    if urgent is not None:
+        items = urgent.sortedItems()
+    else:
+        items.sort(key=lambda x: x.daysAway(), reverse=descending)
+    return (items, errors)
+
+
+def _sortedFileRecords(todopath, engine, usecache, reader, pushdown, limit, descending,
+                       backend, today, cutoff):
+    '''Process pool worker: _sortedFileItems with the items as records'''
+    setToday(today)
+    filter_settings.days_cutoff = cutoff  # for sorting wishlist items
+    (items, errors) = _sortedFileItems(todopath, PARSER_ENGINES[engine], usecache, reader,
+                                       pushdown, limit, descending, backend)
+    return ([itemRecord(item) for item in items], errors)
+
+
+class SourceItems(object):
+    '''Collector that sets the source of the items appended and passes
+       them on to ret'''
+    def __init__(self, source, ret):
+        self.source = source
+        self.ret = ret
+        self.streams = getattr(ret, 'streams', False)
+
+    def append(self, item):
+        item.source = self.source
+        self.ret.append(item)
+
+
+def queryTodoFiles(cliopts, todopaths, descending=True, ret=None):
+    '''As queryTodoItems for a list of todo files, returning (todoList,
+       errors) with errors as a list of (todopath, syntax errors). With
+       --no-sort the files are not merged but follow each other.'''
+    import concurrent.futures
+    if len(todopaths) == 1:
+        (todoList, errors) = queryTodoItems(cliopts, todopaths[0], descending=descending,
+                                            ret=ret)
+        return (todoList, [(todopaths[0], errors)])
+    if cliopts.no_sort:
+        todoList = [] if ret is None else ret
+        errors = []
+        for path in todopaths:
+            (items, errs) = queryTodoItems(cliopts, path, ret=SourceItems(path, todoList))
+            errors.append((path, errs))
+        return (todoList, errors)
+
+    pushdown = pushdownFilter()
+    lists = []
+    errors = []
+    with stage('load'):
+        if cliopts.jobs > 1:
+            with concurrent.futures.ProcessPoolExecutor(min(cliopts.jobs, len(todopaths))) as pool:
+                futures = [pool.submit(_sortedFileRecords, path, cliopts.parser, \
+                                       not cliopts.no_cache, cliopts.reader, pushdown, \
+                                       cliopts.limit, descending, cliopts.backend, TODAY, \
+                                       filter_settings.days_cutoff) \
+                           for path in todopaths]
+                for (path, future) in zip(todopaths, futures):
+                    (records, errs) = future.result()
+                    lists.append(itemsFromRecords(records))
+                    errors.append((path, errs))
+        else:
+            for path in todopaths:
+                (items, errs) = _sortedFileItems(path, PARSER_ENGINES[cliopts.parser], \
+                                                 not cliopts.no_cache, cliopts.reader, \
+                                                 pushdown, cliopts.limit, descending, \
+                                                 cliopts.backend)
+                lists.append(items)
+                errors.append((path, errs))
+    for (path, items) in zip(todopaths, lists):
+        for item in items:
+            item.source = path
+
+    with stage('sort'):
+        todoList = list(heapq.merge(*lists, key=lambda x: x.daysAway(), reverse=descending))
+        if cliopts.limit is not None:  # the most urgent are at the end if descending
+            todoList = todoList[-cliopts.limit:] if descending else todoList[:cliopts.limit]
+        if cliopts.group_cat:
+            order = dict((path, num) for (num, path) in enumerate(todopaths))
+            todoList = TodoIndex(sorted(todoList, key=lambda x: (order[x.source], x.linenum))) \
+                       .grouped()
+        elif cliopts.sort_cat:
+            todoList = TodoIndex(todoList).grouped(sort=True)
+    return (todoList, errors)
+
+
+# Watch mode (--watch)
+#
+# The list is kept on the screen and only worked out again when a todo
+# file changes or the date rolls over at midnight; otherwise the
+# process sleeps. Changes are noticed with inotify (called through
+# ctypes) on Linux, or by checking the size and mtime of the files
+# every WATCH_INTERVAL seconds elsewhere. The files are loaded through
+# the parsed file cache, so only the changed blocks are reparsed, and
+# only the screen lines that differ from the last time are redrawn.
+WATCH_INTERVAL = 1  # seconds between checks when inotify is not available
+
+# inotify_add_watch mask: anything that can change a file in the directory
+IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE = 0x2, 0x4, 0x8
+IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x40, 0x80, 0x100, 0x200
+INOTIFY_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+               IN_CREATE | IN_DELETE
+
+
+class FileWatcher(object):
+    '''Waits for changes to the content of a list of files. The
+       directories of the files are watched rather than the files, as
+       editors (and rewriteTodoFile) replace files by renaming.'''
+    def __init__(self, paths):
+        self.paths = [os.path.realpath(path) for path in paths]
+        self.stats = self.statKeys()
+        self.fd = self._inotify()
+
+    def statKeys(self):
+        keys = []
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+                keys.append((stat.st_mtime_ns, stat.st_size, stat.st_ino))
+            except OSError:
+                keys.append(None)
+        return keys
+
+    def _inotify(self):
+        '''Returns an inotify file descriptor watching the directories,
+           or None if inotify is not available'''
+        try:
+            import ctypes, ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        for dirname in set(os.path.dirname(path) for path in self.paths):
+            if libc.inotify_add_watch(fd, os.fsencode(dirname), INOTIFY_MASK) < 0:
+                os.close(fd)
+                return None
+        return fd
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def wait(self, timeout, fds=()):
+        '''Waits up to timeout seconds for a file to change, or for one
+           of the other fds to be readable. Returns True if a file
+           changed.'''
+        deadline = time.monotonic() + timeout
+        watched = list(fds) if self.fd is None else [self.fd] + list(fds)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if self.fd is not None:
+                (ready, _, _) = select.select(watched, [], [], remaining)
+                if self.fd in ready:
+                    try:
+                        while os.read(self.fd, 65536):  # the events themselves don't matter
+                            pass
+                    except BlockingIOError:
+                        pass
+            else:
+                (ready, _, _) = select.select(watched, [], [], min(WATCH_INTERVAL, remaining))
+            stats = self.statKeys()
+            if stats != self.stats:
+                self.stats = stats
+                return True
+            if ready and ready != [self.fd]:
+                return False  # one of fds
+
+
+class WatchScreen(object):
+    '''Shows a list of lines on the terminal, redrawing only the lines
+       that changed since the last paint. Lines are not wrapped so each
+       is one screen row.'''
+    def __init__(self, out=None):
+        self.out = out or sys.stdout
+        self.size = None
+        self.rows = []
+
+    def start(self):
+        # alternate screen, hide the cursor and don't wrap lines
+        self.out.write('\x1b[?1049h\x1b[?25l\x1b[?7l')
+
+    def stop(self):
+        self.out.write('\x1b[?7h\x1b[?25h\x1b[?1049l')
+        self.out.flush()
+
+    def paint(self, lines, bottom=False):
+        '''Shows as many of lines as fit; the last ones if bottom'''
+        size = shutil.get_terminal_size()
+        rows = '\n'.join(lines).split('\n') if lines else []  # --two-lines
+        rows = rows[-size.lines:] if bottom else rows[:size.lines]
+        out = []
+        old = self.rows
+        if size != self.size:  # all of it after a resize
+            out.append('\x1b[H\x1b[2J')
+            old = []
+            self.size = size
+        for (num, row) in enumerate(rows):
+            if num >= len(old) or old[num] != row:
+                out.append('\x1b[%d;1H%s\x1b[K' % (num + 1, row))
+        if len(rows) < len(old):
+            out.append('\x1b[%d;1H\x1b[J' % (len(rows) + 1))
+        self.rows = rows
+        self.out.write(''.join(out))
+        self.out.flush()
+
+
+def secondsToMidnight():
+    tomorrow = datetime.datetime.combine(datetime.date.today() + datetime.timedelta(1),
+                                         datetime.time())
+    return max((tomorrow - datetime.datetime.now()).total_seconds(), 0) + 1
+
+
+def watchTodoFiles(cliopts, todopaths, descending=True):
+    '''Runs --watch until interrupted (after applyOptions)'''
+    watcher = FileWatcher(todopaths + [journalPath(path) for path in todopaths])
+    screen = WatchScreen()
+    wakeups = []
+    if hasattr(signal, 'SIGWINCH'):  # resizes wake the wait up to repaint
+        (wakeread, wakewrite) = os.pipe()
+        os.set_blocking(wakeread, False)
+        os.set_blocking(wakewrite, False)
+        signal.set_wakeup_fd(wakewrite)
+        signal.signal(signal.SIGWINCH, lambda signum, frame: None)
+        wakeups.append(wakeread)
+    screen.start()
+    try:
+        changed = True
+        while True:
+            if not cliopts.as_of and datetime.date.today() != TODAY:
+                setToday()
+                changed = True
+            if changed:
+                (todoList, errors) = queryTodoFiles(cliopts, todopaths, descending)
+                lines = ['Syntax error at line %d%s' % (linenum, '' if len(todopaths) == 1 \
+                                                       else ' of %s' % path) \
+                         for (path, errs) in errors for linenum in errs]
+                lines.extend(TodoRenderer().lines(todoList))
+            screen.paint(lines, bottom=descending)
+            changed = watcher.wait(secondsToMidnight(), wakeups)
+            for fd in wakeups:
+                try:
+                    os.read(fd, 512)
+                except BlockingIOError:
+                    pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        screen.stop()
+        watcher.close()
+
+
+# Forecasts (--forecast)
+#
+# Items keep their dates as ordinals and days away is worked out from
+# TODAY when used, so one load of the todo files can be shown as of any
+# number of dates with setToday. The date filters only hide items that
+# are too far away (the days cutoff and the wake window), so each item
+# is visible from some date on: visibleFrom works that out once, and
+# each day of a forecast only adds the items that became visible to
+# the lists carried over from the day before. Dated items keep the same
+# order whatever the date, as do the items whose days away don't depend
+# on it, so the two lists stay sorted and are merged for each day. Only
+# --where, which can say anything about days away, is checked again
+# every day.
+def visibleFrom(item, pushdown):
+    '''Returns the first date ordinal on which the item passes the
+       option filters of the FilterPushdown (or None), 0 if it always
+       does and None if it never does'''
+    if pushdown is None or not pushdown.filtering:
+        return 0
+    if not pushdown.wantCategory(item.category) or item.type not in pushdown.types:
+        return None
+    if item.ordinal is None:  # days away doesn't change
+        days = item.daysAway()
+        if days > pushdown.days_cutoff or item.wake is not None and item.wake < days:
+            return None
+        return 0
+    if item.wake is None:
+        return item.ordinal - pushdown.days_cutoff
+    return item.ordinal - min(pushdown.days_cutoff, item.wake)
+
+
+def forecastTodoFiles(cliopts, todopaths, days, descending=True, out=None):
+    '''Writes the list as it will be on each of days dates from TODAY
+       on (--forecast) to out (default stdout), after applyOptions.
+       The todo files are loaded once.'''
+    out = out or sys.stdout
+    start = TODAY
+    pushdown = pushdownFilter()
+    wheretree = parseWhere(filter_settings.where) if filter_settings.where else None
+    sources = len(todopaths) > 1
+    errout = out if cliopts.format == 'text' else sys.stderr
+    pending = []  # (first visible ordinal, seq, item) of the dated items
+    dated = []  # (sort key, seq, item) of the visible dated items
+    fixed = []  # and of the items whose days away is fixed
+    sign = -1 if descending else 1
+    with stage('load'):
+        for path in todopaths:
+            (items, errors) = loadTodoFile(path, PARSER_ENGINES[cliopts.parser], \
+                                           usecache=not cliopts.no_cache, jobs=cliopts.jobs, \
+                                           reader=cliopts.reader)
+            reportSyntaxErrors(errors, errout, path if sources else None)
+            for item in items:
+                if sources:
+                    item.source = path
+                first = visibleFrom(item, pushdown)
+                if first is None:
+                    continue
+                seq = len(pending) + len(fixed)
+                if item.ordinal is None:
+                    fixed.append((sign * item.daysAway(), seq, item))
+                else:
+                    pending.append((first, seq, item))
+    fixed.sort()
+    pending.sort(reverse=True)  # popped from the end, earliest first
+    writer = None
+    if cliopts.format != 'text':
+        writer = RecordWriter(out, cliopts.format, sources, as_of=True)
+
+    for ordinal in range(start.toordinal(), start.toordinal() + days):
+        setToday(datetime.date.fromordinal(ordinal))
+        with stage('filter'):
+            added = []
+            while pending and pending[-1][0] <= ordinal:
+                (first, seq, item) = pending.pop()
+                added.append((sign * item.ordinal, seq, item))
+            if added:
+                added.sort()
+                dated = list(heapq.merge(dated, added))
+            # sign * days away is sign * ordinal less a constant for the day
+            todoList = [entry[2] for entry in heapq.merge(dated, fixed, \
+                        key=lambda entry: (sign * entry[2].daysAway(), entry[1]))]
+            if wheretree is not None:
+                where = compileFilter(wheretree, False, ordinal, filter_settings.days_cutoff)
+                todoList = [item for item in todoList if where(item)]
+            if cliopts.limit is not None:
+                todoList = todoList[-cliopts.limit:] if descending else todoList[:cliopts.limit]
+            for item in todoList:
+                if item.recurrence is not None and item.recurrence[0] == '+':
+                    item.recur = nextRecurrence(item.date, item.recurrence)
+            if cliopts.group_cat:
+                todoList = TodoIndex(sorted(todoList, key=lambda x: (todopaths.index(x.source) \
+                                            if sources else 0, x.linenum))).grouped()
+            elif cliopts.sort_cat:
+                todoList = TodoIndex(todoList).grouped(sort=True)
+        if writer is None:
+            out.write('== %s ==\n' % TODAY.strftime('%Y-%m-%d %a'))
+            printTodoList(todoList, out)
+        else:
+            writer.as_of = TODAY.isoformat()
+            for item in todoList:
+                writer.append(item)
+    setToday(start)
+
+
+# Agenda (--agenda)
+#
+# The items falling due on each date of a range, with every occurrence
+# of the recurring items in it. Occurrences are generated lazily (see
+# occurrences), one generator for each recurring item, and merged by
+# date with the dated items, so the time taken is in the number of
+# items and the occurrences shown rather than the length of the range:
+# the merge stops at the end of the range or once --limit occurrences
+# have been shown. The days cutoff and wake windows don't apply; the
+# type and category filters and --where (on each occurrence, with days
+# away from TODAY) do.
+def _agendaOccurrences(item, start, end, seq):
+    '''Generates (ordinal, seq, copy of item due on that date) for each
+       occurrence of the recurring item in [start, end)'''
+    dates = occurrences(item.date, item.recurrence, start)
+    date = next(dates, None)
+    while date is not None and date < end:
+        following = next(dates, None)
+        copy = TodoItem.fromFields(item.type, item.desc, item.linenum, item.category, None,
+                                   date.toordinal(), item.wake, following, item.recurrence)
+        copy.source = item.source
+        yield (copy.ordinal, seq, copy)
+        date = following
+
+
+def agendaTodoFiles(cliopts, todopaths, days, out=None):
+    '''Writes the items due on each of days dates from TODAY on
+       (--agenda) to out (default stdout), after applyOptions'''
+    out = out or sys.stdout
+    (start, end) = (TODAY, TODAY + datetime.timedelta(days=days))
+    pushdown = pushdownFilter()
+    where = None
+    if filter_settings.where:
+        where = compileFilter(parseWhere(filter_settings.where), False, \
+                              TODAY.toordinal(), filter_settings.days_cutoff)
+    sources = len(todopaths) > 1
+    errout = out if cliopts.format == 'text' else sys.stderr
+    dated = []  # (ordinal, seq, item) of the items due in the range
+    recurring = []  # occurrence generators of the recurring items
+    with stage('load'):
+        for path in todopaths:
+            (items, errors) = loadTodoFile(path, PARSER_ENGINES[cliopts.parser], \
+                                           usecache=not cliopts.no_cache, jobs=cliopts.jobs, \
+                                           reader=cliopts.reader)
+            reportSyntaxErrors(errors, errout, path if sources else None)
+            for item in items:
+                if item.ordinal is None or pushdown is not None and pushdown.filtering and \
+                   not (item.type in pushdown.types and pushdown.wantCategory(item.category)):
+                    continue
+                if sources:
+                    item.source = path
+                seq = len(dated) + len(recurring)
+                if item.recurrence is not None:
+                    recurring.append(_agendaOccurrences(item, start, end, seq))
+                elif start.toordinal() <= item.ordinal < end.toordinal():
+                    dated.append((item.ordinal, seq, item))
+    dated.sort()
+    agenda = (entry[2] for entry in heapq.merge(dated, *recurring))
+    if where is not None:
+        agenda = filter(where, agenda)
+    if cliopts.limit is not None:
+        agenda = itertools.islice(agenda, cliopts.limit)
+    writer = None
+    if cliopts.format != 'text':
+        writer = RecordWriter(out, cliopts.format, sources)
+    for (ordinal, todoList) in itertools.groupby(agenda, key=lambda item: item.ordinal):
+        if writer is None:
+            out.write('== %s ==\n' % dateFromOrdinal(ordinal).strftime('%Y-%m-%d %a'))
+            printTodoList(list(todoList), out)
+        else:
+            for item in todoList:
+                writer.append(item)
+
+
+# Query daemon (--daemon)
+#
+# Keeps the parsed items of each todo file it is asked about, reloading
+# (from the parsed file cache) when the file changes or the date rolls
+# over, and answers queries from other runs. A query is one line of
+# JSON {"argv": [command line arguments], "cwd": working directory};
+# the reply is one line {"status": exit status, "stdout": output,
+# "stderr": messages}, or {"fallback": true} for a query the run has to
+# answer itself (several files, edits, --watch, usage errors...). Runs
+# use a daemon if one is listening on the socket and fall back to
+# parsing themselves otherwise; rastodoc.py asks it without loading
+# this module at all.
+DAEMON_TIMEOUT = 5  # seconds a run waits for the daemon
+
+def daemonAnswers(cliopts):
+    '''True if a daemon could answer a run with these options (it only
+       prints, always for the real date, and from the items it loaded
+       with the default parser, reader and backend)'''
+    return not (cliopts.no_daemon or cliopts.daemon or cliopts.edit or cliopts.compact or \
+                cliopts.bump_line or cliopts.bump_all_due or cliopts.cache_stats or \
+                cliopts.profile or cliopts.watch or cliopts.as_of or \
+                cliopts.forecast is not None or cliopts.agenda is not None or \
+                cliopts.parser != 'table' or cliopts.backend != 'objects' or \
+                cliopts.reader != 'text' or cliopts.jobs > 1 or cliopts.no_cache)
+
+
+class TodoDaemon(object):
+    def __init__(self):
+        self.loaded = {}  # todopath -> (stat key, (items, errors))
+        self.today = TODAY
+        self.defaults = (dict(vars(filter_settings)), dict(settings['display']))
+
+    def load(self, todopath):
+        '''Returns (items, errors) for all of the named file'''
+        key = (todoStat(todopath), os.stat(todopath).st_ino)
+        entry = self.loaded.get(todopath)
+        if entry is None or entry[0] != key:
+            entry = self.loaded[todopath] = (key, loadTodoFile(todopath))
+        return entry[1]
+
+    def query(self, argv, cwd):
+        '''Runs a query as a terminal run in cwd would, returning the
+           reply, or None if the run should answer it itself'''
+        if datetime.date.today() != self.today:
+            setToday()  # midnight; '+' recurrences need reparsing
+            self.today = TODAY
+            self.loaded.clear()
+        setToday(self.today)
+        vars(filter_settings).clear()
+        vars(filter_settings).update(self.defaults[0])
+        settings['display'] = dict(self.defaults[1])
+
+        optparser = makeOptionParser()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()), \
+                 contextlib.redirect_stderr(io.StringIO()):
+                (cliopts, cliargs) = optparser.parse_args(argv)
+                checkOptions(optparser, cliopts)
+        except SystemExit:  # --help or a usage error, for the run to print
+            return None
+        if not daemonAnswers(cliopts):
+            return None
+        try:
+            todopaths = expandTodoPaths([os.path.join(cwd, os.path.expanduser(spec)) \
+                                         for spec in cliopts.file or [DEFAULTTODOFILE]])
+        except ValueError:
+            return None
+        if len(todopaths) != 1 or not os.access(todopaths[0], os.R_OK):
+            return None
+        todopath = os.path.normpath(todopaths[0])
+        applyOptions(cliopts)
+        try:
+            loaded = self.load(todopath)
+        except OSError as e:
+            return {'status': 1, 'stdout': '', 'stderr': '%s\n' % e}
+        if cliopts.stats or cliopts.count:
+            stats = TodoStats()
+            stats.addItems(loaded[0], loaded[1], pushdownFilter())
+            out = io.StringIO()
+            stats.report(out, cliopts.format, count=not cliopts.stats)
+            return {'status': 0, 'stdout': out.getvalue(), 'stderr': ''}
+        (todoList, errors) = queryTodoItems(cliopts, todopath, loaded, \
+                                            descending=not cliopts.reverse)
+        out = io.StringIO()
+        errout = out if cliopts.format == 'text' else io.StringIO()
+        reportSyntaxErrors(errors, errout)
+        printTodoList(todoList, out, cliopts.format)
+        return {'status': 0, 'stdout': out.getvalue(),
+                'stderr': '' if errout is out else errout.getvalue()}
+
+    def handle(self, rfile, wfile):
+        '''Answers the query read from rfile'''
+        import json
+        line = rfile.readline()
+        if not line:
+            return  # just checking it is running
+        try:
+            request = json.loads(line)
+            reply = self.query(request['argv'], request['cwd'])
+        except Exception as e:  # keep serving
+            reply = {'status': 1, 'stdout': '', 'stderr': 'rastodo daemon: %r\n' % e}
+        try:
+            wfile.write(json.dumps(reply or {'fallback': True}).encode('ascii') + b'\n')
+        except OSError:
+            pass  # the run gave up waiting
+
+
+def queryDaemon(argv, socketpath=None):
+    '''Asks a running daemon to answer the query for the command line
+       arguments argv; returns its reply, or None if there is no
+       daemon to ask or it left the query to this run'''
+    import json
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(DAEMON_TIMEOUT)
+            sock.connect(socketpath or settings['paths']['socket'])
+            request = {'argv': argv, 'cwd': os.getcwd()}
+            sock.sendall(json.dumps(request).encode('ascii') + b'\n')
+            with sock.makefile('rb') as replies:
+                reply = json.loads(replies.readline())
+    except (OSError, ValueError):
+        return None  # not running, or gone away
+    return None if reply.get('fallback') else reply
+
+
+def serveDaemon(socketpath=None, preload=()):
+    '''Runs a TodoDaemon on the socket until interrupted, loading the
+       preload todo files first'''
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            daemon.handle(self.rfile, self.wfile)
+
+    socketpath = socketpath or settings['paths']['socket']
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        if sock.connect_ex(socketpath) == 0:
+            sys.exit("A daemon is already listening on %s" % socketpath)
+    try:
+        os.unlink(socketpath)  # left behind by one that was killed
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(socketpath) or '.', exist_ok=True)
+    daemon = TodoDaemon()
+    oldmask = os.umask(0o077)  # only this user can connect
+    try:
+        server = socketserver.UnixStreamServer(socketpath, Handler)
+    finally:
+        os.umask(oldmask)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for path in preload:
+            if os.access(path, os.R_OK):
+                daemon.load(os.path.abspath(path))
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socketpath)
+
+
+def main(asked=False):
+    '''Runs rastodo for the command line in sys.argv; asked is True if a
+       daemon has already been asked and left the query to this run'''
+    global droid, cache_stats
+    # Parse commandline arguments
+    optparser = makeOptionParser()
+    (cliopts, cliargs) = optparser.parse_args()
+    checkOptions(optparser, cliopts)
+
+    # Check term option first
+    if cliopts.terminal:
+        droid = None
+
+    if cliopts.socket:
+        settings['paths']['socket'] = cliopts.socket
+    # Check file arguments second
+    try:
+        todopaths = expandTodoPaths(cliopts.file or [settings['paths']['todopath']])
+    except ValueError as e:
+        sys.exit(str(e))
+    settings['paths']['todopath'] = todopath = todopaths[0]
+    if cliopts.daemon:
+        serveDaemon(preload=todopaths)
+        sys.exit()
+    for path in todopaths:
+        if not os.access(path, os.F_OK):
+            sys.exit("%s does not exist; use the -f option to specify a todo file" % path)
+        if not os.access(path, os.R_OK):
+            sys.exit("%s is not readable." % path)
+
+    # If edit mode, send to defined editor, replacing this process
+    # (with any journals folded in first, as the line numbers change)
+    if cliopts.edit:
+        for path in todopaths:
+            try:
+                compactTodoFile(path)
+            except (ValueError, OSError) as e:
+                print("Warning: %s not compacted: %s" % (path, e), file=sys.stderr)
+        os.execlp(EDITOR, "editor", *todopaths)  # replaces this process
+    if cliopts.compact:
+        for path in todopaths:
+            try:
+                batches = compactTodoFile(path)
+            except (ValueError, OSError) as e:
+                sys.exit("%s not compacted: %s" % (path, e))
+            if batches:
+                print("Compacted %d journalled edits into %s" % (batches, path))
+        sys.exit()
+    # If bumping, rewrite the files and stop
+    if cliopts.bump_line or cliopts.bump_all_due:
+        edits = dict((path, {}) for path in todopaths)
+        realpaths = dict((os.path.realpath(path), path) for path in todopaths)
+        if cliopts.bump_line:
+            for entry in cliopts.bump_line.split(','):
+                (path, sep, num) = entry.rpartition(':')
+                if not sep and len(todopaths) > 1:
+                    sys.exit("--bump-line needs FILE:LINE with more than one todo file")
+                path = realpaths.get(os.path.realpath(path)) if sep else todopath
+                if path is None:
+                    sys.exit("%s is not one of the todo files" % entry.rpartition(':')[0])
+                edits[path][int(num)] = ('bump', None)
+        # Check the lines first (just those lines, with the line index)
+        # rather than failing after reading all of a big file
+        for path in todopaths:
+            for linenum in sorted(edits[path]):
+                line = readLineAt(path, linenum)
+                if line is None:
+                    sys.exit("%s not changed: there is no line %d" % (path, linenum))
+                if bumpTodoLine(line) is None:
+                    sys.exit("%s not changed: line %d is not a recurring item that can be "
+                             "bumped" % (path, linenum))
+        for path in todopaths:
+            if not edits[path] and not cliopts.bump_all_due:
+                continue
+            try:
+                changes = editTodoFile(path, edits[path], bumpdue=cliopts.bump_all_due, \
+                                       journal=cliopts.journal)
+            except (ValueError, OSError) as e:
+                sys.exit("%s not changed: %s" % (path, e))
+            for (linenum, oldline, newline) in changes:
+                if len(todopaths) == 1:
+                    print("Bumped line %d: %s" % (linenum, newline.rstrip('\r\n')))
+                else:
+                    print("Bumped line %s:%d: %s" % (path, linenum, newline.rstrip('\r\n')))
+        sys.exit()
+
+    # Stop quietly when the output is closed early (e.g. piped to head)
+    if hasattr(signal, 'SIGPIPE'):
+        signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+    # Let a running daemon answer if there is one (it has single files)
+    if droid is None and not asked and len(todopaths) == 1 and daemonAnswers(cliopts):
+        reply = queryDaemon(sys.argv[1:])
+        if reply is not None:
+            sys.stdout.write(reply['stdout'])
+            sys.stderr.write(reply['stderr'])
+            sys.exit(reply['status'])
+
+    if cliopts.profile:
+        startProfile()
+    cache_stats = bool(cliopts.profile or cliopts.cache_stats)
+    try:
+        applyOptions(cliopts)
+        if cliopts.watch and droid is None:
+            watchTodoFiles(cliopts, todopaths, descending=not cliopts.reverse)
+            sys.exit()
+        if cliopts.forecast is not None:
+            forecastTodoFiles(cliopts, todopaths, cliopts.forecast, descending=not cliopts.reverse)
+            sys.exit()
+        if cliopts.agenda is not None:
+            agendaTodoFiles(cliopts, todopaths, cliopts.agenda)
+            sys.exit()
+        if cliopts.stats or cliopts.count:
+            stats = TodoStats()
+            pushdown = pushdownFilter()
+            for path in todopaths:
+                body = loadTodoBody(path, PARSER_ENGINES[cliopts.parser], cliopts.jobs, \
+                                    cliopts.reader, usecache=not cliopts.no_cache)[1]
+                addCount('records read from cache', len(body[1]))
+                with stage('count'):
+                    stats.addRecords(body, pushdown)
+            addCount('items counted', stats.count)
+            stats.report(sys.stdout, cliopts.format, count=not cliopts.stats)
+            sys.exit()
+
+        # android always newest on top
+        # Records are written as they are parsed if they don't need sorting
+        streaming = None
+        if droid is None and cliopts.format != 'text' and cliopts.no_sort:
+            streaming = RecordWriter(sys.stdout, cliopts.format, len(todopaths) > 1)
+        (todoList, errors) = queryTodoFiles(cliopts, todopaths, \
+                                            descending=droid is None and not cliopts.reverse, \
+                                            ret=streaming)
+        for (path, errs) in errors:
+            reportSyntaxErrors(errs, sys.stdout if cliopts.format == 'text' else sys.stderr, \
+                               source=path if len(todopaths) > 1 else None)
+            addCount('syntax errors reported', len(errs))
+        if cliopts.cache_stats:
+            stats = readCacheStats()
+            sys.stderr.write("cache: %d hits, %d rehashed hits, %d partial reparses, " \
+                             "%d misses\n" % (stats.get('hit', 0), stats.get('rehash', 0), \
+                                              stats.get('partial', 0), stats.get('miss', 0)))
+
+        # Display items
+        if droid is None:
+            if streaming is None:
+                printTodoList(todoList, format=cliopts.format, sources=len(todopaths) > 1)
+            addCount('items shown', len(todoList))
+        else:  # droid - display in listview
+            groups = TodoIndex(todoList).categories
+            categories = ["[Uncategorized]" if cat is None else cat for cat in groups]
+
+            # TODO: Option for [Add Item] ? In each category?
+            todoselection = None
+
+            while todoselection == None:
+                try:
+                    droid.dialogCreateAlert('Todo Categories:', '')
+                    droid.dialogSetItems(categories)
+                    droid.dialogShow()
+
+                    # triggers an exception if back key used
+                    cat = categories[droid.dialogGetResponse().result['item']]
+                    if cat == "[Uncategorized]":
+                        cat = None
+
+                except:
+                    sys.exit()  # back pressed in cat menu
+
+                try:
+                    items = [item.prettyPrintStr() for item in groups.get(cat, ())]
+
+                    droid.dialogCreateAlert('Todo List:', cat)
+                    droid.dialogSetItems(items)
+                    droid.dialogShow()
+
+                    # triggers an exception if back key used
+                    todoselection = droid.dialogGetResponse().result['item']
+                except:
+                    pass  # do nothing; goes back to cat menu
+
+                    # end while for displaying listview
+                    # action on selected todo item
+                    # XXX: menu with options, date/time picker etc?
+                    # TODO: newline = droid.dialogGetInput('Edit Entry',  oldline, oldline).result
+
+
+                    # end else for droid displayitems
+
+    finally:
+        # Report however the run ends (the modes above exit early)
+        if profile is not None:
+            profile.finish()
+            sys.stdout.flush()
+            profile.report(cliopts.profile)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+#
+# Quick client for the rastodo query daemon.
+#
+'''
+   Runs rastodo.py with the same arguments, asking a running daemon
+   (rastodo.py --daemon) first without loading rastodo itself, so
+   status lines and prompt hooks only pay for starting Python and a
+   round trip on the socket.
+
+   Usage: rastodoc.py [rastodo.py options]
+
+   If no daemon is listening, or it leaves the query to the run (for
+   several files, edits, --watch and so on), rastodo is loaded and
+   run here as usual.
+'''
+
+import os, sys, socket, signal, json
+
+DAEMON_TIMEOUT = 5  # seconds to wait for the daemon, as rastodo.py
+
+
+def socketPath(argv):
+    '''Returns the daemon socket for the command line arguments argv
+       as rastodo.py finds it, or None if this can't tell (an
+       abbreviated --socket option)'''
+    for (i, arg) in enumerate(argv):
+        if arg == '--':
+            break
+        if arg == '--socket' and i + 1 < len(argv):
+            return argv[i + 1]
+        if arg.startswith('--socket='):
+            return arg[len('--socket='):]
+        if arg.startswith('--soc'):
+            return None
+    cachedir = os.path.join(os.getenv('XDG_CACHE_HOME') or \
+                            os.path.join(os.getenv('HOME', ''), '.cache'), 'rastodo')
+    return os.path.join(cachedir, 'daemon.sock')
+
+
+def queryDaemon(argv, socketpath):
+    '''Asks the daemon on socketpath to answer the query for argv, as
+       rastodo.queryDaemon does; returns its reply, or None if there is
+       no daemon or it left the query to this run'''
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(DAEMON_TIMEOUT)
+            sock.connect(socketpath)
+            request = {'argv': argv, 'cwd': os.getcwd()}
+            sock.sendall(json.dumps(request).encode('ascii') + b'\n')
+            with sock.makefile('rb') as replies:
+                reply = json.loads(replies.readline())
+    except (OSError, ValueError):
+        return None  # not running, or gone away
+    return None if reply.get('fallback') else reply
+
+
+if __name__ == '__main__':
+    # Stop quietly when the output is closed early (e.g. piped to head)
+    if hasattr(signal, 'SIGPIPE'):
+        signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+    socketpath = socketPath(sys.argv[1:])
+    if socketpath is not None:
+        reply = queryDaemon(sys.argv[1:], socketpath)
+        if reply is not None:
+            sys.stdout.write(reply['stdout'])
+            sys.stderr.write(reply['stderr'])
+            sys.exit(reply['status'])
+    import rastodo  # from its bytecode cache, unlike running rastodo.py
+    rastodo.main(asked=socketpath is not None)
@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+#
+# The parsed file cache gives the items a fresh parse does.
+#
+
+import os, sys, unittest
+import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+import rastodo
+from todotest import TodoFileTest
+
+TODO = (b'w wish\n'
+        b't 2016-02-30 impossible date\n'
+        b'[work]\n'
+        b't 2016-01-25 report\n'
+        b'r1 2016-01-31 =1m rent\n'
+        b'r2 2016-01-10 +2w laundry\n'
+        b'[home]\n'
+        b'a3 2016-01-22 anniversary\n'
+        b's2 2016-01-10 tidy the shed\n'
+        b'c5 always\n')
+
+
+def summary(items):
+    return [(item.linenum, item.type, item.category, item.desc, item.date, item.days,
+             item.wake, item.recur, item.recurrence) for item in items]
+
+
+class CachedFileTest(TodoFileTest):
+    '''A test on TODO, counting cache results'''
+    def setUp(self):
+        TodoFileTest.setUp(self)
+        self.write(TODO)
+        rastodo.cache_stats = True
+
+    def tearDown(self):
+        rastodo.cache_stats = False
+        TodoFileTest.tearDown(self)
+
+    def load(self, **options):
+        (items, errors) = rastodo.loadTodoFile(self.path, **options)
+        return (summary(items), errors)
+
+    def touch(self, seconds=10):
+        '''Moves the mtime of the todo file on, as a later edit would'''
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + seconds * 10**9))
+
+
+class CacheTest(CachedFileTest):
+    def test_hit_matches_parse(self):
+        expected = self.load(usecache=False)
+        self.assertEqual(rastodo.readCacheStats(), {})
+        self.assertEqual(self.load(), expected)
+        self.assertEqual(self.load(), expected)
+        self.assertEqual(rastodo.readCacheStats(), {'miss': 1, 'hit': 1})
+        self.assertEqual(expected[1], [2])
+
+    def test_hit_on_another_day(self):
+        self.load()
+        rastodo.setToday(datetime.date(2016, 3, 1))  # days and '+' recurrences move
+        self.assertEqual(self.load(), self.load(usecache=False))
+        self.assertEqual(rastodo.readCacheStats(), {'miss': 1, 'hit': 1})
+
+    def test_touched(self):
+        self.load()
+        self.touch()
+        self.assertEqual(self.load(), self.load(usecache=False))
+        self.assertEqual(rastodo.readCacheStats(), {'miss': 1, 'rehash': 1})
+
+    def test_changed(self):
+        self.load()
+        self.write(TODO.replace(b'report', b'review'))
+        self.touch()
+        (items, errors) = self.load()
+        self.assertEqual((items, errors), self.load(usecache=False))
+        self.assertIn('review', [item[3] for item in items])
+
+    def test_other_parser_not_cached(self):
+        expected = self.load(usecache=False)
+        self.assertEqual(self.load(parseLine=rastodo.parseTodoLineLegacy), expected)
+        self.assertFalse(os.path.exists(rastodo.cachePath(self.path)))
+        self.assertEqual(rastodo.readCacheStats(), {})
+
+    def test_corrupt_cache(self):
+        expected = self.load()
+        with open(rastodo.cachePath(self.path), 'r+b') as f:
+            f.seek(40)
+            f.write(b'\xff' * 40)
+        self.assertEqual(self.load(), expected)
+
+    def test_stats_only_when_asked(self):
+        rastodo.cache_stats = False
+        self.load()
+        self.load()
+        self.assertFalse(os.path.exists(os.path.join(rastodo.settings['paths']['cachedir'],
+                                                     'stats')))
+
+
+class IncrementalTest(CachedFileTest):
+    def edit(self, old, new):
+        self.write(self.read().replace(old, new))
+        self.touch()
+
+    def reused(self):
+        '''Returns how many blocks loading the file again reuses'''
+        (header, cached) = rastodo._readCache(rastodo.cachePath(self.path))
+        with cached:
+            oldblocks = rastodo._oldBlocks(rastodo.marshal.loads(cached.read()))
+        return rastodo.parseBlocks(self.read(), oldblocks=oldblocks)[3]
+
+    def check(self):
+        expected = self.load(usecache=False)
+        self.assertEqual(self.load(), expected)
+        self.assertEqual(self.load(), expected)  # and from the new cache
+
+    def test_one_line_changed(self):
+        self.load()
+        self.edit(b'report', b'review')
+        self.assertEqual(self.reused(), 2)
+        self.check()
+        self.assertEqual(rastodo.readCacheStats(), {'miss': 1, 'partial': 1, 'hit': 1})
+
+    def test_lines_added_above(self):
+        self.load()
+        self.edit(b'w wish\n', b'w wish\nw another\n\n# comment\n')
+        self.assertEqual(self.reused(), 2)
+        self.check()
+
+    def test_lines_removed_and_block_added(self):
+        self.load()
+        self.edit(b'r2 2016-01-10 +2w laundry\n', b'[new]\nt 2016-02-31 bad\n')
+        self.assertEqual(self.reused(), 2)
+        self.check()
+
+    def test_blocks_swapped(self):
+        self.load()
+        data = self.read()
+        (work, home) = (data.index(b'[work]'), data.index(b'[home]'))
+        self.write(data[:work] + data[home:] + data[work:home])
+        self.touch()
+        self.assertEqual(self.reused(), 3)
+        self.check()
+
+    def test_parallel(self):
+        self.load()
+        self.edit(b'report', b'review')
+        expected = self.load(usecache=False)
+        self.assertEqual(self.load(jobs=2), expected)
+        self.assertEqual(rastodo.readCacheStats(), {'miss': 1, 'partial': 1})
+
+    def test_crlf(self):
+        self.write(TODO.replace(b'\n', b'\r\n'))
+        self.load()
+        self.edit(b'report', b'review')
+        self.assertEqual(self.reused(), 2)
+        self.check()
+
+    def test_cr(self):
+        self.write(TODO.replace(b'\n', b'\r'))
+        self.load()
+        self.edit(b'report', b'review')
+        self.assertEqual(self.reused(), 2)
+        self.check()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+#
+# The columnar backend (--backend=columnar) prints what the object
+# backend does.
+#
+
+import os, sys, subprocess, unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+from todotest import TodoFileTest
+
+TODO = ('w wish\n'
+        't 2016-01-25 dentist\n'
+        't 2016-02-30 impossible date\n'
+        'c0 always\n'
+        '[work]\n'
+        't 2016-01-25 report\n'
+        's3 2016-01-22 asleep until near\n'
+        's30 2016-03-01 asleep a while\n'
+        'r1 2016-01-31 =1m rent\n'
+        'r2 2016-01-10 +2w laundry\n'
+        'r1 9999-06-30 =1m far away\n'
+        '[home]\n'
+        'a3 2016-01-22 anniversary\n'
+        'a30 2016-02-10 trip\n'
+        'c12 sometime\n'
+        't 2015-12-01 long overdue\n'
+        'x unknown type\n'
+        '[empty]\n'
+        '[home]\n'
+        'w another wish\n')
+
+
+class ColumnarTest(TodoFileTest):
+    def setUp(self):
+        TodoFileTest.setUp(self)
+        self.write(TODO.encode())
+
+    def listing(self, backend, *args):
+        '''Returns (status, stdout, stderr) of rastodo.py with these
+           arguments on the test file'''
+        env = dict(os.environ, XDG_CACHE_HOME=self.tmpdir.name)
+        result = subprocess.run([sys.executable, os.path.join(HERE, '..', 'rastodo.py'),
+                                 '-f', self.path, '--no-daemon', '--mono',
+                                 '--as-of', '2016-01-20', '--backend', backend] + list(args),
+                                env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True)
+        return (result.returncode, result.stdout, result.stderr)
+
+    def check(self, *args):
+        expected = self.listing('objects', *args)
+        self.assertEqual(expected[0], 0, expected[2])
+        self.assertEqual(self.listing('columnar', *args), expected, args)
+        self.assertEqual(self.listing('columnar', *args), expected, args)  # columns cached
+
+    def test_default(self):
+        self.check()
+        self.check('--format', 'jsonl')
+        self.check('--reverse', '--format', 'csv')
+
+    def test_option_filters(self):
+        self.check('--all')
+        self.check('--days', '3')
+        self.check('--days', '400')
+        self.check('--only-types', 'tsa')
+        self.check('--only-cat', 'home,empty')
+        self.check('--ex-cat', 'work')
+        self.check('--ex-types', 'cw')
+
+    def test_where(self):
+        self.check('--where', 'days < 3 and cat != none')
+        self.check('--all', '--where', 'type in "rw" or desc ~ "^a"')
+        self.check('--search', 'wish')
+
+    def test_grouping(self):
+        self.check('--sort-cat')
+        self.check('--group-cat')
+        self.check('--limit', '4', '--group-cat')
+
+    def test_changed_file(self):
+        self.check()
+        with open(self.path, 'a') as f:
+            f.write('t 2016-01-21 added later\n')
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**10))
+        self.check()
+
+
+if __name__ == '__main__':
+    unittest.main()
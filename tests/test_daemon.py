@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+#
+# The query daemon answers plain listings and leaves runs with other
+# engines, edits or dates to the run itself.
+#
+
+import os, sys, unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+import rastodo
+from todotest import TodoFileTest
+
+TODO = (b'w wish\n'
+        b'[work]\n'
+        b't 2016-01-25 report\n'
+        b'r1 2016-01-31 =1m rent\n')
+
+
+class DaemonTest(TodoFileTest):
+    def setUp(self):
+        TodoFileTest.setUp(self)
+        self.write(TODO)
+        self.filters = dict(vars(rastodo.filter_settings))
+        self.display = dict(rastodo.settings['display'])
+        self.daemon = rastodo.TodoDaemon()
+
+    def tearDown(self):
+        vars(rastodo.filter_settings).clear()
+        vars(rastodo.filter_settings).update(self.filters)
+        rastodo.settings['display'] = self.display
+        TodoFileTest.tearDown(self)
+
+    def query(self, *args):
+        return self.daemon.query(['-f', self.path, '--mono'] + list(args), self.tmpdir.name)
+
+    def test_answers(self):
+        for args in ((), ('--format', 'jsonl'), ('--where', 'type == "t"'), ('--count',),
+                     ('--parser', 'table'), ('--jobs', '1')):
+            reply = self.query(*args)
+            self.assertIsNotNone(reply, args)
+            self.assertEqual(reply['status'], 0, reply['stderr'])
+        self.assertIn('report', self.query()['stdout'])
+
+    def test_other_engines_fall_back(self):
+        for args in (('--parser', 'legacy'), ('--backend', 'columnar'), ('--reader', 'mmap'),
+                     ('--jobs', '2'), ('--no-cache',)):
+            self.assertIsNone(self.query(*args), args)
+
+    def test_other_runs_fall_back(self):
+        for args in (('--as-of', '2016-02-01'), ('--forecast', '3'), ('--agenda', '7'),
+                     ('--bump-line', '4'), ('--profile',), ('--no-daemon',), ('--help',),
+                     ('--no-such-option',)):
+            self.assertIsNone(self.query(*args), args)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+#
+# Each day of --forecast is the list --as-of that day shows.
+#
+
+import os, sys, subprocess, unittest, json
+import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+from todotest import TodoFileTest
+
+TODO = ('w wish\n'
+        't 2016-01-22 dentist\n'
+        't 2016-02-30 impossible date\n'
+        'c2 always\n'
+        '[work]\n'
+        't 2016-01-26 report\n'
+        's1 2016-01-24 asleep until the day before\n'
+        's9 2016-01-30 asleep a while\n'
+        'r1 2016-01-21 =1w standup notes\n'
+        'r2 2016-01-10 +2w laundry\n'
+        '[home]\n'
+        'a2 2016-01-25 anniversary\n'
+        'a1 2016-01-27 trip\n'
+        'c9 sometime\n'
+        't 2015-12-01 long overdue\n'
+        'w another wish\n')
+START = datetime.date(2016, 1, 20)
+DAYS = 8
+
+
+class ForecastTest(TodoFileTest):
+    def setUp(self):
+        TodoFileTest.setUp(self)
+        self.write(TODO.encode())
+
+    def listing(self, *args):
+        '''Returns the output of rastodo.py with these arguments on the
+           test file'''
+        env = dict(os.environ, XDG_CACHE_HOME=self.tmpdir.name)
+        result = subprocess.run([sys.executable, os.path.join(HERE, '..', 'rastodo.py'),
+                                 '-f', self.path, '--no-daemon', '--mono'] + list(args),
+                                env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout
+
+    def dates(self):
+        return [(START + datetime.timedelta(days)).isoformat() for days in range(DAYS)]
+
+    def check(self, *args, text=False):
+        '''Checks the jsonl forecast (and the text one if text is true)
+           against --as-of each day'''
+        forecast = dict((date, []) for date in self.dates())
+        for line in self.listing('--as-of', START.isoformat(), '--forecast', str(DAYS),
+                                 '--format', 'jsonl', *args).splitlines():
+            record = json.loads(line)
+            forecast[record.pop('as_of')].append(record)
+        for date in self.dates():
+            asof = self.listing('--as-of', date, '--format', 'jsonl', *args)
+            self.assertEqual(forecast[date], [json.loads(line) for line in asof.splitlines()],
+                             (date, args))
+        if not text:
+            return
+        days = self.listing('--as-of', START.isoformat(), '--forecast', str(DAYS),
+                            *args).split('== ')[1:]
+        self.assertEqual(len(days), DAYS)
+        for (date, listing) in zip(self.dates(), days):
+            # less the date, and the syntax errors reported before the list
+            asof = self.listing('--as-of', date, *args)
+            self.assertEqual(listing.split('\n', 1)[1], asof[asof.index('\n') + 1:],
+                             (date, args))
+
+    def test_default(self):
+        self.check(text=True)
+        self.check('--reverse')
+
+    def test_filters(self):
+        self.check('--days', '3')
+        self.check('--all', '--only-types', 'trs')
+
+    def test_where_and_limit(self):
+        self.check('--days', '4', '--where', 'days <= 1 or cat == "home"')
+        self.check('--limit', '3')
+
+    def test_grouping(self):
+        self.check('--days', '3', '--sort-cat', text=True)
+        self.check('--days', '3', '--group-cat', text=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+#
+# The edit journal (--journal, --compact).
+#
+
+import os, sys, unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+import rastodo
+from todotest import TodoFileTest
+
+TODO = b'w a\r\nr1 2016-01-10 +1w b\n[cat]\nr2 2016-01-31 =1m c\nw d'
+
+
+class JournalTest(TodoFileTest):
+    def setUp(self):
+        TodoFileTest.setUp(self)
+        self.write(TODO)
+
+    def journal(self):
+        with open(self.path + '.journal', 'rb') as f:
+            return f.read()
+
+    def edit(self, edits, **options):
+        return rastodo.editTodoFile(self.path, edits, journal=True, **options)
+
+    def expected(self, batches):
+        '''The file after the same batches of edits made by rewriting'''
+        path = os.path.join(self.tmpdir.name, 'rewritten.todo')
+        self.write(TODO, path)
+        for (edits, bumpdue) in batches:
+            rastodo.rewriteTodoFile(path, edits, bumpdue)
+        return self.read(path)
+
+    def test_replay_matches_rewrite(self):
+        batches = [({2: ('bump', None)}, False),
+                   ({6: ('insert', 'w e\n'), 1: ('delete', None)}, False),
+                   ({2: ('replace', '[other]\n')}, True)]
+        for (edits, bumpdue) in batches:
+            self.assertTrue(self.edit(edits, bumpdue=bumpdue))
+        self.assertEqual(self.read(), TODO)  # only the journal is written
+        expected = self.expected(batches)
+        self.assertEqual(rastodo.readTodoData(self.path), expected)
+        with rastodo.openTodoFile(self.path) as f:
+            self.assertEqual(f.read(), expected.decode())
+        (items, errors) = rastodo.loadTodoFile(self.path)
+        self.assertEqual([(item.linenum, item.category, item.desc) for item in items],
+                         [(1, None, 'b'), (3, 'other', 'c'), (4, 'other', 'd'),
+                          (5, 'other', 'e')])
+
+        self.assertEqual(rastodo.compactTodoFile(self.path), 3)
+        self.assertEqual(self.read(), expected)
+        self.assertFalse(os.path.exists(self.path + '.journal'))
+        self.assertEqual(rastodo.compactTodoFile(self.path), 0)
+
+    def test_journal_kept_once_started(self):
+        self.edit({2: ('bump', None)})
+        rastodo.editTodoFile(self.path, {4: ('bump', None)})
+        self.assertEqual(self.read(), TODO)
+        self.assertEqual(rastodo.compactTodoFile(self.path), 2)
+
+    def test_failed_edit_not_journalled(self):
+        self.edit({2: ('bump', None)})
+        journal = self.journal()
+        self.assertRaises(ValueError, self.edit, {1: ('bump', None)})
+        self.assertRaises(ValueError, self.edit, {9: ('delete', None)})
+        self.assertEqual(self.journal(), journal)
+
+    def test_changed_file(self):
+        self.edit({2: ('bump', None)})
+        with open(self.path, 'ab') as f:
+            f.write(b'\nw changed\n')
+        self.assertRaises(ValueError, self.edit, {1: ('delete', None)})
+        self.assertRaises(ValueError, rastodo.compactTodoFile, self.path)
+        self.assertEqual(rastodo.readTodoData(self.path), TODO + b'\nw changed\n')
+
+    def test_half_written_record_ignored(self):
+        self.edit({2: ('bump', None)})
+        with open(self.path + '.journal', 'ab') as f:
+            f.write(b'[[1, "w a')
+        self.assertEqual(rastodo.readTodoData(self.path), self.expected([({2: ('bump', None)},
+                                                                          False)]))
+
+    def test_compacts_when_big(self):
+        size = rastodo.JOURNAL_COMPACT_SIZE
+        rastodo.JOURNAL_COMPACT_SIZE = 200
+        try:
+            for n in range(10):
+                self.edit({1: ('replace', 'w %d\r\n' % n)})
+        finally:
+            rastodo.JOURNAL_COMPACT_SIZE = size
+        self.assertNotEqual(self.read(), TODO)  # compacted on the way
+        if os.path.exists(self.path + '.journal'):
+            self.assertLess(os.path.getsize(self.path + '.journal'), 200)
+        self.assertEqual(rastodo.readTodoData(self.path).split(b'\n')[0], b'w 9\r')
+
+
+if __name__ == '__main__':
+    unittest.main()
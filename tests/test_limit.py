@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+#
+# --limit N keeps the N items the full sort ends with.
+#
+
+import os, sys, subprocess, unittest, random
+import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+import rastodo
+from todotest import TodoFileTest
+
+
+def todoData(seed, lines=120):
+    '''Returns todo file contents with many items due on the same days'''
+    rand = random.Random(seed)
+    ret = []
+    for num in range(lines):
+        if num % 25 == 0:
+            ret.append('[cat %d]' % (num // 25))
+        day = datetime.date(2016, 1, 20) + datetime.timedelta(rand.randrange(-5, 10))
+        ret.append(rand.choice(['t %s item %d' % (day, num),
+                                'a2 %s item %d' % (day, num),
+                                'c%d item %d' % (rand.randrange(5), num),
+                                'w item %d' % num]))
+    return '\n'.join(ret) + '\n'
+
+
+class UrgentItemsTest(unittest.TestCase):
+    def setUp(self):
+        rastodo.setToday(datetime.date(2016, 1, 20))
+
+    def tearDown(self):
+        rastodo.setToday()
+
+    def test_matches_sort(self):
+        for seed in range(5):
+            (items, errors) = rastodo.readTodoItems(todoData(seed).splitlines(True))
+            for descending in (True, False):
+                full = sorted(items, key=rastodo.TodoItem.daysAway, reverse=descending)
+                for limit in (1, 7, 30, len(items), len(items) + 5):
+                    urgent = rastodo.UrgentItems(limit, descending)
+                    for item in items:
+                        urgent.append(item)
+                    expected = full[-limit:] if descending else full[:limit]
+                    self.assertEqual(urgent.sortedItems(), expected,
+                                     (seed, descending, limit))
+
+
+class LimitTest(TodoFileTest):
+    def setUp(self):
+        TodoFileTest.setUp(self)
+        self.paths = [self.path, os.path.join(self.tmpdir.name, 'other.todo')]
+        for (seed, path) in enumerate(self.paths):
+            self.write(todoData(seed).encode(), path)
+
+    def listing(self, *args):
+        '''Returns the lines rastodo.py prints with these arguments'''
+        env = dict(os.environ, XDG_CACHE_HOME=self.tmpdir.name)
+        result = subprocess.run([sys.executable, os.path.join(HERE, '..', 'rastodo.py'),
+                                 '--no-daemon', '--as-of', '2016-01-20', '--format', 'jsonl']
+                                + list(args),
+                                env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout.splitlines()
+
+    def check(self, *args):
+        full = self.listing(*args)
+        reverse = self.listing('--reverse', *args)
+        for limit in (1, 10, len(full) + 1):
+            self.assertEqual(self.listing('--limit', str(limit), *args), full[-limit:],
+                             (limit, args))
+            self.assertEqual(self.listing('--limit', str(limit), '--reverse', *args),
+                             reverse[:limit], (limit, args))
+
+    def test_one_file(self):
+        self.check('-f', self.path)
+        self.check('-f', self.path, '--all')  # from the cache this time
+
+    def test_files_merged(self):
+        self.check('-f', self.paths[0], '-f', self.paths[1], '--days', '5')
+
+    def test_columnar(self):
+        self.check('-f', self.path, '--backend', 'columnar')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+#
+# Parallel parsing (--jobs) gives what a serial parse does, whatever the
+# line endings.
+#
+
+import os, sys, io, unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+import rastodo
+
+ENDINGS = (b'\n', b'\r\n', b'\r', b'\n', b'\r')
+
+
+def todoData(lines=400):
+    ret = []
+    for num in range(lines):
+        if num % 50 == 0:
+            line = b'[cat %d]' % (num // 50)
+        elif num % 37 == 0:
+            line = b'x not an item'
+        else:
+            line = b'w item %d' % num
+        ret.append(line + ENDINGS[num % len(ENDINGS)])
+    return b''.join(ret)
+
+
+def summary(items):
+    return [(item.linenum, item.category, item.desc) for item in items]
+
+
+class LineEndingsTest(unittest.TestCase):
+    def test_count_lines(self):
+        data = b'a\nb\r\nc\rd\r\re'
+        self.assertEqual(rastodo.countLines(data, 0, len(data)), 5)
+        self.assertEqual(rastodo.countLines(data, 2, 5), 1)
+
+    def test_category_at(self):
+        data = b'w a\r[one]\rw b\r\n[two]\r\nw c\nw d'
+        self.assertEqual(rastodo.categoryAt(data, 0), None)
+        self.assertEqual(rastodo.categoryAt(data, data.index(b'w b')), 'one')
+        self.assertEqual(rastodo.categoryAt(data, data.index(b'w d')), 'two')
+
+    def test_split_lines(self):
+        data = todoData()
+        pieces = rastodo.splitLines(data, 0, len(data), 100)
+        self.assertGreater(len(pieces), 10)
+        for (start, end) in pieces[:-1]:
+            self.assertIn(data[end-1:end], (b'\n', b'\r'))
+            self.assertNotEqual(data[end-1:end+1], b'\r\n')
+
+    def test_parallel_matches_serial(self):
+        data = todoData()
+        (items, errors) = rastodo.readTodoItems(io.TextIOWrapper(io.BytesIO(data)))
+        for reader in rastodo.READERS:
+            (pitems, perrors) = rastodo.parseParallel(data, jobs=3, reader=reader)
+            self.assertEqual(summary(pitems), summary(items), reader)
+            self.assertEqual(perrors, errors, reader)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+#
+# The --parser engines make the same items and report the same syntax
+# errors.
+#
+
+import os, sys, io, unittest
+import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+import rastodo
+
+TODO = ('t 2016-01-25 dentist\n'
+        't 2016-02-30 impossible date\n'
+        's2 2016-13-01 bad month\n'
+        'a3 2016-01-22 anniversary\n'
+        'a3 2016-00-22 bad appointment\n'
+        '[home]\n'
+        'r1 2016-01-31 =1m rent\n'
+        'r1 2016-01-10 +2w laundry\n'
+        'r1 2016-02-31 =1y impossible recurring\n'
+        'r1 9999-12-31 =1y recurs past 9999\n'
+        'r1 2016-01-31 =1q unknown unit\n'
+        'c5 constant\n'
+        'w wish\n'
+        'x unknown type\n'
+        't no date\n')
+
+
+def summary(items):
+    return [(item.linenum, item.type, item.category, item.desc, item.date, item.days,
+             item.wake, item.recur, item.recurrence) for item in items]
+
+
+class ParserEnginesTest(unittest.TestCase):
+    def setUp(self):
+        rastodo.setToday(datetime.date(2016, 1, 20))
+
+    def tearDown(self):
+        rastodo.setToday()
+
+    def test_engines_agree(self):
+        (items, errors) = rastodo.readTodoItems(io.StringIO(TODO))
+        self.assertEqual(errors, [2, 3, 5, 9, 10, 11, 14, 15])
+        for (name, parseLine) in sorted(rastodo.PARSER_ENGINES.items()):
+            (engineitems, engineerrors) = rastodo.readTodoItems(io.StringIO(TODO), parseLine)
+            self.assertEqual(summary(engineitems), summary(items), name)
+            self.assertEqual(engineerrors, errors, name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+#
+# Syntax errors are the same whether or not the filters skip the lines.
+#
+
+import os, sys, io, unittest
+import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+import rastodo
+
+TODO = ('t 2016-02-30 impossible date\n'
+        't 2099-02-30 impossible and far away\n'
+        'x unknown type\n'
+        '[skipped]\n'
+        't 2016-01-25 fine\n'
+        't 2016-13-01 bad month\n'
+        'r1 9999-12-31 =1y recurs past 9999\n'
+        'w   \n'
+        '[kept]\n'
+        'a3 2016-01-22 fine\n'
+        's2 2016-99-01 bad\n'
+        '\n'
+        'w wish\n')
+ERRORS = [1, 2, 3, 6, 7, 11]
+
+
+class PushdownErrorsTest(unittest.TestCase):
+    def setUp(self):
+        rastodo.setToday(datetime.date(2016, 1, 20))
+
+    def tearDown(self):
+        rastodo.setToday()
+
+    def pushdown(self, **options):
+        settings = rastodo.FilterSettings()
+        vars(settings).update(options)
+        return rastodo.FilterPushdown(settings)
+
+    def check(self, pushdown):
+        (items, errors) = rastodo.readTodoItems(io.StringIO(TODO), pushdown=pushdown)
+        self.assertEqual(errors, ERRORS)
+        (items, errors, linecount) = rastodo.readTodoBytes(TODO.encode(), pushdown=pushdown)
+        self.assertEqual(errors, ERRORS)
+
+    def test_unfiltered(self):
+        self.check(None)
+
+    def test_skipped_category(self):
+        self.check(self.pushdown(only_categories=['kept']))
+
+    def test_skipped_types(self):
+        self.check(self.pushdown(only_types='w'))
+
+    def test_filtered_dates(self):
+        self.check(self.pushdown(days_cutoff=0))
+
+
+if __name__ == '__main__':
+    unittest.main()
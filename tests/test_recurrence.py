@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+#
+# Recurrence arithmetic (addPeriod, occurrences) and --agenda.
+#
+
+import os, sys, subprocess, tempfile, unittest, itertools
+import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+import rastodo
+
+D = datetime.date
+
+
+class AddPeriodTest(unittest.TestCase):
+    def test_days_and_weeks(self):
+        self.assertEqual(rastodo.addPeriod(D(2016, 2, 27), 3, 'd'), D(2016, 3, 1))
+        self.assertEqual(rastodo.addPeriod(D(2016, 2, 27), 2, 'w', times=2), D(2016, 3, 26))
+
+    def test_month_end_clamps(self):
+        self.assertEqual(rastodo.addPeriod(D(2016, 1, 31), 1, 'm'), D(2016, 2, 29))
+        self.assertEqual(rastodo.addPeriod(D(2015, 1, 31), 1, 'm'), D(2015, 2, 28))
+        self.assertEqual(rastodo.addPeriod(D(2016, 1, 31), 1, 'm', times=2), D(2016, 3, 31))
+        self.assertEqual(rastodo.addPeriod(D(2016, 1, 31), 3, 'm'), D(2016, 4, 30))
+
+    def test_year_rollover_and_leap_day(self):
+        self.assertEqual(rastodo.addPeriod(D(2015, 12, 15), 1, 'm'), D(2016, 1, 15))
+        self.assertEqual(rastodo.addPeriod(D(2016, 2, 29), 1, 'y'), D(2017, 2, 28))
+        self.assertEqual(rastodo.addPeriod(D(2016, 2, 29), 4, 'y'), D(2020, 2, 29))
+
+    def test_out_of_range(self):
+        self.assertRaises(ValueError, rastodo.addPeriod, D(9999, 12, 1), 1, 'm')
+        self.assertRaises(ValueError, rastodo.addPeriod, D(9999, 12, 30), 2, 'd')
+
+
+class OccurrencesTest(unittest.TestCase):
+    def setUp(self):
+        rastodo.setToday(D(2016, 1, 20))
+
+    def tearDown(self):
+        rastodo.setToday()
+
+    def first(self, date, recurrence, start=None, count=4):
+        return list(itertools.islice(rastodo.occurrences(date, recurrence, start), count))
+
+    def test_counted_from_due_date(self):
+        self.assertEqual(self.first(D(2016, 1, 31), ('=', 1, 'm')),
+                         [D(2016, 1, 31), D(2016, 2, 29), D(2016, 3, 31), D(2016, 4, 30)])
+
+    def test_start_jumps_ahead(self):
+        self.assertEqual(self.first(D(2016, 2, 29), ('=', 1, 'y'), D(2026, 10, 16), 3),
+                         [D(2027, 2, 28), D(2028, 2, 29), D(2029, 2, 28)])
+        self.assertEqual(self.first(D(2016, 1, 1), ('=', 3, 'd'), D(2016, 1, 20), 2),
+                         [D(2016, 1, 22), D(2016, 1, 25)])
+
+    def test_start_matches_stepping(self):
+        for recurrence in (('=', 5, 'd'), ('=', 2, 'w'), ('=', 1, 'm'), ('+', 3, 'm'),
+                           ('=', 1, 'y'), ('+', 2, 'w')):
+            for start in (D(2016, 1, 1), D(2016, 3, 31), D(2019, 7, 4)):
+                stepped = [date for date in itertools.islice(
+                               rastodo.occurrences(D(2015, 8, 31), recurrence), 2000)
+                           if date >= start][:3]
+                self.assertEqual(self.first(D(2015, 8, 31), recurrence, start, 3), stepped,
+                                 (recurrence, start))
+
+    def test_overdue_plus_recurrence_counts_from_today(self):
+        self.assertEqual(self.first(D(2016, 1, 10), ('+', 2, 'w'), count=3),
+                         [D(2016, 1, 10), D(2016, 2, 3), D(2016, 2, 17)])
+
+    def test_zero_length_occurs_once(self):
+        self.assertEqual(self.first(D(2016, 2, 1), ('=', 0, 'd')), [D(2016, 2, 1)])
+
+    def test_stops_before_year_10000(self):
+        self.assertEqual(self.first(D(9999, 11, 1), ('=', 1, 'm')),
+                         [D(9999, 11, 1), D(9999, 12, 1)])
+
+
+class AgendaTest(unittest.TestCase):
+    TODO = ('c0 always\n'
+            '[bills]\n'
+            'r3 2016-01-31 =1m rent\n'
+            't  2016-02-10 taxes\n'
+            'w  whenever\n')
+
+    def agenda(self, *args):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'agenda.todo')
+            with open(path, 'w') as f:
+                f.write(self.TODO)
+            env = dict(os.environ, XDG_CACHE_HOME=tmpdir)
+            return subprocess.run([sys.executable, os.path.join(HERE, '..', 'rastodo.py'),
+                                   '-f', path, '--no-daemon', '--mono', '--as-of', '2016-01-20',
+                                   '--agenda', '45'] + list(args),
+                                  env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                  universal_newlines=True)
+
+    def test_all_without_where(self):
+        result = self.agenda('--all')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual([line for line in result.stdout.splitlines() if line.startswith('==')],
+                         ['== 2016-01-31 Sun ==', '== 2016-02-10 Wed ==', '== 2016-02-29 Mon =='])
+
+    def test_filters(self):
+        result = self.agenda('--only-types', 't')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.count('=='), 2)
+        self.assertIn('taxes', result.stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
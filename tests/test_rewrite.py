@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+#
+# Batch edits of the todo file (rewriteTodoFile, --bump-line, --bump-all-due).
+#
+
+import os, sys, unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+import rastodo
+from todotest import TodoFileTest
+
+
+class RewriteTest(TodoFileTest):
+    def files(self):
+        return sorted(name for name in os.listdir(self.tmpdir.name) if name != 'cache')
+
+    def test_bump_in_place(self):
+        self.write(b'w a\r\nr1 2016-01-31 =1m rent\r\nw b')
+        inode = os.stat(self.path).st_ino
+        changes = rastodo.rewriteTodoFile(self.path, {2: ('bump', None)})
+        self.assertEqual(changes, [(2, 'r1 2016-01-31 =1m rent\r\n',
+                                    'r1 2016-02-29 =1m rent\r\n')])
+        self.assertEqual(self.read(), b'w a\r\nr1 2016-02-29 =1m rent\r\nw b')
+        self.assertEqual(os.stat(self.path).st_ino, inode)
+
+    def test_rewrite_replaces_the_file(self):
+        self.write(b'w a\nw b\n')
+        os.chmod(self.path, 0o640)
+        inode = os.stat(self.path).st_ino
+        rastodo.rewriteTodoFile(self.path, {1: ('replace', 'w longer\n'), 2: ('delete', None)})
+        self.assertEqual(self.read(), b'w longer\n')
+        self.assertNotEqual(os.stat(self.path).st_ino, inode)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o640)
+        self.assertEqual(self.files(), ['test.todo'])  # no temporary file left
+
+    def test_failed_edit_leaves_the_file(self):
+        self.write(b'w a\nr1 2016-01-10 +1w b\nw c\n')
+        for edits in ({1: ('bump', None)}, {2: ('bump', None), 5: ('delete', None)},
+                      {0: ('replace', 'w x\n')}):
+            self.assertRaises(ValueError, rastodo.rewriteTodoFile, self.path, edits)
+            self.assertEqual(self.read(), b'w a\nr1 2016-01-10 +1w b\nw c\n')
+            self.assertEqual(self.files(), ['test.todo'])
+
+    def test_insert_at_end_without_newline(self):
+        self.write(b'w a\nw b')
+        changes = rastodo.rewriteTodoFile(self.path, {3: ('insert', 'w c\n')})
+        self.assertEqual(changes, [(3, None, 'w c\n')])
+        self.assertEqual(self.read(), b'w a\nw b\nw c\n')
+
+    def test_insert_before_last_line(self):
+        self.write(b'w a\nw b')
+        rastodo.rewriteTodoFile(self.path, {2: ('insert', 'w c\n')})
+        self.assertEqual(self.read(), b'w a\nw c\nw b')
+
+    def test_delete_last_line_without_newline(self):
+        self.write(b'w a\nw b')
+        changes = rastodo.rewriteTodoFile(self.path, {2: ('delete', None)})
+        self.assertEqual(changes, [(2, 'w b', None)])
+        self.assertEqual(self.read(), b'w a\n')
+
+    def test_crlf_kept(self):
+        self.write(b'w a\r\nr2 2016-01-01 +3d b\r\n[cat]\r\nr1 2016-01-19 =1w c\r\n')
+        changes = rastodo.rewriteTodoFile(self.path, {1: ('replace', 'w longer a\r\n')},
+                                          bumpdue=True)
+        self.assertEqual([num for (num, old, new) in changes], [1, 2, 4])
+        self.assertEqual(self.read(), b'w longer a\r\nr2 2016-01-23 +3d b\r\n[cat]\r\n'
+                                      b'r1 2016-01-26 =1w c\r\n')
+
+    def test_symlink_kept(self):
+        self.write(b'w a\n')
+        link = os.path.join(self.tmpdir.name, 'link.todo')
+        os.symlink(self.path, link)
+        rastodo.rewriteTodoFile(link, {1: ('replace', 'w bb\n')})
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(self.read(), b'w bb\n')
+
+    def test_no_edits(self):
+        self.write(b'w a\n')
+        self.assertEqual(rastodo.rewriteTodoFile(self.path), [])
+        self.assertEqual(self.read(), b'w a\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
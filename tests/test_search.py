@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+#
+# --search through the search index gives the items a full read does.
+#
+
+import os, sys, unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+import rastodo
+from todotest import TodoFileTest
+
+TODO = ['w week 2 lab report',
+        '[school]',
+        't 2016-01-25 lab coat',
+        'r1 2016-01-31 =1m pay the lab fees',
+        '# lab notes',
+        'x lab bad line',
+        '[home]',
+        'w label maker',
+        'a3 2016-01-22 lab',
+        's2 2016-01-10 tidy the shed']
+
+
+def summary(items):
+    return [(item.linenum, item.category, item.type, item.desc) for item in items]
+
+
+class SearchTest(TodoFileTest):
+    def pushdown(self, text):
+        settings = rastodo.FilterSettings()
+        settings.show_all = True
+        settings.search = rastodo.searchWords(text)
+        settings.where = rastodo.searchWhere(settings.search)
+        return rastodo.FilterPushdown(settings)
+
+    def check(self, ending, text='lab'):
+        self.write((ending.join(TODO) + ending).encode())
+        (expected, experrors) = rastodo.loadTodoFile(self.path, usecache=False,
+                                                      pushdown=self.pushdown(text))
+        self.assertTrue(expected)
+        for run in range(2):  # building the index, then using it
+            (items, errors) = rastodo.loadTodoFile(self.path, pushdown=self.pushdown(text))
+            self.assertEqual(summary(items), summary(expected), (ending, run))
+            self.assertEqual(errors, experrors)
+        return expected
+
+    def test_lf(self):
+        self.assertEqual([item.desc for item in self.check('\n')],
+                         ['week 2 lab report', 'lab coat', 'pay the lab fees', 'label maker',
+                          'lab'])
+
+    def test_crlf(self):
+        self.check('\r\n')
+
+    def test_cr(self):
+        self.check('\r')
+
+    def test_journal(self):
+        self.check('\r\n')
+        rastodo.editTodoFile(self.path, {8: ('replace', 'w lab bench\r\n')}, journal=True)
+        (expected, errors) = rastodo.loadTodoFile(self.path, usecache=False,
+                                                  pushdown=self.pushdown('lab'))
+        (items, errors) = rastodo.loadTodoFile(self.path, pushdown=self.pushdown('lab'))
+        self.assertEqual(summary(items), summary(expected))
+        self.assertIn('lab bench', [item.desc for item in items])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+#
+# The --where expression parser and filter compiler.
+#
+
+import os, sys, io, unittest
+import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+import rastodo
+
+TODO = ('w wish list\n'
+        't 2016-01-25 dentist\n'
+        '[home]\n'
+        'a3 2016-01-22 "quoted" anniversary\n'
+        'r1 2016-01-31 =1m rent\n'
+        '[work]\n'
+        's2 2016-01-10 past due report\n'
+        'w new laptop\n')
+TODAY = datetime.date(2016, 1, 20).toordinal()
+CUTOFF = 30
+OFFSET = 100
+
+
+class WhereTest(unittest.TestCase):
+    def setUp(self):
+        rastodo.setToday(datetime.date(2016, 1, 20))
+        (self.items, errors) = rastodo.readTodoItems(io.StringIO(TODO))
+        self.assertEqual(errors, [])
+
+    def tearDown(self):
+        rastodo.setToday()
+
+    def lines(self, text):
+        '''Returns the line numbers of the items matching text, checking
+           that matching items and cache records agree'''
+        tree = rastodo.parseWhere(text)
+        match = rastodo.compileFilter(tree, today=TODAY, cutoff=CUTOFF)
+        matchRecord = rastodo.compileFilter(tree, record=True, today=TODAY, cutoff=CUTOFF)
+        ret = [item.linenum for item in self.items if match(item)]
+        records = [item.linenum for item in self.items
+                   if matchRecord(rastodo.itemRecord(item, OFFSET), OFFSET)]
+        self.assertEqual(records, ret, text)
+        return ret
+
+    def test_fields(self):
+        self.assertEqual(self.lines('type == "w"'), [1, 8])
+        self.assertEqual(self.lines('cat == "home"'), [4, 5])
+        self.assertEqual(self.lines('desc == "rent"'), [5])
+        self.assertEqual(self.lines('line >= 5'), [5, 7, 8])
+        self.assertEqual(self.lines('date < 2016-01-25'), [4, 7])
+        self.assertEqual(self.lines('wake == 2'), [7])
+
+    def test_days(self):
+        self.assertEqual(self.lines('days < 0'), [7])
+        self.assertEqual(self.lines('days <= 5'), [2, 4, 7])
+        self.assertEqual(self.lines('days == 30'), [1, 8])  # wishlist is --days away
+
+    def test_none(self):
+        self.assertEqual(self.lines('cat == none'), [1, 2])
+        self.assertEqual(self.lines('date != none'), [2, 4, 5, 7])
+        # none is neither less nor greater than anything
+        self.assertEqual(self.lines('date < 2100-01-01 or date >= 2100-01-01'), [2, 4, 5, 7])
+        self.assertEqual(self.lines('wake > 0'), [4, 5, 7])
+
+    def test_in(self):
+        self.assertEqual(self.lines('type in "ta"'), [2, 4])
+        self.assertEqual(self.lines('type not in "tw"'), [4, 5, 7])
+        self.assertEqual(self.lines('cat in "home,work"'), [4, 5, 7, 8])
+        self.assertEqual(self.lines('cat in ("work", none)'), [1, 2, 7, 8])
+        self.assertEqual(self.lines('line not in (1, 2, 3, 4)'), [5, 7, 8])
+
+    def test_regex(self):
+        self.assertEqual(self.lines('desc ~ "^[a-r]"'), [2, 5, 7, 8])
+        self.assertEqual(self.lines('cat ~ "o"'), [4, 5, 7, 8])
+        self.assertEqual(self.lines('cat !~ "o"'), [1, 2])
+        self.assertEqual(self.lines('desc ~ "\\"quoted\\""'), [4])
+        self.assertEqual(self.lines("desc ~ 'rent'"), [5])
+
+    def test_fields_compared(self):
+        self.assertEqual(self.lines('days < wake'), [4, 7])
+        self.assertEqual(self.lines('type == "w" and cat != none'), [8])
+
+    def test_logic(self):
+        self.assertEqual(self.lines('type == "w" or days < 3'), [1, 4, 7, 8])
+        self.assertEqual(self.lines('not type == "w"'), [2, 4, 5, 7])
+        self.assertEqual(self.lines('not (type == "w" or cat == "home")'), [2, 7])
+        self.assertEqual(self.lines('(type == "w" or type == "t") and line > 1'), [2, 8])
+        # and binds tighter than or
+        self.assertEqual(self.lines('type == "w" or type == "t" and line > 1'), [1, 2, 8])
+
+    def test_errors(self):
+        for text in ('', 'type', 'type ==', 'type = "w"', 'bogus == 1', 'days == "1"',
+                     'cat < none', 'days ~ "1"', 'desc ~ "("', 'date == 2016-02-30',
+                     '(type == "w"', 'type == "w")', 'type == "w" and', 'type not "w"',
+                     'line in (1 2)', 'line in 1', 'cat in ("a", 1)', 'type == cat and',
+                     'days == date', 'type == "w" $'):
+            self.assertRaises(ValueError, rastodo.parseWhere, text)
+
+
+if __name__ == '__main__':
+    unittest.main()
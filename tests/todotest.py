@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+#
+# Shared fixture for tests that work on a todo file.
+#
+
+import os, sys, tempfile, unittest
+import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+import rastodo
+
+
+class TodoFileTest(unittest.TestCase):
+    '''A test with self.path, a todo file (not yet written) in a
+       temporary directory that also holds the cache, and TODAY fixed
+       at 2016-01-20'''
+    TODAY = datetime.date(2016, 1, 20)
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cachedir = rastodo.settings['paths']['cachedir']
+        rastodo.settings['paths']['cachedir'] = os.path.join(self.tmpdir.name, 'cache')
+        rastodo.setToday(self.TODAY)
+        self.path = os.path.join(self.tmpdir.name, 'test.todo')
+
+    def tearDown(self):
+        rastodo.setToday()
+        rastodo.settings['paths']['cachedir'] = self.cachedir
+        self.tmpdir.cleanup()
+
+    def write(self, data, path=None):
+        with open(path or self.path, 'wb') as f:
+            f.write(data)
+
+    def read(self, path=None):
+        with open(path or self.path, 'rb') as f:
+            return f.read()